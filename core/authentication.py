@@ -0,0 +1,94 @@
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from django_redis.exceptions import ConnectionInterrupted
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import ClaimsUser
+from . import roles
+
+ROLE_CLAIMS = ('groups', 'organizations', 'roles_version')
+
+
+def revoked_key(jti):
+    return f'revoked-token:{jti}'
+
+
+def add_role_claims(token, user):
+    """Embed the user's groups and organization roles in ``token``.
+
+    The claims version is read before the roles, so a membership change that
+    commits in between outdates the token instead of being missed.
+    """
+    token['roles_version'] = roles.claims_version(user.pk)
+    token['roles_generation'] = roles.current_generation()
+    resolved = roles.resolve(user)
+    token['email'] = user.email
+    token['groups'] = sorted(resolved.groups)
+    token['organizations'] = {str(org_id): role for org_id, role in resolved.organizations.items()}
+    return token
+
+
+def revoke(token):
+    """Reject ``token`` until it expires."""
+    remaining = token['exp'] - datetime.now(timezone.utc).timestamp()
+    if remaining > 0:
+        cache.set(revoked_key(token[api_settings.JTI_CLAIM]), True, int(remaining) + 1)
+
+
+def _token_state(token, *keys):
+    """Reject ``token`` if it was revoked and return the cached values of ``keys``, in one round trip."""
+    revoked = revoked_key(token.get(api_settings.JTI_CLAIM))
+    try:
+        state = cache.get_many([revoked, *keys])
+    except ConnectionInterrupted:
+        # Fail closed: without the cache a revoked token cannot be told apart.
+        raise AuthenticationFailed(_("Token state could not be verified"), code="token_state_unavailable")
+    if state.get(revoked):
+        raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+    return [state.get(key) for key in keys]
+
+
+def check_not_revoked(token):
+    """Reject a revoked ``token``, e.g. a refresh token that was logged out."""
+    _token_state(token)
+
+
+class StatelessRoleAuthentication(authentication.JWTAuthentication):
+    """Authenticate from the token's role claims alone, without touching the database.
+
+    One cache round trip checks that the token was not revoked and that its
+    role claims are still current: every membership change bumps the user's
+    claims version and every group change bumps the global generation, which
+    sends the client back to log in.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token or \
+                any(claim not in validated_token for claim in ROLE_CLAIMS):
+            raise InvalidToken(_("Token contains no role claims"))
+        version, generation = _token_state(
+            validated_token,
+            roles.claims_version_key(validated_token[api_settings.USER_ID_CLAIM]),
+            roles.GENERATION_KEY,
+        )
+        if validated_token['roles_version'] != version or \
+                validated_token.get('roles_generation') != generation:
+            raise AuthenticationFailed(_("Token role claims are out of date"), code="token_outdated")
+
+        user = ClaimsUser(
+            id=validated_token[api_settings.USER_ID_CLAIM],
+            username=validated_token.get('username', ''),
+            email=validated_token.get('email', ''),
+        )
+        user._state.adding = False
+        user._state.db = DEFAULT_DB_ALIAS
+        user.claimed_roles = roles.ResolvedRoles(
+            validated_token['groups'],
+            {int(org_id): role for org_id, role in validated_token['organizations'].items()},
+        )
+        return user
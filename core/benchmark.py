@@ -0,0 +1,311 @@
+import heapq
+import random
+import time
+from collections import deque
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from rq.job import JobStatus
+
+from .models import Cluster, Deployment
+from . import capacity, lifecycle, queues, scheduler
+
+QUEUE_ORDER = ('high', 'default', 'medium', 'low')
+
+
+class InMemoryJob:
+    def __init__(self, job_id, func, args, status):
+        self.id = job_id
+        self.func = func
+        self.args = args
+        self.status = status
+
+    def get_status(self):
+        return self.status
+
+
+class InMemoryQueue:
+    """The subset of the RQ queue API the scheduler uses, kept in process memory."""
+
+    def __init__(self, name, broker):
+        self.name = name
+        self.broker = broker
+        self.jobs = deque()
+
+    @property
+    def count(self):
+        return len(self.jobs)
+
+    def fetch_job(self, job_id):
+        return self.broker.jobs.get(job_id)
+
+    def enqueue(self, func, *args, job_id=None, **kwargs):
+        job = self.broker.register(job_id, func, args, JobStatus.QUEUED)
+        self.jobs.append(job)
+        return job
+
+    def enqueue_in(self, time_delta, func, *args, job_id=None, **kwargs):
+        job = self.broker.register(job_id, func, args, JobStatus.SCHEDULED)
+        heapq.heappush(
+            self.broker.scheduled,
+            (self.broker.clock + time_delta.total_seconds(), next(self.broker.sequence), self, job),
+        )
+        return job
+
+
+class InMemoryBroker:
+    """Queue backend (see ``core.queues``) kept in process memory, with a virtual clock for delayed jobs.
+
+    Delayed jobs (``enqueue_in``) wait until ``advance`` moves the clock past
+    their due time.
+    """
+
+    in_process = True
+
+    def __init__(self):
+        self.queues = {}
+        self.jobs = {}
+        self.scheduled = []
+        self.clock = 0.0
+        self.sequence = iter(range(1 << 62))
+
+    def get_queue(self, name='default', *args, **kwargs):
+        if name not in self.queues:
+            self.queues[name] = InMemoryQueue(name, self)
+        return self.queues[name]
+
+    def register(self, job_id, func, args, status):
+        job = InMemoryJob(job_id or f'job-{next(self.sequence)}', func, args, status)
+        self.jobs[job.id] = job
+        return job
+
+    def enqueue_many(self, jobs):
+        """Like ``queues.RQBackend.enqueue_many``: skips ids that are already waiting."""
+        for queue_name, func, args, job_id in jobs:
+            waiting = self.jobs.get(job_id) if job_id else None
+            if waiting is None or waiting.status not in queues.WAITING:
+                self.get_queue(queue_name).enqueue(func, *args, job_id=job_id)
+
+    def advance(self, seconds):
+        """Move the clock forward, queueing the delayed jobs that became due."""
+        self.clock += seconds
+        while self.scheduled and self.scheduled[0][0] <= self.clock:
+            _, _, queue, job = heapq.heappop(self.scheduled)
+            job.status = JobStatus.QUEUED
+            queue.jobs.append(job)
+
+    def run_next(self):
+        """Run the next queued job, highest-priority queue first; None when all are empty."""
+        names = sorted(self.queues, key=lambda n: QUEUE_ORDER.index(n) if n in QUEUE_ORDER else len(QUEUE_ORDER))
+        for name in names:
+            queue = self.queues[name]
+            if queue.jobs:
+                job = queue.jobs.popleft()
+                job.status = JobStatus.STARTED
+                job.func(*job.args)
+                job.status = JobStatus.FINISHED
+                return job
+        return None
+
+
+def in_memory_queues():
+    """Route the scheduler jobs of the current context to a fresh ``InMemoryBroker``."""
+    return queues.using(InMemoryBroker())
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Workload:
+    """Synthetic clusters and deployments for a benchmark run.
+
+    ``priority_mix`` maps priorities to relative weights, ``dependency_rate``
+    is the mean number of dependencies per deployment (edges always point to
+    earlier deployments, so the graph is a DAG) and ``unplaced_rate`` is the
+    share of deployments submitted without a cluster.
+    """
+
+    def __init__(self, clusters=100, deployments=1000, priority_mix=None, dependency_rate=0.0,
+                 dependency_window=50, unplaced_rate=0.0, gpu_rate=0.3, seed=0):
+        self.clusters = clusters
+        self.deployments = deployments
+        self.priority_mix = priority_mix or {'HIGH': 1, 'MEDIUM': 3, 'LOW': 6}
+        self.dependency_rate = dependency_rate
+        self.dependency_window = dependency_window
+        self.unplaced_rate = unplaced_rate
+        self.gpu_rate = gpu_rate
+        self.random = random.Random(seed)
+
+    def create(self, user):
+        rnd = self.random
+        clusters = Cluster.objects.bulk_create([
+            Cluster(
+                name=f'bench-{i}',
+                total_ram=rnd.choice((64, 128, 256, 512)),
+                total_cpu=rnd.choice((16, 32, 64, 128)),
+                total_gpu=rnd.choice((0, 0, 4, 8, 16)),
+                created_by=user,
+            )
+            for i in range(self.clusters)
+        ])
+        if not connection.features.can_return_rows_from_bulk_insert:
+            clusters = list(Cluster.objects.filter(created_by=user).order_by('id'))
+        capacity.invalidate([cluster.id for cluster in clusters])
+
+        priorities = list(self.priority_mix)
+        weights = [self.priority_mix[p] for p in priorities]
+        now = timezone.now()
+        rows = []
+        gpu_clusters = [c for c in clusters if c.total_gpu] or clusters
+        for _ in range(self.deployments):
+            gpu = rnd.randint(1, 2) if rnd.random() < self.gpu_rate else 0
+            if rnd.random() < self.unplaced_rate:
+                cluster = None
+            else:
+                cluster = rnd.choice(gpu_clusters if gpu else clusters)
+            priority = rnd.choices(priorities, weights)[0]
+            rows.append(Deployment(
+                docker_image_path='https://localhost/benchmark',
+                required_ram=rnd.randint(1, 32),
+                required_cpu=rnd.randint(1, 8),
+                required_gpu=gpu,
+                priority=priority,
+                priority_rank=Deployment.PRIORITY_RANKS[priority],
+                cluster=cluster,
+                created_by=user,
+                pending_since=now,
+            ))
+
+        edges = []
+        for index in range(1, len(rows)):
+            count = int(self.dependency_rate) + (rnd.random() < self.dependency_rate % 1)
+            lower = max(0, index - self.dependency_window)
+            for parent in set(rnd.randrange(lower, index) for _ in range(count)):
+                edges.append((index, parent))
+                rows[index].unmet_dependencies += 1
+
+        deployments = Deployment.objects.bulk_create(rows, batch_size=2000)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            deployments = list(Deployment.objects.filter(created_by=user).order_by('id'))
+        Deployment.dependencies.through.objects.bulk_create([
+            Deployment.dependencies.through(
+                from_deployment_id=deployments[child].id,
+                to_deployment_id=deployments[parent].id,
+            )
+            for child, parent in edges
+        ], batch_size=5000)
+        return clusters, deployments
+
+
+def _utilization():
+    totals = Cluster.objects.values_list('total_ram', 'total_cpu', 'total_gpu', 'allocated_ram', 'allocated_cpu', 'allocated_gpu')
+    sums = [sum(column) for column in zip(*totals)] or [0] * 6
+    return {
+        name: (sums[i + 3] / sums[i]) if sums[i] else 0.0
+        for i, name in enumerate(('ram', 'cpu', 'gpu'))
+    }
+
+
+def run_benchmark(workload, mode=scheduler.EVENT_MODE, complete_fraction=0.5, round_seconds=60,
+                  max_rounds=1000, keep=False):
+    """Submit ``workload`` and drive the scheduler until it settles.
+
+    All jobs run in-process against an ``InMemoryBroker``. After the queues
+    drain, ``complete_fraction`` of the RUNNING deployments are completed,
+    which frees capacity and unblocks dependents, and the virtual clock moves
+    on by ``round_seconds`` so that due retries run in the next round; those
+    completions stand in for external events and are not measured.
+    Unless ``keep`` is set, everything runs in one transaction that is rolled
+    back at the end.
+
+    Decisions are admissions (PENDING to RUNNING). Latency is measured in
+    scheduler time, i.e. the time spent inside scheduler jobs between
+    submission and admission, so harness overhead does not count.
+    """
+    rnd = random.Random(0)
+    counter = QueryCounter()
+    latencies = []
+    utilization = []
+    scheduler_seconds = 0.0
+    jobs = 0
+
+    with transaction.atomic(), scheduler.using_mode(mode), in_memory_queues() as broker:
+        user = User.objects.create(username=f'benchmark-{time.time_ns()}')
+        workload.create(user)
+        owned = Deployment.objects.filter(created_by=user)
+        admitted = set()
+
+        if mode == scheduler.EVENT_MODE:
+            scheduler.wake_placement()
+            for cluster_id in owned.exclude(cluster__isnull=True).values_list('cluster_id', flat=True).distinct():
+                scheduler.wake_cluster(cluster_id)
+        else:
+            for deployment in owned:
+                scheduler.submit(deployment)
+
+        for _ in range(max_rounds):
+            while True:
+                started = timezone.now()
+                tick = time.perf_counter()
+                with connection.execute_wrapper(counter):
+                    job = broker.run_next()
+                if job is None:
+                    break
+                scheduler_seconds += time.perf_counter() - tick
+                jobs += 1
+                for deployment_id in owned.filter(
+                    status=Deployment.Status.RUNNING, updated_at__gte=started
+                ).values_list('id', flat=True):
+                    if deployment_id not in admitted:
+                        admitted.add(deployment_id)
+                        latencies.append(scheduler_seconds)
+
+            utilization.append(_utilization())
+            running = list(owned.filter(status=Deployment.Status.RUNNING))
+            if not running and not broker.scheduled:
+                break
+            for deployment in rnd.sample(running, int(len(running) * complete_fraction) or len(running)):
+                lifecycle.complete(deployment)
+            broker.advance(round_seconds)
+
+        pending = owned.filter(status=Deployment.Status.PENDING).count()
+        if not keep:
+            transaction.set_rollback(True)
+
+    decisions = len(admitted)
+    return {
+        'mode': mode,
+        'clusters': workload.clusters,
+        'deployments': workload.deployments,
+        'decisions': decisions,
+        'left_pending': pending,
+        'jobs': jobs,
+        'scheduler_seconds': round(scheduler_seconds, 4),
+        'decisions_per_second': round(decisions / scheduler_seconds, 1) if scheduler_seconds else None,
+        'queries': counter.count,
+        'queries_per_decision': round(counter.count / decisions, 2) if decisions else None,
+        'admission_latency_p50_ms': round(_percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        'admission_latency_p99_ms': round(_percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'utilization': {
+            name: round(sum(u[name] for u in utilization) / len(utilization), 4) if utilization else 0.0
+            for name in ('ram', 'cpu', 'gpu')
+        },
+        'peak_utilization': {
+            name: round(max((u[name] for u in utilization), default=0.0), 4)
+            for name in ('ram', 'cpu', 'gpu')
+        },
+    }
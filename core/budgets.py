@@ -0,0 +1,263 @@
+import itertools
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from .benchmark import QueryCounter, Workload, in_memory_queues
+from .models import Cluster, Deployment, DeploymentGroup, Organization
+from .serializers import CustomTokenObtainPairSerializer
+from . import scheduler
+
+# Under the WSGI test client every async read (``views.AsyncReadMixin``) runs
+# on an event loop of its own, so it builds and closes a ``redis.asyncio``
+# client and connection inside the measured window. That cost depends on the
+# transport (an in-process fake is far cheaper than TCP), so those cases get
+# this much on top of their own memory budget.
+ASYNC_CLIENT_KIB = 256
+
+# Upper bounds per case: queries, and peak traced memory in KiB while it ran.
+# Query bounds are exact on purpose; raise one only with the change that
+# justifies it, and keep it independent of fixture size.
+BUDGETS = {
+    'register': {'queries': 7, 'kib': 256},
+    'login': {'queries': 3, 'kib': 256},
+    'logout': {'queries': 1, 'kib': 256},
+    'profile': {'queries': 1, 'kib': 256},
+    'create-organization': {'queries': 2, 'kib': 256},
+    'get-invite-code': {'queries': 3, 'kib': 256},
+    'join-organization': {'queries': 4, 'kib': 256},
+    'organization-quota': {'queries': 6, 'kib': 256},
+    'cluster-list': {'queries': 4, 'kib': 640 + ASYNC_CLIENT_KIB},
+    'cluster-create': {'queries': 4, 'kib': 256},
+    'cluster-detail': {'queries': 1, 'kib': 256 + ASYNC_CLIENT_KIB},
+    'deployment-list': {'queries': 5, 'kib': 1024 + ASYNC_CLIENT_KIB},
+    'deployment-list-filtered': {'queries': 5, 'kib': 1152 + ASYNC_CLIENT_KIB},
+    'deployment-create': {'queries': 12, 'kib': 256},
+    'deployment-bulk-create': {'queries': 12, 'kib': 2944},
+    'deployment-bulk-create-group': {'queries': 10, 'kib': 1792},
+    'deployment-detail': {'queries': 3, 'kib': 256 + ASYNC_CLIENT_KIB},
+    'deployment-complete': {'queries': 12, 'kib': 256},
+    'deployment-fail': {'queries': 10, 'kib': 256},
+    'deployment-cancel': {'queries': 10, 'kib': 256},
+    'export': {'queries': 4, 'kib': 256},
+    'process_deployment': {'queries': 7, 'kib': 256},
+    'process_deployment-blocked': {'queries': 2, 'kib': 256},
+    'process_deployment-preempt': {'queries': 13, 'kib': 256},
+    'process_deployment-gang': {'queries': 8, 'kib': 256},
+}
+# Endpoints in core.urls that are deliberately not measured.
+SKIPPED = {
+    'events': "long-lived server-sent event stream; its setup cost is covered by the detail reads",
+}
+BULK_SIZE = 100
+GANG_SIZE = 8
+PASSWORD = 'budget-password'
+
+
+class Fixture:
+    """Users, tokens and a scratch cluster on top of a synthetic ``Workload``."""
+
+    def __init__(self, workload):
+        self.admin = self._user('budget-admin', 'Admin')
+        self.developer = self._user('budget-developer', 'Developer')
+        self.clusters, self.deployments = workload.create(self.admin)
+        self.scratch = Cluster.objects.create(
+            name='budget-scratch', total_ram=10 ** 6, total_cpu=10 ** 6, total_gpu=10 ** 6, created_by=self.admin
+        )
+        self.organization = Organization.objects.create(name='budget-org', created_by=self.admin)
+        self.names = (f'budget-{n}' for n in itertools.count())
+
+    @staticmethod
+    def _user(username, group):
+        user = User.objects.create_user(username=f'{username}-{time.time_ns()}', password=PASSWORD)
+        user.groups.add(Group.objects.get(name=group))
+        return user
+
+    def client(self, user):
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        return Client(headers={'Authorization': f'Bearer {token}'})
+
+    def deployment(self, cluster=None, **kwargs):
+        return Deployment.objects.create(**{
+            'docker_image_path': 'https://localhost/budget', 'required_ram': 1, 'required_cpu': 1,
+            'required_gpu': 0, 'cluster': cluster or self.scratch, 'created_by': self.developer, **kwargs
+        })
+
+    def running(self):
+        deployment = self.deployment()
+        deployment.allocate()
+        self.deployment().dependencies.add(deployment)
+        return deployment
+
+
+def _request(client, method, path, data=None):
+    return lambda: getattr(client, method)(path, data, content_type='application/json')
+
+
+def _transition(name):
+    def case(f):
+        return _request(f.client(f.developer), 'post', reverse(name, args=[f.running().id]))
+    return case
+
+
+def _gang(f):
+    group = DeploymentGroup.objects.create(name=next(f.names), created_by=f.developer)
+    members = [f.deployment(group=group) for _ in range(GANG_SIZE)]
+    return lambda: scheduler.process_deployment(members[-1].id)
+
+
+def _process(f, blocked=False, preempt=False):
+    if preempt:
+        cluster = Cluster.objects.create(
+            name=next(f.names), total_ram=8, total_cpu=8, total_gpu=0, created_by=f.admin
+        )
+        victim = f.deployment(cluster, required_ram=8, required_cpu=8, priority='LOW')
+        victim.allocate()
+        deployment = f.deployment(cluster, required_ram=8, required_cpu=8, priority='HIGH')
+    else:
+        deployment = f.deployment()
+    if blocked:
+        deployment.dependencies.add(f.deployment())
+    return lambda: scheduler.process_deployment(deployment.id)
+
+
+# Case name -> function of the fixture returning the call to measure; the
+# setup in the function itself is not measured.
+CASES = {
+    'register': lambda f: _request(Client(), 'post', reverse('register'), {
+        'username': next(f.names), 'password': PASSWORD, 'role': 'DEVELOPER',
+    }),
+    'login': lambda f: _request(Client(), 'post', reverse('login'), {
+        'username': f.developer.username, 'password': PASSWORD,
+    }),
+    'logout': lambda f: _request(f.client(f.developer), 'post', reverse('logout'), {
+        'refresh': str(CustomTokenObtainPairSerializer.get_token(f.developer)),
+    }),
+    'profile': lambda f: _request(f.client(f.developer), 'get', reverse('profile')),
+    'create-organization': lambda f: _request(
+        f.client(f.developer), 'post', reverse('create-organization'), {'name': next(f.names)}
+    ),
+    'get-invite-code': lambda f: _request(
+        f.client(f.admin), 'get', reverse('get-invite-code', args=[f.organization.id])
+    ),
+    'join-organization': lambda f: _request(f.client(f.developer), 'post', reverse('join-organization'), {
+        'invite_code': str(Organization.objects.create(name=next(f.names), created_by=f.admin).invite_code),
+    }),
+    'organization-quota': lambda f: _request(
+        f.client(f.admin), 'patch', reverse('organization-quota', args=[f.organization.id]), {'quota_gpu': 8}
+    ),
+    'cluster-list': lambda f: _request(f.client(f.developer), 'get', reverse('cluster-list-create')),
+    'cluster-create': lambda f: _request(f.client(f.admin), 'post', reverse('cluster-list-create'), {
+        'name': next(f.names), 'total_ram': 64, 'total_cpu': 16, 'total_gpu': 4,
+    }),
+    'cluster-detail': lambda f: _request(
+        f.client(f.developer), 'get', reverse('cluster-detail', args=[f.clusters[-1].id])
+    ),
+    'deployment-list': lambda f: _request(f.client(f.developer), 'get', reverse('deployment-list-create')),
+    'deployment-list-filtered': lambda f: _request(
+        f.client(f.developer), 'get', reverse('deployment-list-create') + '?status=PENDING&priority=HIGH,LOW'
+    ),
+    'deployment-create': lambda f: _request(f.client(f.developer), 'post', reverse('deployment-list-create'), {
+        'docker_image_path': 'https://localhost/budget', 'required_ram': 1, 'required_cpu': 1,
+        'required_gpu': 0, 'cluster': f.scratch.id, 'dependencies': [f.deployments[-1].id],
+    }),
+    'deployment-bulk-create': lambda f: _request(f.client(f.developer), 'post', reverse('deployment-bulk-create'), [
+        {
+            'docker_image_path': 'https://localhost/budget', 'required_ram': 1, 'required_cpu': 1,
+            'required_gpu': 0, 'cluster': f.scratch.id, 'dependencies': [f.deployments[-1 - i % len(f.deployments)].id],
+            **({'depends_on': [i - 1]} if i else {}),
+        }
+        for i in range(BULK_SIZE)
+    ]),
+    'deployment-bulk-create-group': lambda f: _request(
+        f.client(f.developer), 'post', reverse('deployment-bulk-create'), {
+            'group': next(f.names),
+            'deployments': [
+                {
+                    'docker_image_path': 'https://localhost/budget', 'required_ram': 1, 'required_cpu': 1,
+                    'required_gpu': 0, 'cluster': f.scratch.id,
+                }
+                for _ in range(BULK_SIZE)
+            ],
+        }
+    ),
+    'deployment-detail': lambda f: _request(
+        f.client(f.developer), 'get', reverse('deployment-detail', args=[f.deployments[-1].id])
+    ),
+    'deployment-complete': _transition('deployment-complete'),
+    'deployment-fail': _transition('deployment-fail'),
+    'deployment-cancel': _transition('deployment-cancel'),
+    'export': lambda f: _request(
+        f.client(f.admin), 'get', reverse('export') + f'?include=deployments&cluster={f.clusters[0].id}'
+    ),
+    'process_deployment': lambda f: _process(f),
+    'process_deployment-blocked': lambda f: _process(f, blocked=True),
+    'process_deployment-preempt': lambda f: _process(f, preempt=True),
+    'process_deployment-gang': _gang,
+}
+
+
+def _measure(call):
+    counter = QueryCounter()
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(counter):
+            result = call()
+            if getattr(result, 'streaming', False):
+                b''.join(result.streaming_content)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, {
+        'queries': counter.count,
+        'peak_kib': round(peak / 1024, 1),
+        'ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def run_budgets(clusters=1000, deployments=50000, dependency_rate=0.5, cases=None, seed=0):
+    """Measure every case against ``BUDGETS`` on a synthetic fixture and return a report.
+
+    Each case runs twice and the second, warm run is measured, so one-off
+    cache fills do not count. Everything runs in one transaction that is
+    rolled back, and scheduler jobs go to an in-memory queue.
+    """
+    report = {'clusters': clusters, 'deployments': deployments, 'cases': {}, 'skipped': SKIPPED, 'failures': []}
+    hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+    with transaction.atomic(), override_settings(ALLOWED_HOSTS=hosts), in_memory_queues():
+        fixture = Fixture(Workload(clusters, deployments, dependency_rate=dependency_rate, seed=seed))
+        for name in cases or CASES:
+            CASES[name](fixture)()
+            result, measured = _measure(CASES[name](fixture))
+            status = getattr(result, 'status_code', None)
+            match = getattr(result, 'resolver_match', None)
+            budget = BUDGETS[name]
+            measured.update(
+                status=status, url=match.url_name if match else None,
+                budget_queries=budget['queries'], budget_kib=budget['kib'],
+            )
+            if status is not None and status >= 400:
+                report['failures'].append(f"{name}: HTTP {status}")
+            if measured['queries'] > budget['queries']:
+                report['failures'].append(f"{name}: {measured['queries']} queries > budget {budget['queries']}")
+            if measured['peak_kib'] > budget['kib']:
+                report['failures'].append(f"{name}: {measured['peak_kib']} KiB > budget {budget['kib']}")
+            report['cases'][name] = measured
+        transaction.set_rollback(True)
+    return report
+
+
+def regressions(report, baseline):
+    """Cases that issue more queries than in ``baseline``, an earlier report."""
+    return [
+        f"{name}: {case['queries']} queries, was {baseline['cases'][name]['queries']}"
+        for name, case in report['cases'].items()
+        if name in baseline.get('cases', {}) and case['queries'] > baseline['cases'][name]['queries']
+    ]
@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import weakref
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django_redis import get_redis_connection
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from .models import Cluster
+from . import events
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'cluster-capacity'
+
+SNAPSHOT_FIELDS = (
+    'id', 'name', 'created_by__username', 'created_at',
+    'total_ram', 'total_cpu', 'total_gpu',
+    'allocated_ram', 'allocated_cpu', 'allocated_gpu',
+    'version',
+)
+INTEGER_FIELDS = (
+    'id', 'total_ram', 'total_cpu', 'total_gpu',
+    'allocated_ram', 'allocated_cpu', 'allocated_gpu', 'version',
+)
+
+# KEYS[1]: snapshot hash. ARGV: version, ttl, then field/value pairs.
+# The snapshot is only replaced by a strictly newer version, so a slow writer
+# can never roll the cache back to an older row.
+STORE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'version')
+if current and tonumber(current) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'version', ARGV[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class ClusterSnapshot:
+    """Read-only view of a cluster's capacity, shaped like a ``Cluster`` for serializers."""
+
+    def __init__(self, values):
+        self.id = values['id']
+        self.name = values['name']
+        self.created_by = values['created_by']
+        self.created_at = values['created_at']
+        self.total_ram = values['total_ram']
+        self.total_cpu = values['total_cpu']
+        self.total_gpu = values['total_gpu']
+        self.allocated_ram = values['allocated_ram']
+        self.allocated_cpu = values['allocated_cpu']
+        self.allocated_gpu = values['allocated_gpu']
+        self.version = values['version']
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def available_ram(self):
+        return self.total_ram - self.allocated_ram
+
+    @property
+    def available_cpu(self):
+        return self.total_cpu - self.allocated_cpu
+
+    @property
+    def available_gpu(self):
+        return self.total_gpu - self.allocated_gpu
+
+
+def enabled():
+    return getattr(settings, 'CLUSTER_CAPACITY_CACHE', True)
+
+
+def ttl():
+    return getattr(settings, 'CLUSTER_CAPACITY_TTL', 300)
+
+
+def cache_key(cluster_id):
+    return f'{KEY_PREFIX}:{cluster_id}'
+
+
+def _client():
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        # The default cache is not django-redis (e.g. LocMemCache in development).
+        return None
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _async_client():
+    """A ``redis.asyncio`` client for the running event loop, or None without django-redis."""
+    if _client() is None:
+        return None
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = aioredis.Redis.from_url(settings.CACHES['default']['LOCATION'])
+    return _async_clients[loop]
+
+
+async def aclose():
+    """Close the running event loop's client.
+
+    For loops that end with the request, as when async views are served
+    under WSGI: their clients would otherwise pile up, one per request.
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _decode(raw):
+    values = {key.decode(): value.decode() for key, value in raw.items()}
+    for field in INTEGER_FIELDS:
+        values[field] = int(values[field])
+    values['created_at'] = datetime.fromisoformat(values['created_at'])
+    return values
+
+
+def _encode(values):
+    pairs = []
+    for field, value in values.items():
+        if field == 'version':
+            continue
+        pairs += [field, value.isoformat() if field == 'created_at' else value]
+    return pairs
+
+
+def _load(queryset):
+    return {
+        row['id']: {**row, 'created_by': row.pop('created_by__username')}
+        for row in queryset.values(*SNAPSHOT_FIELDS)
+    }
+
+
+def _store(client, rows):
+    script = client.register_script(STORE_SCRIPT)
+    pipe = client.pipeline(transaction=False)
+    for values in rows.values():
+        script(
+            keys=[cache_key(values['id'])],
+            args=[values['version'], ttl(), *_encode(values)],
+            client=pipe,
+        )
+    pipe.execute()
+
+
+def get_many(cluster_ids):
+    """Return ``{id: ClusterSnapshot}`` for the given clusters, from Redis where possible.
+
+    Misses are read from the database in one query and written back, unless
+    the caller is inside a transaction whose uncommitted changes must not leak
+    into the cache. Missing clusters are left out of the result. Redis errors
+    are logged and the database is used instead.
+    """
+    cluster_ids = list(cluster_ids)
+    found = {}
+    client = _client() if enabled() else None
+    if client is not None and cluster_ids:
+        try:
+            pipe = client.pipeline(transaction=False)
+            for cluster_id in cluster_ids:
+                pipe.hgetall(cache_key(cluster_id))
+            for raw in pipe.execute():
+                if raw:
+                    values = _decode(raw)
+                    found[values['id']] = values
+        except RedisError:
+            logger.warning("Capacity cache read failed, falling back to the database", exc_info=True)
+            client = None
+
+    missing = [cluster_id for cluster_id in cluster_ids if cluster_id not in found]
+    if missing:
+        loaded = _load(Cluster.objects.filter(id__in=missing))
+        found.update(loaded)
+        if client is not None and loaded and not connection.in_atomic_block:
+            try:
+                _store(client, loaded)
+            except RedisError:
+                logger.warning("Capacity cache write failed", exc_info=True)
+    return {cluster_id: ClusterSnapshot(values) for cluster_id, values in found.items()}
+
+
+def get(cluster_id):
+    return get_many([cluster_id]).get(cluster_id)
+
+
+async def aget_many(cluster_ids):
+    """``get_many`` for async views: Redis through ``redis.asyncio``, misses through the async ORM."""
+    cluster_ids = list(cluster_ids)
+    found = {}
+    client = _async_client() if enabled() else None
+    if client is not None and cluster_ids:
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                for cluster_id in cluster_ids:
+                    pipe.hgetall(cache_key(cluster_id))
+                for raw in await pipe.execute():
+                    if raw:
+                        values = _decode(raw)
+                        found[values['id']] = values
+        except RedisError:
+            logger.warning("Capacity cache read failed, falling back to the database", exc_info=True)
+            client = None
+
+    missing = [cluster_id for cluster_id in cluster_ids if cluster_id not in found]
+    if missing:
+        loaded = {
+            row['id']: {**row, 'created_by': row.pop('created_by__username')}
+            async for row in Cluster.objects.filter(id__in=missing).values(*SNAPSHOT_FIELDS)
+        }
+        found.update(loaded)
+        if client is not None and loaded:
+            try:
+                script = client.register_script(STORE_SCRIPT)
+                async with client.pipeline(transaction=False) as pipe:
+                    for values in loaded.values():
+                        await script(
+                            keys=[cache_key(values['id'])],
+                            args=[values['version'], ttl(), *_encode(values)],
+                            client=pipe,
+                        )
+                    await pipe.execute()
+            except RedisError:
+                logger.warning("Capacity cache write failed", exc_info=True)
+    return {cluster_id: ClusterSnapshot(values) for cluster_id, values in found.items()}
+
+
+def refresh(queryset):
+    """Copy the committed capacity of every cluster in ``queryset`` into Redis.
+
+    The rows read for the cache are also published as cluster status events.
+    """
+    client = _client() if enabled() else None
+    if client is None and not events.enabled():
+        return
+    rows = _load(queryset)
+    events.publish([events.cluster_event(values) for values in rows.values()])
+    if client is None:
+        return
+    try:
+        _store(client, rows)
+    except RedisError:
+        logger.warning("Capacity cache refresh failed; invalidating", exc_info=True)
+        invalidate(rows)
+
+
+def invalidate(cluster_ids):
+    client = _client() if enabled() else None
+    keys = [cache_key(cluster_id) for cluster_id in cluster_ids]
+    if client is None or not keys:
+        return
+    try:
+        client.delete(*keys)
+    except RedisError:
+        logger.warning("Capacity cache invalidation failed", exc_info=True)
+
+
+def write_through(queryset):
+    """Refresh the cached snapshots of ``queryset`` once the current transaction commits.
+
+    Every ledger update bumps ``Cluster.version``; the refresh only replaces a
+    cached snapshot with a newer version, so refreshes from concurrent workers
+    may land in any order. If the transaction rolls back nothing is written.
+    """
+    transaction.on_commit(lambda: refresh(queryset))
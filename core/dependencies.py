@@ -0,0 +1,77 @@
+from collections import Counter, defaultdict
+
+from django.db.models import F
+
+from .models import Deployment
+
+Edge = Deployment.dependencies.through
+
+
+def _shift(counts, sign):
+    by_amount = defaultdict(list)
+    for deployment_id, amount in counts.items():
+        by_amount[amount].append(deployment_id)
+    for amount, deployment_ids in by_amount.items():
+        Deployment.objects.filter(id__in=deployment_ids).update(
+            unmet_dependencies=F('unmet_dependencies') + sign * amount
+        )
+
+
+def _unmet_counts(edges):
+    incomplete = set(
+        Deployment.objects.filter(
+            id__in={dependency_id for _, dependency_id in edges}
+        ).exclude(
+            status=Deployment.Status.COMPLETED
+        ).values_list('id', flat=True)
+    )
+    return Counter(dependent_id for dependent_id, dependency_id in edges if dependency_id in incomplete)
+
+
+def add_edges(edges):
+    """Count newly added ``(dependent_id, dependency_id)`` edges towards unmet dependencies."""
+    _shift(_unmet_counts(edges), 1)
+
+
+def remove_edges(edges):
+    _shift(_unmet_counts(edges), -1)
+
+
+def existing_edges(dependent_ids=None, dependency_ids=None):
+    edges = Edge.objects.all()
+    if dependent_ids is not None:
+        edges = edges.filter(from_deployment_id__in=dependent_ids)
+    if dependency_ids is not None:
+        edges = edges.filter(to_deployment_id__in=dependency_ids)
+    return list(edges.values_list('from_deployment_id', 'to_deployment_id'))
+
+
+def complete(deployment):
+    """Record that a deployment completed and return the dependents it made ready.
+
+    Only the deployment's own outgoing edges are touched, so completing every
+    node of a DAG costs time proportional to its edges.
+    """
+    dependents = Deployment.objects.filter(dependencies=deployment)
+    dependents.update(unmet_dependencies=F('unmet_dependencies') - 1)
+    return ready(dependents)
+
+
+def reopen(deployment):
+    Deployment.objects.filter(dependencies=deployment).update(
+        unmet_dependencies=F('unmet_dependencies') + 1
+    )
+
+
+def ready(queryset=None):
+    """PENDING deployments whose dependencies have all completed."""
+    queryset = Deployment.objects.all() if queryset is None else queryset
+    return queryset.filter(status=Deployment.Status.PENDING, unmet_dependencies=0)
+
+
+def recount(queryset=None):
+    """Rebuild ``unmet_dependencies`` from the dependency edges."""
+    queryset = Deployment.objects.all() if queryset is None else queryset
+    deployment_ids = list(queryset.values_list('id', flat=True))
+    queryset.update(unmet_dependencies=0)
+    _shift(_unmet_counts(existing_edges(dependent_ids=deployment_ids)), 1)
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+DEPLOYMENT_FIELDS = ('id', 'status', 'priority', 'cluster_id')
+CLUSTER_FIELDS = (
+    'id', 'total_ram', 'total_cpu', 'total_gpu',
+    'allocated_ram', 'allocated_cpu', 'allocated_gpu', 'version',
+)
+RECONNECT_SECONDS = 1
+
+
+def enabled():
+    return getattr(settings, 'STATUS_EVENTS', True)
+
+
+def channel():
+    return getattr(settings, 'STATUS_EVENTS_CHANNEL', 'hypervisor-events')
+
+
+def keepalive():
+    return getattr(settings, 'STATUS_EVENTS_KEEPALIVE', 15)
+
+
+def _client():
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+def _encode(event):
+    return json.dumps(event, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+def publish(events):
+    """Publish ``events`` on the status channel right away, in one pipeline."""
+    client = _client() if enabled() else None
+    if client is None or not events:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for event in events:
+            pipe.publish(channel(), _encode(event))
+        pipe.execute()
+    except RedisError:
+        logger.warning("Status event publish failed", exc_info=True)
+
+
+def deployment_event(deployment):
+    return {'type': 'deployment', **{field: getattr(deployment, field) for field in DEPLOYMENT_FIELDS}}
+
+
+def cluster_event(values):
+    return {'type': 'cluster', **{field: values[field] for field in CLUSTER_FIELDS}}
+
+
+def deployments_changed(deployments):
+    """Announce the current status of ``deployments`` once the transaction commits."""
+    if enabled():
+        batch = [deployment_event(deployment) for deployment in deployments]
+        transaction.on_commit(lambda: publish(batch))
+
+
+class Hub:
+    """Fans one Redis subscription out to every watcher on an event loop.
+
+    Watchers register for keys such as ``('deployment', 3)`` or ``None`` for
+    every event and get their own bounded queue; a watcher that falls behind
+    loses its oldest events rather than holding up the others. The
+    subscription is opened with the first watcher and closed with the last.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.watchers = defaultdict(set)
+        self.ready = asyncio.Event()
+        self._task = None
+
+    def watch(self, keys):
+        queue = asyncio.Queue(self.queue_size)
+        for key in keys:
+            self.watchers[key].add(queue)
+        if self._task is None:
+            self.ready.clear()
+            self._task = asyncio.ensure_future(self._listen())
+        return queue
+
+    def unwatch(self, queue, keys):
+        for key in keys:
+            self.watchers[key].discard(queue)
+            if not self.watchers[key]:
+                del self.watchers[key]
+        if not self.watchers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def dispatch(self, event):
+        for key in (None, (event.get('type'), event.get('id'))):
+            for queue in self.watchers.get(key, ()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+    async def _listen(self):
+        while True:
+            client = aioredis.Redis.from_url(settings.CACHES['default']['LOCATION'])
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(channel())
+                self.ready.set()
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.dispatch(json.loads(message['data']))
+            except (RedisError, OSError):
+                logger.warning("Status event subscription lost, reconnecting", exc_info=True)
+                self.ready.clear()
+                await asyncio.sleep(RECONNECT_SECONDS)
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def hub():
+    """The ``Hub`` of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = Hub()
+    return _hubs[loop]
+
+
+def format_sse(event):
+    return f"event: {event['type']}\ndata: {_encode(event)}\n\n"
+
+
+async def stream(keys, snapshot=None):
+    """Yield server-sent events for ``keys`` until the client goes away.
+
+    ``snapshot`` is an async callable returning the current state of the
+    watched objects as events; it runs once the subscription is live, so no
+    change can fall between the snapshot and the stream.
+    """
+    current = hub()
+    queue = current.watch(keys)
+    try:
+        await current.ready.wait()
+        yield "retry: 3000\n\n"
+        for event in await snapshot() if snapshot else ():
+            yield format_sse(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), keepalive())
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        current.unwatch(queue, keys)
@@ -0,0 +1,96 @@
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.functions import Greatest
+
+from .models import Cluster, Deployment
+
+CHUNK_SIZE = 2000
+
+CLUSTER_FIELDS = (
+    'id', 'name',
+    'total_ram', 'total_cpu', 'total_gpu',
+    'allocated_ram', 'allocated_cpu', 'allocated_gpu',
+    'created_at',
+)
+DEPLOYMENT_FIELDS = (
+    'id', 'docker_image_path', 'status', 'priority',
+    'required_ram', 'required_cpu', 'required_gpu',
+    'cluster_id', 'organization_id', 'group_id', 'unmet_dependencies', 'attempts',
+    'created_at', 'updated_at', 'pending_since',
+)
+SECTIONS = ('clusters', 'deployments', 'dependencies')
+
+
+def _rows(record_type, queryset, fields, chunk_size):
+    # values() rows streamed through a server-side cursor: no model
+    # instances and no result cache, so memory stays flat.
+    for row in queryset.order_by('pk').values(*fields).iterator(chunk_size=chunk_size):
+        yield {'type': record_type, **row}
+
+
+def _edges(deployments, chunk_size):
+    # Only edges between two exported deployments, so every id an edge names
+    # is in the export. Ordered by the later of the two deployments, the
+    # point at which a replay has seen both of them.
+    edges = Deployment.dependencies.through.objects.filter(
+        from_deployment__in=deployments.values('pk'), to_deployment__in=deployments.values('pk'),
+    )
+    for dependent, dependency in edges.annotate(
+        last=Greatest('from_deployment_id', 'to_deployment_id')
+    ).order_by('last', 'pk').values_list('from_deployment_id', 'to_deployment_id').iterator(chunk_size=chunk_size):
+        yield {'type': 'dependency', 'deployment_id': dependent, 'depends_on_id': dependency}
+
+
+def _interleave(rows, edges):
+    """Yield each deployment row followed by the edges that become complete with it."""
+    edges = iter(edges)
+    edge = next(edges, None)
+    for row in rows:
+        yield row
+        while edge is not None and max(edge['deployment_id'], edge['depends_on_id']) <= row['id']:
+            yield edge
+            edge = next(edges, None)
+    if edge is not None:
+        yield edge
+        yield from edges
+
+
+def export_records(sections=SECTIONS, deployments=None, chunk_size=CHUNK_SIZE):
+    """Yield clusters, deployments and dependency edges as flat, typed dicts.
+
+    ``deployments`` optionally narrows the exported deployments, and the
+    dependency edges to those between two exported deployments, so a narrowed
+    export still imports; clusters are always exported whole. Each edge follows
+    the later of its two deployments, so replaying an export (see
+    ``core.trace``) adds it before anything that depends on it is admitted.
+    """
+    deployments = Deployment.objects.all() if deployments is None else deployments
+    if 'clusters' in sections:
+        yield from _rows('cluster', Cluster.objects.all(), CLUSTER_FIELDS, chunk_size)
+    rows = _rows('deployment', deployments, DEPLOYMENT_FIELDS, chunk_size) if 'deployments' in sections else []
+    edges = _edges(deployments, chunk_size) if 'dependencies' in sections else []
+    yield from _interleave(rows, edges)
+
+
+def ndjson(records):
+    """Encode records as newline-delimited JSON, one line at a time."""
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for record in records:
+        yield encoder.encode(record) + '\n'
+
+
+async def aiterate(iterable, batch_size=CHUNK_SIZE):
+    """Serve a sync iterable to an async consumer, ``batch_size`` items per thread hop.
+
+    Under ASGI Django reads a sync streaming response into memory before
+    sending it; this keeps the export streaming there. The batches are pulled
+    on the thread-sensitive executor, so a server-side cursor stays on one
+    connection throughout.
+    """
+    iterator = iter(iterable)
+    take = sync_to_async(lambda: list(itertools.islice(iterator, batch_size)))
+    while batch := await take():
+        for item in batch:
+            yield item
@@ -0,0 +1,192 @@
+import heapq
+import logging
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django_redis.exceptions import ConnectionInterrupted
+
+from .models import Cluster, Organization
+
+logger = logging.getLogger(__name__)
+
+TOTALS_KEY = 'fair-share-cluster-totals'
+ORGANIZATION_FIELDS = (
+    'id', 'weight', 'quota_ram', 'quota_cpu', 'quota_gpu', 'allocated_ram', 'allocated_cpu', 'allocated_gpu',
+)
+RESOURCES = ('ram', 'cpu', 'gpu')
+
+
+def enabled():
+    return getattr(settings, 'FAIR_SHARE', True)
+
+
+def totals_ttl():
+    return getattr(settings, 'FAIR_SHARE_TOTALS_TTL', 60)
+
+
+def cluster_totals():
+    """(ram, cpu, gpu) summed over every cluster: the denominators of dominant shares.
+
+    Cached, and dropped whenever a cluster is saved or deleted; the TTL
+    bounds staleness after bulk inserts, which send no signals.
+    """
+    try:
+        totals = cache.get(TOTALS_KEY)
+    except ConnectionInterrupted:
+        logger.warning("Cluster totals cache read failed", exc_info=True)
+        totals = None
+    if totals is None:
+        summed = Cluster.objects.aggregate(**{resource: Sum(f'total_{resource}') for resource in RESOURCES})
+        totals = tuple(summed[resource] or 0 for resource in RESOURCES)
+        try:
+            cache.set(TOTALS_KEY, totals, totals_ttl())
+        except ConnectionInterrupted:
+            logger.warning("Cluster totals cache write failed", exc_info=True)
+    return totals
+
+
+def invalidate_totals():
+    try:
+        cache.delete(TOTALS_KEY)
+    except ConnectionInterrupted:
+        logger.warning("Cluster totals cache invalidation failed", exc_info=True)
+
+
+def _demand(deployment):
+    return (deployment.required_ram, deployment.required_cpu, deployment.required_gpu)
+
+
+class Shares:
+    """Quotas and dominant resource shares of the organizations in one scheduling decision.
+
+    An organization's dominant share is the largest fraction of any resource,
+    summed over all clusters, that it holds, divided by its weight. The
+    counters come from the ``Organization`` rows in one query and are then
+    kept current in memory with ``take`` and ``give``, so every check costs
+    O(1). Deployments without an organization have no quota and a share of 0.
+    With ``FAIR_SHARE`` off, quotas are still checked but shares are all 0.
+    """
+
+    def __init__(self):
+        self.organizations = {}
+        self._totals = None
+
+    @classmethod
+    def load(cls, organization_ids):
+        return cls().include(organization_ids)
+
+    @classmethod
+    def of(cls, organizations):
+        """Shares of ``Organization`` instances that are already loaded."""
+        shares = cls()
+        for organization in organizations:
+            shares._add({field: getattr(organization, field) for field in ORGANIZATION_FIELDS})
+        return shares
+
+    def _add(self, row):
+        self.organizations[row['id']] = {
+            'weight': max(row['weight'], 1),
+            'quota': [row[f'quota_{resource}'] for resource in RESOURCES],
+            'used': [row[f'allocated_{resource}'] for resource in RESOURCES],
+        }
+
+    def include(self, organization_ids):
+        """Load the organizations in ``organization_ids`` not loaded yet."""
+        missing = {pk for pk in organization_ids if pk is not None} - set(self.organizations)
+        if missing:
+            for row in Organization.objects.filter(id__in=missing).values(*ORGANIZATION_FIELDS):
+                self._add(row)
+        return self
+
+    @property
+    def totals(self):
+        if self._totals is None:
+            self._totals = cluster_totals()
+        return self._totals
+
+    def share(self, organization_id, extra=(0, 0, 0)):
+        organization = self.organizations.get(organization_id)
+        if organization is None or not enabled():
+            return 0.0
+        fractions = [
+            (used + more) / total
+            for used, more, total in zip(organization['used'], extra, self.totals) if total
+        ]
+        return max(fractions, default=0.0) / organization['weight']
+
+    def within_quota(self, deployment):
+        organization = self.organizations.get(deployment.organization_id)
+        if organization is None:
+            return True
+        return all(
+            quota is None or used + amount <= quota
+            for used, amount, quota in zip(organization['used'], _demand(deployment), organization['quota'])
+        )
+
+    def _shift(self, deployment, sign):
+        organization = self.organizations.get(deployment.organization_id)
+        if organization is not None:
+            organization['used'] = [
+                used + sign * amount for used, amount in zip(organization['used'], _demand(deployment))
+            ]
+
+    def take(self, deployment):
+        self._shift(deployment, 1)
+
+    def give(self, deployment):
+        self._shift(deployment, -1)
+
+    def may_preempt(self, deployment, victim):
+        """Whether ``deployment`` may evict ``victim``, which already ranks below it.
+
+        Across organizations, a victim's organization must stay above the
+        preempting organization's share once ``deployment`` runs, so a team
+        cannot preempt its way past a team holding less than it does.
+        """
+        if (not enabled() or deployment.organization_id == victim.organization_id or
+                deployment.organization_id is None or victim.organization_id is None):
+            return True
+        return self.share(victim.organization_id) > self.share(deployment.organization_id, _demand(deployment))
+
+    def discount(self, victim):
+        """Multiplier on a victim's eviction cost: the larger its organization's share, the cheaper."""
+        return 1 / (1 + self.share(victim.organization_id))
+
+    def deltas(self, admitted, preempted):
+        """Net ``{organization id: [ram, cpu, gpu]}`` change of a pass, for ``Organization.objects.adjust``."""
+        net = defaultdict(lambda: [0, 0, 0])
+        for sign, deployments in ((1, admitted), (-1, preempted)):
+            for deployment in deployments:
+                if deployment.organization_id is not None:
+                    delta = net[deployment.organization_id]
+                    for i, amount in enumerate(_demand(deployment)):
+                        delta[i] += sign * amount
+        return {pk: delta for pk, delta in net.items() if any(delta)}
+
+
+def fair_order(deployments, shares, rank):
+    """Yield ``deployments`` by ``rank`` (highest first), then by their organization's current share.
+
+    Within a rank, organizations take turns by lowest dominant share, oldest
+    deployment first; each organization's share is read again after its
+    deployment is yielded, so admissions recorded with ``Shares.take`` in
+    between push it back (progressive filling). Without organizations this
+    is plain rank-then-age order.
+    """
+    queues = defaultdict(deque)
+    for deployment in sorted(deployments, key=lambda d: (-rank(d), d.created_at)):
+        queues[deployment.organization_id].append(deployment)
+
+    def entry(organization_id):
+        head = queues[organization_id][0]
+        return (-rank(head), shares.share(organization_id), head.created_at, head.id, organization_id)
+
+    heap = [entry(organization_id) for organization_id in queues]
+    heapq.heapify(heap)
+    while heap:
+        organization_id = heapq.heappop(heap)[-1]
+        yield queues[organization_id].popleft()
+        if queues[organization_id]:
+            heapq.heappush(heap, entry(organization_id))
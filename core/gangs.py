@@ -0,0 +1,123 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cluster, Deployment, Organization
+
+Status = Deployment.Status
+
+
+class Gang:
+    """The members of a ``DeploymentGroup`` that the scheduler handles as one unit.
+
+    It carries the combined demand of its members and the scheduling
+    attributes of a deployment, so admission, placement, quotas and victim
+    selection treat it like one big deployment. ``allocate`` and
+    ``release_resources`` move every member at once: either the whole gang
+    holds cluster resources or none of it does. Members share a cluster,
+    organization and priority (checked on submission); the lowest id stands
+    in for the gang wherever one id is needed.
+
+    Only the columns read by victim selection (``PREEMPTION_FIELDS`` in
+    core.scheduler) are read up front; the rest are derived on access.
+    """
+
+    def __init__(self, members):
+        self.members = sorted(members, key=lambda member: member.id)
+        leader = self.members[0]
+        self.id = self.pk = leader.id
+        self.group_id = leader.group_id
+        self.organization_id = leader.organization_id
+        self.priority = leader.priority
+        self.priority_rank = leader.priority_rank
+        self.updated_at = min(member.updated_at for member in self.members)
+        self.required_ram = sum(member.required_ram for member in self.members)
+        self.required_cpu = sum(member.required_cpu for member in self.members)
+        self.required_gpu = sum(member.required_gpu for member in self.members)
+
+    @classmethod
+    def load(cls, group_id, status=Status.PENDING):
+        members = list(Deployment.objects.filter(group_id=group_id, status=status))
+        return cls(members) if members else None
+
+    @property
+    def cluster_id(self):
+        return self.members[0].cluster_id
+
+    @cluster_id.setter
+    def cluster_id(self, value):
+        for member in self.members:
+            member.cluster_id = value
+
+    @property
+    def status(self):
+        return self.members[0].status
+
+    @property
+    def created_at(self):
+        return min(member.created_at for member in self.members)
+
+    @property
+    def pending_since(self):
+        return min(member.pending_since for member in self.members)
+
+    @property
+    def attempts(self):
+        return max(member.attempts for member in self.members)
+
+    @property
+    def unmet_dependencies(self):
+        return sum(member.unmet_dependencies for member in self.members)
+
+    @property
+    def ids(self):
+        return [member.id for member in self.members]
+
+    def allocate(self):
+        """Claim the gang's combined demand and mark every member RUNNING, or change nothing."""
+        with transaction.atomic():
+            claimed = Deployment.objects.filter(pk__in=self.ids, status=Status.PENDING).update(
+                status=Status.RUNNING, updated_at=timezone.now()
+            )
+            allocated = claimed == len(self.members) and Cluster.objects.filter(pk=self.cluster_id).allocate(
+                self.required_ram, self.required_cpu, self.required_gpu
+            )
+            if allocated and self.organization_id is not None:
+                allocated = Organization.objects.filter(pk=self.organization_id).allocate(
+                    self.required_ram, self.required_cpu, self.required_gpu
+                )
+            if not allocated:
+                transaction.set_rollback(True)
+                return False
+        for member in self.members:
+            member.status = Status.RUNNING
+            member._mirror_allocation(1)
+        from .events import deployments_changed
+        deployments_changed(self.members)
+        return True
+
+    def release_resources(self):
+        """Send every member that is still RUNNING back to PENDING, releasing what it held."""
+        with transaction.atomic():
+            released = [member for member in self.members if member.release_resources()]
+        return bool(released)
+
+
+def bundle(deployments):
+    """``deployments`` with the members of each group folded into one ``Gang``, in their original order."""
+    units = []
+    groups = defaultdict(list)
+    for deployment in deployments:
+        if deployment.group_id is None:
+            units.append(deployment)
+        else:
+            if deployment.group_id not in groups:
+                units.append(deployment.group_id)
+            groups[deployment.group_id].append(deployment)
+    return [Gang(groups[unit]) if isinstance(unit, int) else unit for unit in units]
+
+
+def members(units):
+    """The deployments behind ``units``, gangs expanded."""
+    return [member for unit in units for member in (unit.members if isinstance(unit, Gang) else [unit])]
@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Cluster, Deployment, Organization
+from . import dependencies, events, gangs, scheduler
+
+Status = Deployment.Status
+
+# Terminal status -> statuses it can be reached from.
+TRANSITIONS = {
+    Status.COMPLETED: (Status.RUNNING,),
+    Status.FAILED: (Status.RUNNING,),
+    Status.CANCELLED: (Status.RUNNING, Status.PENDING),
+}
+
+
+class TransitionError(Exception):
+    pass
+
+
+def finish(deployment, status):
+    """Move a deployment to a terminal ``status``, releasing what it holds.
+
+    The status change is a conditional UPDATE, so of two concurrent requests
+    only one wins and resources are released exactly once. In the same
+    transaction the cluster and organization ledgers are released, dependents
+    are credited (for COMPLETED) and scheduling passes are requested for the
+    freed cluster, the organization's parked deployments and the dependents
+    that became ready; the passes are only enqueued once that transaction
+    commits (see ``scheduler._wake``), so they see the new state. Failing or
+    cancelling a RUNNING gang member sends the rest of its gang back to
+    PENDING. Raises
+    ``TransitionError`` if the deployment is not in a status ``status`` can be
+    reached from.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        previous = None
+        for source in TRANSITIONS[status]:
+            if Deployment.objects.filter(pk=deployment.pk, status=source).update(status=status, updated_at=now):
+                previous = source
+                break
+        if previous is None:
+            current = Deployment.objects.filter(pk=deployment.pk).values_list('status', flat=True).first()
+            raise TransitionError(f"Cannot move a {current or 'deleted'} deployment to {status}")
+        if previous == Status.RUNNING:
+            Cluster.objects.filter(pk=deployment.cluster_id).release(
+                deployment.required_ram, deployment.required_cpu, deployment.required_gpu
+            )
+            scheduler.capacity_freed(deployment.cluster_id)
+            if deployment.organization_id is not None:
+                Organization.objects.filter(pk=deployment.organization_id).release(
+                    deployment.required_ram, deployment.required_cpu, deployment.required_gpu
+                )
+                scheduler.quota_freed(deployment.organization_id, deployment.cluster_id)
+            if deployment.group_id is not None and status != Status.COMPLETED:
+                # The rest of a failed or cancelled gang cannot run on its
+                # own, so it goes back to PENDING rather than hold resources.
+                rest = gangs.Gang.load(deployment.group_id, status=Status.RUNNING)
+                if rest is not None:
+                    rest.release_resources()
+        if status == Status.COMPLETED:
+            ready = dependencies.complete(deployment)
+            if previous == Status.RUNNING:
+                # Already covered by the capacity_freed passes above.
+                ready = ready.exclude(Q(cluster_id=deployment.cluster_id) | Q(cluster__isnull=True))
+            scheduler.wake_deployments(ready)
+
+    deployment.status = status
+    deployment.updated_at = now
+    # Keep the post_save handler from replaying this transition on a later save().
+    deployment._loaded_values = {**getattr(deployment, '_loaded_values', {}), 'status': status}
+    if previous == Status.RUNNING:
+        deployment._mirror_allocation(-1)
+    events.deployments_changed([deployment])
+    return deployment
+
+
+def complete(deployment):
+    return finish(deployment, Status.COMPLETED)
+
+
+def fail(deployment):
+    return finish(deployment, Status.FAILED)
+
+
+def cancel(deployment):
+    return finish(deployment, Status.CANCELLED)
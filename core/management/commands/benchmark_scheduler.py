@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import Workload, run_benchmark
+from core.scheduler import EVENT_MODE, POLL_MODE
+
+
+def parse_priority_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip().upper()
+        if name not in ('HIGH', 'MEDIUM', 'LOW') or not weight:
+            raise CommandError(f"Invalid priority mix entry: {part!r}")
+        mix[name] = float(weight)
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the scheduler in-process against a synthetic workload with an in-memory "
+        "queue and report throughput, queries per decision, admission latency and utilization. "
+        "Everything is rolled back afterwards unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clusters', type=int, default=100)
+        parser.add_argument('--deployments', type=int, default=1000)
+        parser.add_argument('--priority-mix', default='HIGH=1,MEDIUM=3,LOW=6',
+                            help="Relative weights, e.g. HIGH=1,MEDIUM=3,LOW=6")
+        parser.add_argument('--dependency-rate', type=float, default=0.0,
+                            help="Mean number of dependencies per deployment")
+        parser.add_argument('--dependency-window', type=int, default=50,
+                            help="Dependencies are drawn from this many preceding deployments")
+        parser.add_argument('--unplaced-rate', type=float, default=0.0,
+                            help="Share of deployments submitted without a cluster")
+        parser.add_argument('--gpu-rate', type=float, default=0.3)
+        parser.add_argument('--mode', choices=(EVENT_MODE, POLL_MODE), default=EVENT_MODE)
+        parser.add_argument('--complete-fraction', type=float, default=0.5,
+                            help="Share of RUNNING deployments completed after each round")
+        parser.add_argument('--round-seconds', type=float, default=60,
+                            help="Virtual seconds between rounds; delayed retries become due as they pass")
+        parser.add_argument('--max-rounds', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Commit the generated rows")
+
+    def handle(self, *args, **options):
+        workload = Workload(
+            clusters=options['clusters'],
+            deployments=options['deployments'],
+            priority_mix=parse_priority_mix(options['priority_mix']),
+            dependency_rate=options['dependency_rate'],
+            dependency_window=options['dependency_window'],
+            unplaced_rate=options['unplaced_rate'],
+            gpu_rate=options['gpu_rate'],
+            seed=options['seed'],
+        )
+        report = run_benchmark(
+            workload,
+            mode=options['mode'],
+            complete_fraction=options['complete_fraction'],
+            round_seconds=options['round_seconds'],
+            max_rounds=options['max_rounds'],
+            keep=options['keep'],
+        )
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.budgets import CASES, regressions, run_budgets
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the queries and peak memory of every API endpoint and of process_deployment on a "
+        "synthetic fixture, and fail if any exceeds its budget in core.budgets. Everything is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clusters', type=int, default=1000)
+        parser.add_argument('--deployments', type=int, default=50000)
+        parser.add_argument('--dependency-rate', type=float, default=0.5)
+        parser.add_argument('--case', action='append', choices=sorted(CASES), dest='cases',
+                            help="Only run this case; may be repeated")
+        parser.add_argument('--output', help="Write the JSON report to this file")
+        parser.add_argument('--baseline', help="Fail if any case issues more queries than in this earlier report")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        report = run_budgets(
+            clusters=options['clusters'],
+            deployments=options['deployments'],
+            dependency_rate=options['dependency_rate'],
+            cases=options['cases'],
+            seed=options['seed'],
+        )
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                report['failures'] += regressions(report, json.load(baseline))
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text + '\n')
+        self.stdout.write(text)
+        if report['failures']:
+            raise CommandError(f"{len(report['failures'])} budget(s) exceeded:\n" + '\n'.join(report['failures']))
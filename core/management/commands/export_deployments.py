@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from core.export import CHUNK_SIZE, SECTIONS, export_records, ndjson
+from core.models import Deployment
+from core.views import filter_deployments
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream clusters, deployments and dependency edges as NDJSON, one typed "
+        "record per line, with flat memory use regardless of table size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="File to write to (default: stdout)")
+        parser.add_argument('--include', default=','.join(SECTIONS),
+                            help=f"Comma-separated sections out of {', '.join(SECTIONS)}")
+        parser.add_argument('--status', help="Only deployments with these statuses (comma-separated)")
+        parser.add_argument('--priority', help="Only deployments with these priorities (comma-separated)")
+        parser.add_argument('--cluster', help="Only deployments on this cluster id, or 'none'")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        sections = [s.strip() for s in options['include'].split(',') if s.strip()]
+        invalid = [s for s in sections if s not in SECTIONS]
+        if invalid:
+            raise CommandError(f"Invalid section(s): {', '.join(invalid)}")
+        params = {name: options[name] for name in ('status', 'priority', 'cluster') if options[name]}
+        try:
+            deployments = filter_deployments(Deployment.objects.all(), params)
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        lines = ndjson(export_records(sections, deployments, options['chunk_size']))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
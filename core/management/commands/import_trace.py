@@ -0,0 +1,54 @@
+import json
+import sys
+from contextlib import nullcontext
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from core.benchmark import in_memory_queues
+from core.scheduler import EVENT_MODE, POLL_MODE, using_mode
+from core.trace import CHUNK_SIZE, TraceError, TraceLoader
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-load a JSONL trace of clusters, deployment submissions, dependencies, completions "
+        "and releases (e.g. the output of export_deployments) in chunked transactions, and "
+        "optionally replay it through the scheduler at accelerated wall-clock speed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Trace file, or - for stdin")
+        parser.add_argument('--user', default='trace-import',
+                            help="Owner of the imported rows; created if it does not exist")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help="Records per bulk insert and transaction")
+        parser.add_argument('--replay', action='store_true',
+                            help="Submit deployments to the scheduler at their recorded times")
+        parser.add_argument('--speed', type=float, default=60.0,
+                            help="Replay speed-up over recorded time; 0 replays without waiting")
+        parser.add_argument('--in-process', action='store_true',
+                            help="Run scheduler jobs in this process instead of enqueueing them for workers")
+        parser.add_argument('--mode', choices=(EVENT_MODE, POLL_MODE),
+                            help="Scheduler mode for the replay (default: SCHEDULER_MODE)")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive")
+        user, _ = User.objects.get_or_create(username=options['user'])
+        queues = in_memory_queues() if options['in_process'] else nullcontext()
+        trace = nullcontext(sys.stdin) if options['path'] == '-' else open(options['path'])
+        with trace as lines, using_mode(options['mode']), queues as broker:
+            loader = TraceLoader(
+                user,
+                chunk_size=options['chunk_size'],
+                replay=options['replay'],
+                speed=options['speed'],
+                broker=broker,
+            )
+            try:
+                stats = loader.load(lines)
+            except (TraceError, IntegrityError, KeyError, TypeError, ValueError) as exc:
+                raise CommandError(f"{exc} (chunks committed so far are kept)")
+        self.stdout.write(json.dumps(stats, indent=2))
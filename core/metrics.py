@@ -0,0 +1,262 @@
+import functools
+import logging
+import math
+import threading
+import time
+from collections import Counter as Tally, defaultdict
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django_redis import get_redis_connection
+from django_rq import get_queue
+from redis.exceptions import RedisError
+from rq import get_current_job
+
+from .models import Cluster, Deployment, Organization
+from . import fairshare
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'metrics'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+# A thread's buffer is written out when it holds this many series or is this
+# old; scheduler jobs always flush when they finish.
+FLUSH_THRESHOLD = 500
+FLUSH_INTERVAL = 5
+
+REGISTRY = {}
+_local = threading.local()
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def _pending():
+    if not hasattr(_local, 'pending'):
+        _local.pending = Tally()
+        _local.flushed = time.monotonic()
+    return _local.pending
+
+
+def _labels(names, values):
+    if set(values) != set(names):
+        raise ValueError(f"Expected labels {names}, got {tuple(values)}")
+    return ','.join(f'{name}="{values[name]}"' for name in names)
+
+
+def _record(metric, field, amount):
+    if not enabled():
+        return
+    pending = _pending()
+    pending[(metric.name, field)] += amount
+    if len(pending) >= FLUSH_THRESHOLD or time.monotonic() - _local.flushed >= FLUSH_INTERVAL:
+        flush()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        REGISTRY[name] = self
+
+    @property
+    def key(self):
+        return f'{KEY_PREFIX}:{self.name}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        _record(self, _labels(self.labels, labels), amount)
+
+    def samples(self, stored):
+        for labels, value in sorted(stored.items()):
+            yield self.name, labels, value
+
+
+class Histogram(Metric):
+    """Fixed-bucket histogram; each observation touches one bucket plus the sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        labels = _labels(self.labels, labels)
+        bucket = next((b for b in self.buckets if value <= b), math.inf)
+        _record(self, f'{labels}|{bucket}', 1)
+        _record(self, f'{labels}|sum', value)
+        _record(self, f'{labels}|count', 1)
+
+    def samples(self, stored):
+        series = defaultdict(dict)
+        for field, value in stored.items():
+            labels, _, part = field.rpartition('|')
+            series[labels][part] = value
+        for labels, parts in sorted(series.items()):
+            cumulative = 0
+            for bucket in (*self.buckets, math.inf):
+                cumulative += parts.get(str(bucket), 0)
+                le = '+Inf' if bucket == math.inf else repr(bucket)
+                yield f'{self.name}_bucket', ','.join(filter(None, (labels, f'le="{le}"'))), cumulative
+            yield f'{self.name}_sum', labels, parts.get('sum', 0)
+            yield f'{self.name}_count', labels, parts.get('count', 0)
+
+
+def _client():
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+def flush():
+    """Write the observations buffered by this thread to Redis in one pipeline."""
+    pending = _pending()
+    _local.flushed = time.monotonic()
+    if not pending:
+        return
+    batch = dict(pending)
+    pending.clear()
+    client = _client()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for (name, field), amount in batch.items():
+            pipe.hincrbyfloat(REGISTRY[name].key, field, amount)
+        pipe.execute()
+    except RedisError:
+        logger.warning("Metrics flush failed; dropping %d series", len(batch), exc_info=True)
+
+
+def stored():
+    """``{metric name: {field: value}}`` as aggregated in Redis across processes."""
+    client = _client()
+    if client is None:
+        return {}
+    pipe = client.pipeline(transaction=False)
+    for metric in REGISTRY.values():
+        pipe.hgetall(metric.key)
+    return {
+        metric.name: {field.decode(): float(value) for field, value in raw.items()}
+        for metric, raw in zip(REGISTRY.values(), pipe.execute())
+    }
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+scheduler_job_seconds = Histogram(
+    'hypervisor_scheduler_job_seconds', "Time spent in one scheduler job", ('job',))
+scheduler_queue_wait_seconds = Histogram(
+    'hypervisor_scheduler_queue_wait_seconds', "Time a scheduler job waited in its queue", ('job',),
+    buckets=WAIT_BUCKETS)
+scheduler_job_queries = Histogram(
+    'hypervisor_scheduler_job_queries', "Database queries issued by one scheduler job", ('job',),
+    buckets=COUNT_BUCKETS)
+admissions = Counter(
+    'hypervisor_scheduler_admissions_total', "Deployments started by the scheduler", ('priority',))
+preemptions = Counter(
+    'hypervisor_scheduler_preemptions_total', "Running deployments preempted, by their priority", ('priority',))
+requeues = Counter(
+    'hypervisor_scheduler_requeues_total', "Deployments handed back to the scheduler", ('reason',))
+attempts_before_running = Histogram(
+    'hypervisor_deployment_attempts_before_running',
+    "Blocked scheduling attempts a deployment went through before it started", buckets=COUNT_BUCKETS)
+http_request_seconds = Histogram(
+    'hypervisor_http_request_seconds', "API request latency", ('view', 'method', 'status'))
+
+
+def admitted(deployments):
+    for deployment in deployments:
+        admissions.inc(priority=deployment.priority)
+        attempts_before_running.observe(deployment.attempts)
+
+
+def preempted(deployments):
+    for deployment in deployments:
+        preemptions.inc(priority=deployment.priority)
+
+
+def instrumented(name):
+    """Record latency, queue wait and query count of a scheduler job, then flush."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            job = get_current_job()
+            if job is not None and job.enqueued_at and job.started_at:
+                scheduler_queue_wait_seconds.observe(
+                    (job.started_at.replace(tzinfo=dt_timezone.utc) -
+                     job.enqueued_at.replace(tzinfo=dt_timezone.utc)).total_seconds(),
+                    job=name,
+                )
+            queries = _QueryCounter()
+            started = time.perf_counter()
+            try:
+                with connection.execute_wrapper(queries):
+                    return func(*args, **kwargs)
+            finally:
+                scheduler_job_seconds.observe(time.perf_counter() - started, job=name)
+                scheduler_job_queries.observe(queries.count, job=name)
+                flush()
+        return wrapper
+    return decorator
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _gauges():
+    yield 'hypervisor_cluster_utilization', "Allocated share of a cluster's resources", [
+        (f'cluster="{row[0]}",resource="{resource}"', row[i + 4] / row[i + 1] if row[i + 1] else 0.0)
+        for row in Cluster.objects.order_by('id').values_list(
+            'id', 'total_ram', 'total_cpu', 'total_gpu', 'allocated_ram', 'allocated_cpu', 'allocated_gpu'
+        )
+        for i, resource in enumerate(('ram', 'cpu', 'gpu'))
+    ]
+    yield 'hypervisor_deployments', "Deployments by status", [
+        (f'status="{row["status"]}"', row['count'])
+        for row in Deployment.objects.order_by().values('status').annotate(count=Count('id'))
+    ]
+    organizations = list(Organization.objects.order_by('id').only(*fairshare.ORGANIZATION_FIELDS))
+    shares = fairshare.Shares.of(organizations)
+    yield 'hypervisor_organization_dominant_share', "Dominant resource share of an organization over its weight", [
+        (f'organization="{organization.id}"', shares.share(organization.id)) for organization in organizations
+    ]
+    yield 'hypervisor_queue_length', "Jobs waiting in an RQ queue", [
+        (f'queue="{name}"', get_queue(name).count) for name in settings.RQ_QUEUES
+    ]
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    values = stored()
+    for metric in REGISTRY.values():
+        lines += [f'# HELP {metric.name} {metric.documentation}', f'# TYPE {metric.name} {metric.kind}']
+        for sample, labels, value in metric.samples(values.get(metric.name, {})):
+            lines.append(f'{sample}{{{labels}}} {_format(value)}' if labels else f'{sample} {_format(value)}')
+    for name, documentation, samples in _gauges():
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} gauge']
+        lines += [f'{name}{{{labels}}} {_format(value)}' for labels, value in samples]
+    return '\n'.join(lines) + '\n'
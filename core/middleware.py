@@ -0,0 +1,87 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics, profiling
+
+
+def _view_name(request):
+    match = request.resolver_match
+    return match.view_name if match else 'unmatched'
+
+
+class HybridMiddleware:
+    """Middleware that runs natively in front of sync and async views.
+
+    Subclasses implement ``before(request)``, whose result is handed to
+    ``after(request, response, state)``. Staying async-capable keeps the
+    async read views off a worker thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.before(request)
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            self.after(request, response, state)
+        return response
+
+    async def __acall__(self, request):
+        state = self.before(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.after(request, response, state)
+        return response
+
+    def before(self, request):
+        return None
+
+    def after(self, request, response, state):
+        pass
+
+
+class RequestMetricsMiddleware(HybridMiddleware):
+    """Records the latency of every request in ``http_request_seconds``."""
+
+    def before(self, request):
+        return time.perf_counter()
+
+    def after(self, request, response, started):
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - started,
+            view=_view_name(request),
+            method=request.method,
+            status=response.status_code if response is not None else 500,
+        )
+
+
+class QueryProfilingMiddleware(HybridMiddleware):
+    """Profiles the queries of each request when ``QUERY_PROFILING`` is on (see core.profiling).
+
+    Adds ``Server-Timing`` and ``X-Query-Count`` headers, logs likely N+1
+    patterns and writes sampled traces to ``QUERY_PROFILING_TRACE_FILE``.
+    """
+
+    def before(self, request):
+        return profiling.start(request.path)
+
+    def after(self, request, response, profile):
+        if profile is None:
+            return
+        profile.label = f'{request.method} {_view_name(request)}'
+        profiling.stop(profile)
+        if response is not None:
+            response['Server-Timing'] = f'db;dur={profile.seconds * 1000:.1f};desc="{profile.count} queries"'
+            response['X-Query-Count'] = str(profile.count)
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:24
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_unmet_dependencies(apps, schema_editor):
+    Deployment = apps.get_model('core', 'Deployment')
+    deployments = Deployment.objects.annotate(
+        unmet=Count('dependencies', filter=~Q(dependencies__status='COMPLETED'))
+    ).filter(unmet__gt=0).only('id')
+    for deployment in deployments.iterator(chunk_size=2000):
+        Deployment.objects.filter(id=deployment.id).update(unmet_dependencies=deployment.unmet)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_deployment_dependencies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deployment',
+            name='unmet_dependencies',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of dependencies that have not completed yet'),
+        ),
+        migrations.RunPython(count_unmet_dependencies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_deployment_unmet_dependencies'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deployment',
+            name='cluster',
+            field=models.ForeignKey(blank=True, help_text='Leave empty to let the scheduler place the deployment', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='deployments', to='core.cluster'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:28
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_pending_since(apps, schema_editor):
+    Deployment = apps.get_model('core', 'Deployment')
+    Deployment.objects.update(pending_since=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_deployment_optional_cluster'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deployment',
+            name='pending_since',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='When the deployment last started waiting to be scheduled'),
+        ),
+        migrations.RunPython(backfill_pending_since, migrations.RunPython.noop),
+    ]
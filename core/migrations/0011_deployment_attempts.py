@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_deployment_pending_since'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deployment',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Scheduling attempts that found the deployment blocked since it last became pending'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_deployment_attempts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(fields=['status', '-id'], name='deployment_status_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(fields=['priority', '-id'], name='deployment_priority_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(fields=['cluster', '-id'], name='deployment_cluster_id_idx'),
+        ),
+    ]
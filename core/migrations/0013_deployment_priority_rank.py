@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_priority_rank(apps, schema_editor):
+    Deployment = apps.get_model('core', 'Deployment')
+    for priority, rank in {'LOW': 1, 'MEDIUM': 2, 'HIGH': 3}.items():
+        Deployment.objects.filter(priority=priority).update(priority_rank=rank)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_deployment_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deployment',
+            name='priority_rank',
+            field=models.PositiveSmallIntegerField(default=2, editable=False, help_text='Numeric priority (higher runs first), kept in sync with priority on save'),
+        ),
+        migrations.RunPython(backfill_priority_rank, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(fields=['cluster', 'status'], name='deployment_cluster_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(condition=models.Q(('status', 'RUNNING')), fields=['cluster', 'priority_rank'], include=('id', 'priority', 'required_ram', 'required_cpu', 'required_gpu', 'updated_at'), name='deployment_running_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['cluster', '-priority_rank', 'created_at'], name='deployment_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(condition=models.Q(('cluster__isnull', True), ('status', 'PENDING'), ('unmet_dependencies', 0)), fields=['-priority_rank', 'created_at'], name='deployment_unplaced_idx'),
+        ),
+    ]
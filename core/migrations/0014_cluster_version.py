@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_deployment_priority_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cluster',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Bumped on every capacity change; orders cached capacity snapshots'),
+        ),
+    ]
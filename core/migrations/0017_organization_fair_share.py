@@ -0,0 +1,65 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:37
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_deployment_terminal_statuses'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='deployment',
+            name='deployment_running_idx',
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='organization',
+            field=models.ForeignKey(blank=True, help_text='Organization whose quota and fair share the deployment counts against', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deployments', to='core.organization'),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='allocated_cpu',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='allocated_gpu',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='allocated_ram',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='quota_cpu',
+            field=models.PositiveIntegerField(blank=True, help_text='CPU cores the organization may hold at once; no limit if empty', null=True),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='quota_gpu',
+            field=models.PositiveIntegerField(blank=True, help_text='GPU units the organization may hold at once; no limit if empty', null=True),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='quota_ram',
+            field=models.PositiveIntegerField(blank=True, help_text='RAM in GB the organization may hold at once; no limit if empty', null=True),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='weight',
+            field=models.PositiveIntegerField(default=1, help_text='Relative share of contended capacity', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(condition=models.Q(('status', 'RUNNING')), fields=['cluster', 'priority_rank'], include=('id', 'priority', 'required_ram', 'required_cpu', 'required_gpu', 'updated_at', 'organization'), name='deployment_running_idx'),
+        ),
+    ]
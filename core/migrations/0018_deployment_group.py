@@ -0,0 +1,42 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_organization_fair_share'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeploymentGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='deployment',
+            name='deployment_running_idx',
+        ),
+        migrations.AddField(
+            model_name='deploymentgroup',
+            name='created_by',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deployment_groups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='group',
+            field=models.ForeignKey(blank=True, help_text='Gang the deployment is admitted and preempted with, all or nothing', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deployments', to='core.deploymentgroup'),
+        ),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(condition=models.Q(('status', 'RUNNING')), fields=['cluster', 'priority_rank'], include=('id', 'priority', 'required_ram', 'required_cpu', 'required_gpu', 'updated_at', 'organization', 'group'), name='deployment_running_idx'),
+        ),
+    ]
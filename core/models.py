@@ -1,12 +1,66 @@
-from django.db import models
+from django.core.validators import MinValueValidator
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
+class OrganizationQuerySet(models.QuerySet):
+    def adjust(self, ram, cpu, gpu):
+        """Shift the usage counters of every organization in the queryset by the given deltas.
+
+        Like ``ClusterQuerySet.adjust`` this is one conditional UPDATE: it only
+        matches rows where usage stays at or above zero and, for a resource
+        with a quota, at or below it. Returns the number of organizations
+        that were updated.
+        """
+        conditions = models.Q()
+        for resource, amount in (('ram', ram), ('cpu', cpu), ('gpu', gpu)):
+            conditions &= models.Q(**{f'allocated_{resource}__gte': -amount})
+            if amount > 0:
+                conditions &= (
+                    models.Q(**{f'quota_{resource}__isnull': True}) |
+                    models.Q(**{f'allocated_{resource}__lte': F(f'quota_{resource}') - amount})
+                )
+        return self.filter(conditions).update(
+            allocated_ram=F('allocated_ram') + ram,
+            allocated_cpu=F('allocated_cpu') + cpu,
+            allocated_gpu=F('allocated_gpu') + gpu,
+        )
+
+    def allocate(self, ram, cpu, gpu):
+        return self.adjust(ram, cpu, gpu)
+
+    def release(self, ram, cpu, gpu):
+        return self.adjust(-ram, -cpu, -gpu)
+
+    def for_member(self, user):
+        """Organizations ``user`` created or joined."""
+        return self.filter(models.Q(created_by=user) | models.Q(members__user=user)).distinct()
+
+
 class Organization(models.Model):
     name = models.CharField(max_length=255)
     invite_code = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='organizations')
     created_at = models.DateTimeField(auto_now_add=True)
+    quota_ram = models.PositiveIntegerField(
+        null=True, blank=True, help_text="RAM in GB the organization may hold at once; no limit if empty"
+    )
+    quota_cpu = models.PositiveIntegerField(
+        null=True, blank=True, help_text="CPU cores the organization may hold at once; no limit if empty"
+    )
+    quota_gpu = models.PositiveIntegerField(
+        null=True, blank=True, help_text="GPU units the organization may hold at once; no limit if empty"
+    )
+    weight = models.PositiveIntegerField(
+        default=1, validators=[MinValueValidator(1)], help_text="Relative share of contended capacity"
+    )
+    allocated_ram = models.IntegerField(default=0, editable=False)
+    allocated_cpu = models.IntegerField(default=0, editable=False)
+    allocated_gpu = models.IntegerField(default=0, editable=False)
+
+    objects = OrganizationQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -22,6 +76,41 @@ class OrganizationMember(models.Model):
     def __str__(self):
         return f"{self.user.username} in {self.organization.name}"
 
+class ClusterQuerySet(models.QuerySet):
+    def adjust(self, ram, cpu, gpu):
+        """Shift the allocation of every cluster in the queryset by the given deltas.
+
+        The change is a single conditional UPDATE that only matches rows where the
+        new allocation stays between zero and the cluster total, so concurrent
+        workers can never over-commit or double-release a cluster. Each update
+        bumps ``version`` and refreshes the cached capacity snapshot once the
+        transaction commits. Returns the number of clusters that were updated.
+        """
+        updated = self.filter(
+            allocated_ram__gte=-ram,
+            allocated_cpu__gte=-cpu,
+            allocated_gpu__gte=-gpu,
+            allocated_ram__lte=F('total_ram') - ram,
+            allocated_cpu__lte=F('total_cpu') - cpu,
+            allocated_gpu__lte=F('total_gpu') - gpu,
+        ).update(
+            allocated_ram=F('allocated_ram') + ram,
+            allocated_cpu=F('allocated_cpu') + cpu,
+            allocated_gpu=F('allocated_gpu') + gpu,
+            version=F('version') + 1,
+        )
+        if updated:
+            from .capacity import write_through
+            write_through(self)
+        return updated
+
+    def allocate(self, ram, cpu, gpu):
+        return self.adjust(ram, cpu, gpu)
+
+    def release(self, ram, cpu, gpu):
+        return self.adjust(-ram, -cpu, -gpu)
+
+
 class Cluster(models.Model):
     name = models.CharField(max_length=255)
     total_ram = models.IntegerField(help_text="Total RAM in GB")
@@ -30,12 +119,42 @@ class Cluster(models.Model):
     allocated_ram = models.IntegerField(default=0)
     allocated_cpu = models.IntegerField(default=0)
     allocated_gpu = models.IntegerField(default=0)
+    version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Bumped on every capacity change; orders cached capacity snapshots"
+    )
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='clusters')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ClusterQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        bump = not self._state.adding
+        if bump:
+            self.version = F('version') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version'}
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
+
+    def apply_allocation(self, ram, cpu, gpu):
+        """Mirror a successful ledger update on this in-memory instance"""
+        self.allocated_ram += ram
+        self.allocated_cpu += cpu
+        self.allocated_gpu += gpu
+
     @property
     def available_ram(self):
         return self.total_ram - self.allocated_ram
@@ -49,17 +168,31 @@ class Cluster(models.Model):
         return self.total_gpu - self.allocated_gpu
 
 
+class DeploymentGroup(models.Model):
+    """Deployments that are only ever started together (gang scheduling, see core.gangs)."""
+    name = models.CharField(max_length=255)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='deployment_groups')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
 class Deployment(models.Model):
     class Status(models.TextChoices):
         PENDING = 'PENDING', 'Pending'
         RUNNING = 'RUNNING', 'Running'
         COMPLETED = 'COMPLETED', 'Completed'
+        FAILED = 'FAILED', 'Failed'
+        CANCELLED = 'CANCELLED', 'Cancelled'
 
     class Priority(models.TextChoices):
         LOW = 'LOW', 'Low'
         MEDIUM = 'MEDIUM', 'Medium'
         HIGH = 'HIGH', 'High'
 
+    PRIORITY_RANKS = {'LOW': 1, 'MEDIUM': 2, 'HIGH': 3}
+
     docker_image_path = models.URLField()
     required_ram = models.IntegerField()
     required_cpu = models.IntegerField()
@@ -70,24 +203,181 @@ class Deployment(models.Model):
         related_name='dependent_deployments',
         blank=True
     )
+    unmet_dependencies = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Number of dependencies that have not completed yet"
+    )
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
     priority = models.CharField(max_length=20, choices=Priority.choices, default=Priority.MEDIUM)
-    cluster = models.ForeignKey(Cluster, on_delete=models.CASCADE, related_name='deployments')
+    priority_rank = models.PositiveSmallIntegerField(
+        default=2,
+        editable=False,
+        help_text="Numeric priority (higher runs first), kept in sync with priority on save"
+    )
+    cluster = models.ForeignKey(
+        Cluster,
+        on_delete=models.CASCADE,
+        related_name='deployments',
+        null=True,
+        blank=True,
+        help_text="Leave empty to let the scheduler place the deployment"
+    )
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.SET_NULL,
+        related_name='deployments',
+        null=True,
+        blank=True,
+        help_text="Organization whose quota and fair share the deployment counts against"
+    )
+    group = models.ForeignKey(
+        DeploymentGroup,
+        on_delete=models.SET_NULL,
+        related_name='deployments',
+        null=True,
+        blank=True,
+        help_text="Gang the deployment is admitted and preempted with, all or nothing"
+    )
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    pending_since = models.DateTimeField(
+        default=timezone.now,
+        help_text="When the deployment last started waiting to be scheduled"
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Scheduling attempts that found the deployment blocked since it last became pending"
+    )
+
+    class Meta:
+        indexes = [
+            # Filtered, newest-first listings (see IdCursorPagination).
+            models.Index(fields=['status', '-id'], name='deployment_status_id_idx'),
+            models.Index(fields=['priority', '-id'], name='deployment_priority_id_idx'),
+            models.Index(fields=['cluster', '-id'], name='deployment_cluster_id_idx'),
+            # Scheduler access paths. Preemption candidates are RUNNING
+            # deployments of one cluster below a priority rank; the covered
+            # columns are what victim selection reads.
+            models.Index(fields=['cluster', 'status'], name='deployment_cluster_status_idx'),
+            models.Index(
+                fields=['cluster', 'priority_rank'],
+                include=[
+                    'id', 'priority', 'required_ram', 'required_cpu', 'required_gpu', 'updated_at', 'organization',
+                    'group',
+                ],
+                condition=models.Q(status='RUNNING'),
+                name='deployment_running_idx',
+            ),
+            models.Index(
+                fields=['cluster', '-priority_rank', 'created_at'],
+                condition=models.Q(status='PENDING'),
+                name='deployment_pending_idx',
+            ),
+            models.Index(
+                fields=['-priority_rank', 'created_at'],
+                condition=models.Q(status='PENDING', cluster__isnull=True, unmet_dependencies=0),
+                name='deployment_unplaced_idx',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.priority_rank = self.PRIORITY_RANKS[self.priority]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'priority' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'priority_rank'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def _mirror_allocation(self, sign):
+        if Deployment.cluster.is_cached(self):
+            self.cluster.apply_allocation(
+                sign * self.required_ram, sign * self.required_cpu, sign * self.required_gpu
+            )
+
+    def allocate(self):
+        """Atomically claim resources on the cluster and mark the deployment RUNNING.
+
+        Returns False without changing anything if the deployment is no longer
+        PENDING, the cluster does not have enough free capacity or its
+        organization would go over quota.
+        """
+        with transaction.atomic():
+            claimed = Deployment.objects.filter(pk=self.pk, status=self.Status.PENDING).update(
+                status=self.Status.RUNNING, updated_at=timezone.now()
+            )
+            if not claimed:
+                return False
+            allocated = Cluster.objects.filter(pk=self.cluster_id).allocate(
+                self.required_ram, self.required_cpu, self.required_gpu
+            )
+            if allocated and self.organization_id is not None:
+                allocated = Organization.objects.filter(pk=self.organization_id).allocate(
+                    self.required_ram, self.required_cpu, self.required_gpu
+                )
+            if not allocated:
+                transaction.set_rollback(True)
+                return False
+        self.status = self.Status.RUNNING
+        self._mirror_allocation(1)
+        from .events import deployments_changed
+        deployments_changed([self])
+        return True
 
     def release_resources(self):
         """Release allocated resources back to the cluster"""
-        self.cluster.allocated_ram -= self.required_ram
-        self.cluster.allocated_cpu -= self.required_cpu
-        self.cluster.allocated_gpu -= self.required_gpu
-        self.cluster.save()
+        with transaction.atomic():
+            now = timezone.now()
+            released = Deployment.objects.filter(pk=self.pk, status=self.Status.RUNNING).update(
+                status=self.Status.PENDING, pending_since=now, attempts=0, updated_at=now
+            )
+            if released:
+                Cluster.objects.filter(pk=self.cluster_id).release(
+                    self.required_ram, self.required_cpu, self.required_gpu
+                )
+                if self.organization_id is not None:
+                    Organization.objects.filter(pk=self.organization_id).release(
+                        self.required_ram, self.required_cpu, self.required_gpu
+                    )
         self.status = self.Status.PENDING
-        self.save()
+        if released:
+            self.pending_since = now
+            self.attempts = 0
+            self._mirror_allocation(-1)
+            from .scheduler import capacity_freed, quota_freed
+            from .events import deployments_changed
+            capacity_freed(self.cluster_id)
+            quota_freed(self.organization_id, self.cluster_id)
+            deployments_changed([self])
+        return bool(released)
+
     def __str__(self):
         return f"{self.docker_image_path} ({self.status})"
 
+class ClaimsUser(User):
+    """A ``User`` rebuilt from JWT claims without a database lookup.
+
+    It carries the id, username and email from the token plus the roles in
+    ``claimed_roles``; it can be assigned to foreign keys but never saved.
+    """
+
+    class Meta:
+        proxy = True
+
+    def save(self, *args, **kwargs):
+        raise TypeError("Users built from token claims are read-only")
+
+    def delete(self, *args, **kwargs):
+        raise TypeError("Users built from token claims are read-only")
+
+
 class Role(models.Model):
     class RoleType(models.TextChoices):
         ADMIN = 'ADMIN', 'Admin'
@@ -1,20 +1,22 @@
 from rest_framework import permissions
 
+from .roles import request_roles
+
 
 class IsAdmin(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Admin').exists()
+        return request_roles(request).in_group('Admin')
 
 class IsDeveloper(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Admin').exists() or request.user.groups.filter(name='Developer').exists()
+        return request_roles(request).in_group('Admin', 'Developer')
 
 class IsViewer(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Admin').exists() or request.user.groups.filter(name='Developer').exists() or request.user.groups.filter(name='Viewer').exists()
+        return request_roles(request).in_group('Admin', 'Developer', 'Viewer')
 
 class IsAdminOrReadOnly(permissions.BasePermission):
     def has_permission(self, request, view):
         if request.method in permissions.SAFE_METHODS:
             return IsViewer().has_permission(request, view)
-        return IsAdmin().has_permission(request, view)
\ No newline at end of file
+        return IsAdmin().has_permission(request, view)
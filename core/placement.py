@@ -0,0 +1,85 @@
+from django.conf import settings
+
+from .models import Cluster
+
+STRATEGIES = {}
+
+CAPACITY_FIELDS = (
+    'id',
+    'total_ram', 'total_cpu', 'total_gpu',
+    'allocated_ram', 'allocated_cpu', 'allocated_gpu',
+)
+
+
+def register_strategy(name):
+    """Register a placement strategy under ``name``.
+
+    A strategy is called as ``strategy(free, total, demand)`` with three
+    (ram, cpu, gpu) tuples for a cluster that can fit the demand, and returns
+    a sort key; the cluster with the lowest key wins.
+    """
+    def decorator(func):
+        STRATEGIES[name] = func
+        return func
+    return decorator
+
+
+def _leftover(free, total, demand):
+    return sum((f - d) / t for f, t, d in zip(free, total, demand) if t)
+
+
+@register_strategy('best_fit')
+def best_fit(free, total, demand):
+    return _leftover(free, total, demand)
+
+
+@register_strategy('worst_fit')
+def worst_fit(free, total, demand):
+    return -_leftover(free, total, demand)
+
+
+@register_strategy('gpu_affinity')
+def gpu_affinity(free, total, demand):
+    # GPU work is packed tightly onto GPU clusters; CPU-only work is steered
+    # towards clusters with the fewest GPUs so those stay available.
+    if demand[2]:
+        return (free[2] - demand[2], _leftover(free, total, demand))
+    return (total[2], _leftover(free, total, demand))
+
+
+@register_strategy('drf')
+def dominant_resource_fairness(free, total, demand):
+    # Place where the cluster's dominant share after placement is smallest.
+    return max((t - f + d) / t for f, t, d in zip(free, total, demand) if t)
+
+
+def default_strategy():
+    return getattr(settings, 'SCHEDULER_PLACEMENT_STRATEGY', 'best_fit')
+
+
+def cluster_capacities(queryset=None):
+    """Load ``(id, free, total)`` for every cluster in one query."""
+    queryset = Cluster.objects.all() if queryset is None else queryset
+    return [
+        (row[0], [row[1] - row[4], row[2] - row[5], row[3] - row[6]], row[1:4])
+        for row in queryset.values_list(*CAPACITY_FIELDS)
+    ]
+
+
+def choose_cluster(demand, capacities, strategy=None):
+    """Pick the cluster for ``demand`` from ``cluster_capacities()`` rows.
+
+    Clusters without room for the demand are skipped; returns the winning row
+    or None if nothing fits.
+    """
+    score = STRATEGIES[strategy or default_strategy()]
+    best = None
+    best_key = None
+    for row in capacities:
+        free = row[1]
+        if free[0] < demand[0] or free[1] < demand[1] or free[2] < demand[2]:
+            continue
+        key = score(free, row[2], demand)
+        if best is None or key < best_key:
+            best, best_key = row, key
+    return best
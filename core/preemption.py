@@ -0,0 +1,139 @@
+from django.utils import timezone
+
+PRIORITY_COST = {'LOW': 1.0, 'MEDIUM': 4.0, 'HIGH': 16.0}
+RUNTIME_COST_PER_HOUR = 0.1
+SEARCH_WIDTH = 16
+SEARCH_BUDGET = 2000
+CANDIDATE_LIMIT = 256
+
+
+def _demand(deployment):
+    return (deployment.required_ram, deployment.required_cpu, deployment.required_gpu)
+
+
+def victim_cost(deployment, capacity, now):
+    """Cost of evicting a deployment.
+
+    Priority dominates; within a priority, bigger deployments (relative to the
+    cluster) and deployments that have been running longer cost more, since
+    they lose more work and take longer to place again.
+    """
+    size = sum(amount / total for amount, total in zip(_demand(deployment), capacity) if total)
+    runtime_hours = (now - deployment.updated_at).total_seconds() / 3600 if deployment.updated_at else 0
+    return PRIORITY_COST[deployment.priority] * (1 + size) + RUNTIME_COST_PER_HOUR * max(runtime_hours, 0)
+
+
+def _covers(freed, shortfall):
+    return all(f >= s for f, s in zip(freed, shortfall))
+
+
+def _usefulness(demand, shortfall):
+    return sum(min(amount, need) / need for amount, need in zip(demand, shortfall) if need > 0)
+
+
+def _prune(chosen, shortfall):
+    freed = [sum(c[1][i] for c in chosen) for i in range(3)]
+    kept = list(chosen)
+    for candidate in sorted(chosen, key=lambda c: -c[2]):
+        without = [f - d for f, d in zip(freed, candidate[1])]
+        if _covers(without, shortfall):
+            kept.remove(candidate)
+            freed = without
+    return kept
+
+
+def _search(candidates, shortfall, best_cost):
+    """Branch and bound over the most efficient candidates.
+
+    ``candidates`` are the scored tuples from ``select_victims`` ordered by cost.
+    Returns the cheapest covering subset found within ``SEARCH_BUDGET`` nodes
+    that beats ``best_cost``, or None.
+    """
+    suffix = [[0, 0, 0] for _ in range(len(candidates) + 1)]
+    for i in range(len(candidates) - 1, -1, -1):
+        suffix[i] = [suffix[i + 1][d] + candidates[i][1][d] for d in range(3)]
+
+    best = None
+    nodes = 0
+    stack = [(0, (0, 0, 0), 0.0, ())]
+    while stack and nodes < SEARCH_BUDGET:
+        index, freed, cost, chosen = stack.pop()
+        nodes += 1
+        if cost >= best_cost:
+            continue
+        if _covers(freed, shortfall):
+            best, best_cost = chosen, cost
+            continue
+        if index == len(candidates):
+            continue
+        if not _covers([f + s for f, s in zip(freed, suffix[index])], shortfall):
+            continue
+        candidate = candidates[index]
+        stack.append((index + 1, freed, cost, chosen))
+        stack.append((
+            index + 1,
+            tuple(f + d for f, d in zip(freed, candidate[1])),
+            cost + candidate[2],
+            chosen + (candidate,),
+        ))
+    return best
+
+
+def select_victims(candidates, shortfall, capacity, now=None, discount=None):
+    """Choose the cheapest set of deployments whose resources cover ``shortfall``.
+
+    ``candidates`` are the RUNNING deployments that may be preempted,
+    ``shortfall`` the (ram, cpu, gpu) still missing and ``capacity`` the
+    cluster totals used to normalise sizes. Everything runs in memory: a
+    greedy pass over the candidates ranked by usefulness per unit of cost gives
+    a covering set, redundant victims are pruned from it, and a bounded branch
+    and bound over the most efficient candidates then looks for a cheaper set.
+    Returns a list of deployments, or None if even evicting every candidate
+    would not free enough. ``discount``, if given, maps a candidate to a
+    multiplier on its cost (see ``core.fairshare.Shares.discount``).
+
+    ``candidates`` may be any iterable and should come cheapest priority
+    first: once ``CANDIDATE_LIMIT`` useful candidates have been scored and
+    together cover the shortfall, the rest are not looked at, so a scheduling
+    pass costs O(pending) selections of bounded size rather than
+    O(pending x running).
+    """
+    shortfall = tuple(max(need, 0) for need in shortfall)
+    if not any(shortfall):
+        return []
+    now = now or timezone.now()
+
+    scored = []
+    total = [0, 0, 0]
+    for deployment in candidates:
+        if len(scored) >= CANDIDATE_LIMIT and _covers(total, shortfall):
+            break
+        demand = _demand(deployment)
+        usefulness = _usefulness(demand, shortfall)
+        if usefulness == 0:
+            continue
+        cost = victim_cost(deployment, capacity, now)
+        if discount is not None:
+            cost *= discount(deployment)
+        scored.append((deployment, demand, cost, usefulness / cost))
+        total = [t + d for t, d in zip(total, demand)]
+    if not _covers(total, shortfall):
+        return None
+
+    scored.sort(key=lambda c: -c[3])
+    chosen = []
+    freed = [0, 0, 0]
+    for candidate in scored:
+        if _covers(freed, shortfall):
+            break
+        if _usefulness([min(d, max(s - f, 0)) for d, s, f in zip(candidate[1], shortfall, freed)], shortfall) == 0:
+            continue
+        chosen.append(candidate)
+        freed = [f + d for f, d in zip(freed, candidate[1])]
+    chosen = _prune(chosen, shortfall)
+
+    pool = sorted({id(c): c for c in scored[:SEARCH_WIDTH] + chosen}.values(), key=lambda c: c[2])
+    better = _search(pool, shortfall, sum(c[2] for c in chosen))
+    if better is not None:
+        chosen = list(better)
+    return [c[0] for c in chosen]
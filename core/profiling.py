@@ -0,0 +1,154 @@
+import contextvars
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TOP_QUERIES = 20
+
+_active = contextvars.ContextVar('query_profile', default=None)
+_trace_lock = threading.Lock()
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACE = re.compile(r'\s+')
+
+
+def enabled():
+    return getattr(settings, 'QUERY_PROFILING', False)
+
+
+def repeat_threshold():
+    return getattr(settings, 'QUERY_PROFILING_REPEAT_THRESHOLD', 5)
+
+
+def fingerprint(sql):
+    """``sql`` with literals and IN-list lengths normalised away, so a query fired in a loop has one fingerprint."""
+    sql = _STRING.sub('%s', sql)
+    sql = _NUMBER.sub('%s', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class QueryProfile:
+    """Queries run while a request or job was being handled, grouped by fingerprint."""
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.by_fingerprint = defaultdict(lambda: [0, 0.0])
+        self.started = time.perf_counter()
+        self.duration = None
+        self.token = None
+
+    def add(self, sql, seconds):
+        entry = self.by_fingerprint[fingerprint(sql)]
+        entry[0] += 1
+        entry[1] += seconds
+        self.count += 1
+        self.seconds += seconds
+
+    def repeated(self):
+        """Fingerprints run at least ``QUERY_PROFILING_REPEAT_THRESHOLD`` times: likely N+1 queries."""
+        threshold = repeat_threshold()
+        return sorted(
+            ((sql, count, seconds) for sql, (count, seconds) in self.by_fingerprint.items() if count >= threshold),
+            key=lambda entry: -entry[1],
+        )
+
+    def as_dict(self):
+        top = sorted(self.by_fingerprint.items(), key=lambda item: -item[1][1])[:TOP_QUERIES]
+        return {
+            'at': timezone.now().isoformat(),
+            'label': self.label,
+            'duration_ms': round((self.duration or 0) * 1000, 3),
+            'queries': self.count,
+            'db_ms': round(self.seconds * 1000, 3),
+            'n_plus_one': [
+                {'fingerprint': sql, 'count': count, 'db_ms': round(seconds * 1000, 3)}
+                for sql, count, seconds in self.repeated()
+            ],
+            'top': [
+                {'fingerprint': sql, 'count': count, 'db_ms': round(seconds * 1000, 3)}
+                for sql, (count, seconds) in top
+            ],
+        }
+
+
+def _record(execute, sql, params, many, context):
+    current = _active.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        current.add(sql, time.perf_counter() - started)
+
+
+def install(db_connection):
+    """Put the profiler on ``db_connection``; it only records while a profile is active.
+
+    Connections are per thread and async views run their queries on another
+    thread than the request, so every connection carries the wrapper and the
+    active profile travels in a context variable. It goes first in the list
+    so ``execute_wrapper`` blocks that pop the last wrapper are unaffected.
+    """
+    if _record not in db_connection.execute_wrappers:
+        db_connection.execute_wrappers.insert(0, _record)
+
+
+def _write_trace(profile):
+    path = getattr(settings, 'QUERY_PROFILING_TRACE_FILE', '')
+    if not path or random.random() >= getattr(settings, 'QUERY_PROFILING_SAMPLE_RATE', 0.01):
+        return
+    line = json.dumps(profile.as_dict()) + '\n'
+    try:
+        with _trace_lock, open(path, 'a') as trace:
+            trace.write(line)
+    except OSError:
+        logger.warning("Could not write query trace to %s", path, exc_info=True)
+
+
+def start(label):
+    """Begin profiling the current context; returns None when profiling is off."""
+    if not enabled():
+        return None
+    install(connection)
+    current = QueryProfile(label)
+    current.token = _active.set(current)
+    return current
+
+
+def stop(current):
+    """End ``current``: log likely N+1 patterns and maybe write a sampled trace."""
+    _active.reset(current.token)
+    current.duration = time.perf_counter() - current.started
+    for sql, count, seconds in current.repeated():
+        logger.warning(
+            "Possible N+1 in %s: %d queries (%.1f ms) of %s", current.label, count, seconds * 1000, sql
+        )
+    _write_trace(current)
+
+
+@contextmanager
+def profile(label):
+    """Profile the queries run inside the block; yields None when profiling is off."""
+    current = start(label)
+    try:
+        yield current
+    finally:
+        if current is not None:
+            stop(current)
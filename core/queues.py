@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+import django_rq
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rq.job import Job, JobStatus
+
+WAITING = (JobStatus.QUEUED, JobStatus.DEFERRED)
+
+_override = ContextVar('queue_backend', default=None)
+
+
+class RQBackend:
+    """Scheduler jobs on the django_rq queues, run by RQ workers."""
+
+    # Jobs run on workers, outside the enqueuing transaction.
+    in_process = False
+
+    def get_queue(self, name='default'):
+        return django_rq.get_queue(name)
+
+    def enqueue_many(self, jobs):
+        """Enqueue ``(queue, func, args, job_id)`` tuples with one Redis pipeline.
+
+        Jobs with an id that is already waiting in its queue are skipped, like
+        ``core.scheduler`` wakes are; their statuses are fetched in one
+        pipelined round trip.
+        """
+        connection = self.get_queue('default').connection
+        ids = [job_id for _, _, _, job_id in jobs if job_id]
+        waiting = {
+            found.id for found in Job.fetch_many(ids, connection=connection)
+            if found is not None and found.get_status(refresh=False) in WAITING
+        } if ids else set()
+        by_queue = {}
+        for queue_name, func, args, job_id in jobs:
+            if job_id not in waiting:
+                by_queue.setdefault(queue_name, []).append(
+                    self.get_queue(queue_name).prepare_data(func, args=args, job_id=job_id)
+                )
+        with connection.pipeline() as pipe:
+            for queue_name, job_datas in by_queue.items():
+                self.get_queue(queue_name).enqueue_many(job_datas, pipeline=pipe)
+            pipe.execute()
+
+
+@lru_cache
+def _configured(path):
+    return import_string(path)()
+
+
+def backend():
+    """The backend scheduler jobs go to: the one ``using`` installed, else ``SCHEDULER_QUEUE_BACKEND``."""
+    override = _override.get()
+    if override is not None:
+        return override
+    return _configured(getattr(settings, 'SCHEDULER_QUEUE_BACKEND', 'core.queues.RQBackend'))
+
+
+@contextmanager
+def using(instance):
+    """Send the scheduler jobs of the current context to ``instance`` inside the block."""
+    token = _override.set(instance)
+    try:
+        yield instance
+    finally:
+        _override.reset(token)
+
+
+def get_queue(name='default'):
+    return backend().get_queue(name)
+
+
+def enqueue_many(jobs):
+    backend().enqueue_many(jobs)
+
+
+def on_commit(func):
+    """Call ``func`` once the current transaction commits, or right away under autocommit.
+
+    An ``in_process`` backend runs its jobs between the caller's own
+    statements, where the uncommitted state is visible, so ``func`` is called
+    right away; this keeps work inside a transaction that is rolled back at
+    the end (e.g. a benchmark run) schedulable.
+    """
+    if backend().in_process:
+        func()
+    else:
+        transaction.on_commit(func)
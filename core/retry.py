@@ -0,0 +1,66 @@
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from rq.job import JobStatus
+
+from . import queues
+
+DEPENDENCIES = 'dependencies'
+RESOURCES = 'resources'
+QUOTA = 'quota'
+
+DEFAULT_POLICIES = {
+    DEPENDENCIES: {'base': 30, 'factor': 2, 'cap': 900, 'jitter': 0.5},
+    RESOURCES: {'base': 5, 'factor': 2, 'cap': 300, 'jitter': 0.5},
+    QUOTA: {'base': 15, 'factor': 2, 'cap': 600, 'jitter': 0.5},
+}
+
+
+class RetryPolicy:
+    """Capped exponential backoff with jitter.
+
+    The delay before retry ``attempt`` (0-based) is ``base * factor ** attempt``
+    seconds, capped at ``cap``; the last ``jitter`` fraction of it is
+    randomised so that deployments blocked at the same moment do not all come
+    back at once.
+    """
+
+    def __init__(self, base, factor=2, cap=300, jitter=0.5):
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        delay = min(self.cap, self.base * self.factor ** min(attempt, 32))
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+
+def policy_for(reason):
+    overrides = getattr(settings, 'SCHEDULER_RETRY_POLICIES', {})
+    return RetryPolicy(**{**DEFAULT_POLICIES[reason], **overrides.get(reason, {})})
+
+
+def retry_job_id(deployment):
+    if getattr(deployment, 'group_id', None) is not None:
+        # Gangs are retried as one unit, whichever member the attempt ran for.
+        return f'retry-group-{deployment.group_id}-{deployment.attempts}'
+    return f'retry-deployment-{deployment.id}-{deployment.attempts}'
+
+
+def schedule_retry(func, deployment, reason, queue_name='default'):
+    """Schedule ``func(deployment.id)`` after the backoff delay for ``reason``.
+
+    Retries live in RQ's scheduled job registry under one job id per
+    deployment (or gang) and attempt, so concurrent failures of the same
+    attempt leave a single retry behind. Returns the scheduled job, or None if that retry
+    was already scheduled.
+    """
+    queue = queues.get_queue(queue_name)
+    job_id = retry_job_id(deployment)
+    pending_job = queue.fetch_job(job_id)
+    if pending_job is not None and pending_job.get_status() in (JobStatus.SCHEDULED, JobStatus.QUEUED):
+        return None
+    seconds = policy_for(reason).delay(deployment.attempts)
+    return queue.enqueue_in(timedelta(seconds=seconds), func, deployment.id, job_id=job_id)
@@ -0,0 +1,132 @@
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django_redis.exceptions import ConnectionInterrupted
+
+from .models import Role
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'user-roles-generation'
+
+
+class ResolvedRoles:
+    """A user's group names and per-organization ``Role`` values."""
+
+    def __init__(self, groups=(), organizations=None):
+        self.groups = frozenset(groups)
+        self.organizations = dict(organizations or {})
+
+    def in_group(self, *names):
+        return not self.groups.isdisjoint(names)
+
+    def role_in(self, organization_id):
+        return self.organizations.get(organization_id)
+
+
+NO_ROLES = ResolvedRoles()
+
+
+def cache_key(user_id):
+    return f'user-roles:{user_id}'
+
+
+def claims_version_key(user_id):
+    return f'user-claims-version:{user_id}'
+
+
+def claims_version(user_id):
+    """Current version of a user's role claims (see ``core.authentication``), created on first use."""
+    key = claims_version_key(user_id)
+    cache.add(key, uuid.uuid4().hex, None)
+    return cache.get(key)
+
+
+def current_generation():
+    return cache.get(GENERATION_KEY)
+
+
+def ttl():
+    return getattr(settings, 'ROLE_CACHE_TTL', 300)
+
+
+def _load(user):
+    return ResolvedRoles(
+        user.groups.values_list('name', flat=True),
+        Role.objects.filter(user=user).values_list('organization_id', 'role'),
+    )
+
+
+def resolve(user):
+    """Load the roles of ``user``, from the cache where possible.
+
+    The cache entry is tagged with the current group generation, which any
+    change to a ``Group`` bumps. Entries are only written outside transactions
+    so uncommitted membership changes can never be cached.
+    """
+    if not user or not user.is_authenticated:
+        return NO_ROLES
+    claimed = getattr(user, 'claimed_roles', None)
+    if claimed is not None:
+        return claimed
+    key = cache_key(user.pk)
+    try:
+        cached = cache.get_many([GENERATION_KEY, key])
+    except ConnectionInterrupted:
+        logger.warning("Role cache read failed, loading roles from the database", exc_info=True)
+        return _load(user)
+    generation = cached.get(GENERATION_KEY)
+    entry = cached.get(key)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+
+    roles = _load(user)
+    if not connection.in_atomic_block:
+        try:
+            cache.set(key, (generation, roles), ttl())
+        except ConnectionInterrupted:
+            logger.warning("Role cache write failed", exc_info=True)
+    return roles
+
+
+def request_roles(request):
+    """Roles of the requesting user, resolved at most once per request."""
+    roles = getattr(request, '_resolved_roles', None)
+    if roles is None:
+        roles = resolve(request.user)
+        request._resolved_roles = roles
+    return roles
+
+
+def _expire(user_ids):
+    try:
+        cache.delete_many([cache_key(user_id) for user_id in user_ids])
+        cache.set_many({claims_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, None)
+    except ConnectionInterrupted:
+        logger.warning("Role cache invalidation failed", exc_info=True)
+
+
+def invalidate(user_ids):
+    """Drop cached roles and outdate role claims in issued tokens, now and again on commit.
+
+    The second pass catches entries that a concurrent request re-read from
+    the committed (old) state while the change was still in flight.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    _expire(user_ids)
+    transaction.on_commit(lambda: _expire(user_ids))
+
+
+def invalidate_all():
+    def bump():
+        try:
+            cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+        except ConnectionInterrupted:
+            logger.warning("Role cache invalidation failed", exc_info=True)
+    bump()
+    transaction.on_commit(bump)
@@ -0,0 +1,502 @@
+import itertools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django_rq import job
+
+from .models import Cluster, Deployment, Organization
+from . import capacity, events, fairshare, gangs, metrics
+from .placement import choose_cluster, cluster_capacities
+from .preemption import select_victims
+from . import queues, retry
+from .retry import schedule_retry
+
+logger = logging.getLogger(__name__)
+
+EVENT_MODE = 'event'
+POLL_MODE = 'poll'
+
+PRIORITY_ORDER = Deployment.PRIORITY_RANKS
+PRIORITY_QUEUES = {3: 'high', 2: 'medium', 1: 'low'}
+
+_mode = ContextVar('scheduler_mode', default=None)
+
+
+def scheduler_mode():
+    return _mode.get() or getattr(settings, 'SCHEDULER_MODE', EVENT_MODE)
+
+
+@contextmanager
+def using_mode(mode):
+    """Schedule in ``mode`` inside the block, in this context only; None keeps ``SCHEDULER_MODE``."""
+    token = _mode.set(mode)
+    try:
+        yield
+    finally:
+        _mode.reset(token)
+
+
+def effective_priority(deployment, now=None):
+    """Priority rank of a deployment, raised one level per aging interval spent PENDING.
+
+    Aging only affects the order in which waiting deployments are dispatched
+    and admitted; preemption always compares the submitted priority.
+    """
+    rank = deployment.priority_rank
+    interval = getattr(settings, 'SCHEDULER_AGING_INTERVAL', 0)
+    if interval and deployment.status == Deployment.Status.PENDING:
+        waited = ((now or timezone.now()) - deployment.pending_since).total_seconds()
+        rank = min(rank + int(waited // interval), PRIORITY_ORDER['HIGH'])
+    return rank
+
+
+def dispatch(deployment):
+    """Enqueue a single-deployment scheduling attempt on the queue for its priority.
+
+    A ``gangs.Gang`` gets one attempt for the whole group, coalesced like a wake.
+    Like a wake, the attempt is enqueued once the current transaction commits,
+    so a preempted victim is never picked up while it still reads RUNNING.
+    """
+    queue = PRIORITY_QUEUES[effective_priority(deployment)]
+    if isinstance(deployment, gangs.Gang):
+        _wake(process_deployment, group_job_id(deployment.group_id), deployment.id, queue_name=queue)
+    else:
+        queues.on_commit(lambda: queues.get_queue(queue).enqueue(process_deployment, deployment.id))
+
+
+def group_job_id(group_id):
+    return f'process-group-{group_id}'
+
+
+PREEMPTION_FIELDS = (
+    'id', 'cluster_id', 'priority', 'priority_rank',
+    'required_ram', 'required_cpu', 'required_gpu', 'updated_at', 'organization_id', 'group_id',
+)
+
+
+def find_preemptable_deployments(cluster, current_priority):
+    # Only reads columns covered by deployment_running_idx.
+    return Deployment.objects.filter(
+        cluster=cluster,
+        status=Deployment.Status.RUNNING,
+        priority_rank__lt=PRIORITY_ORDER[current_priority],
+    ).only(*PREEMPTION_FIELDS).order_by('priority_rank')
+
+
+def requeue(deployment, reason):
+    """Hand a deployment that cannot run yet back to the scheduler.
+
+    In poll mode a retry is scheduled after a backoff that depends on
+    ``reason`` and grows with the number of failed attempts. In event mode it
+    is parked as PENDING and only looked at again once ``wake_cluster`` fires
+    for its cluster. A gang is requeued as one unit: its members' attempts
+    move together and a single retry is scheduled for the group.
+    """
+    members = gangs.members([deployment])
+    Deployment.objects.filter(pk__in=[member.pk for member in members], status=Deployment.Status.PENDING).update(
+        attempts=F('attempts') + 1
+    )
+    metrics.requeues.inc(reason=reason)
+    if scheduler_mode() == POLL_MODE:
+        schedule_retry(
+            process_deployment,
+            deployment,
+            reason,
+            PRIORITY_QUEUES[effective_priority(deployment)],
+        )
+    for member in members:
+        member.attempts += 1
+
+
+def _wake(func, job_id, *args, queue_name='default'):
+    """Enqueue ``func`` under ``job_id`` when the current transaction commits, unless it is already waiting.
+
+    Deferring to the commit keeps a worker from running the pass against the
+    state from before the change that woke it, and using up the coalesced
+    job while it does; a rolled back change wakes nothing.
+    """
+    def enqueue():
+        queue = queues.get_queue(queue_name)
+        pending_job = queue.fetch_job(job_id)
+        if pending_job is not None and pending_job.get_status() in queues.WAITING:
+            return
+        queue.enqueue(func, *args, job_id=job_id)
+
+    queues.on_commit(enqueue)
+
+
+def wake_cluster(cluster_id):
+    """Queue a single re-evaluation pass over the parked deployments of a cluster.
+
+    Wakes are coalesced: if a pass for the cluster is already waiting in the
+    queue, it will see the new state anyway and nothing else is enqueued.
+    """
+    if scheduler_mode() != EVENT_MODE:
+        return
+    _wake(schedule_cluster, f'schedule-cluster-{cluster_id}', cluster_id)
+
+
+def wake_placement():
+    if scheduler_mode() != EVENT_MODE:
+        return
+    _wake(place_unplaced, 'place-unplaced')
+
+
+def capacity_freed(cluster_id):
+    """Wake everything that could use capacity that just became free on a cluster."""
+    wake_cluster(cluster_id)
+    wake_placement()
+
+
+def quota_freed(organization_id, cluster_id=None):
+    """Wake the parked deployments of an organization that just released resources.
+
+    Those on ``cluster_id`` are covered by the ``capacity_freed`` wake for it.
+    """
+    if organization_id is None or scheduler_mode() != EVENT_MODE:
+        return
+    parked = Deployment.objects.filter(organization_id=organization_id, status=Deployment.Status.PENDING)
+    if cluster_id is not None:
+        parked = parked.exclude(cluster_id=cluster_id)
+    wake_deployments(parked)
+
+
+def wake_deployments(deployments):
+    cluster_ids = deployments.values_list('cluster_id', flat=True).distinct()
+    for cluster_id in cluster_ids:
+        if cluster_id is None:
+            wake_placement()
+        else:
+            wake_cluster(cluster_id)
+
+
+def submit(deployment):
+    """Dispatch a newly created deployment to the scheduler."""
+    if scheduler_mode() != EVENT_MODE:
+        dispatch(deployment)
+    elif deployment.cluster_id is None:
+        wake_placement()
+    else:
+        wake_cluster(deployment.cluster_id)
+
+
+def submit_many(deployments):
+    """Dispatch a batch of newly created deployments to the scheduler in one pipeline.
+
+    Event mode wakes each affected cluster (and the placement pass) once; poll
+    mode queues one attempt per deployment on its priority queue.
+    """
+    if scheduler_mode() != EVENT_MODE:
+        jobs = [
+            (
+                PRIORITY_QUEUES[effective_priority(unit)], process_deployment, (unit.id,),
+                group_job_id(unit.group_id) if isinstance(unit, gangs.Gang) else None,
+            )
+            for unit in gangs.bundle(deployments)
+        ]
+    else:
+        cluster_ids = {deployment.cluster_id for deployment in deployments}
+        jobs = [
+            ('default', schedule_cluster, (cluster_id,), f'schedule-cluster-{cluster_id}')
+            for cluster_id in sorted(cluster_ids - {None})
+        ]
+        if None in cluster_ids:
+            jobs.append(('default', place_unplaced, (), 'place-unplaced'))
+    if jobs:
+        queues.enqueue_many(jobs)
+
+
+def _demand(deployment):
+    return (deployment.required_ram, deployment.required_cpu, deployment.required_gpu)
+
+
+def place_deployment(deployment, capacities=None, strategy=None, shares=None):
+    """Pin an unplaced deployment (or ``gangs.Gang``) to the best cluster with room for it and start it.
+
+    ``capacities`` and ``shares`` may be shared across calls (see
+    ``cluster_capacities`` and ``fairshare.Shares``) and are updated in place
+    when the deployment is admitted. Returns False and leaves the deployment
+    unplaced if no cluster can take it right now or its organization is at
+    quota. A gang is pinned to one cluster as a whole.
+    """
+    shares = fairshare.Shares.load([deployment.organization_id]) if shares is None else shares
+    if not shares.within_quota(deployment):
+        return False
+    capacities = cluster_capacities() if capacities is None else capacities
+    row = choose_cluster(_demand(deployment), capacities, strategy)
+    if row is None:
+        return False
+    ids = [member.pk for member in gangs.members([deployment])]
+    with transaction.atomic():
+        pinned = Deployment.objects.filter(pk__in=ids, cluster__isnull=True).update(cluster_id=row[0])
+        deployment.cluster_id = row[0]
+        if pinned == len(ids) and deployment.allocate():
+            _take(row[1], deployment)
+            shares.take(deployment)
+            metrics.admitted(gangs.members([deployment]))
+            return True
+        transaction.set_rollback(True)
+    deployment.cluster_id = None
+    return False
+
+
+@job('default', timeout=3600)
+@metrics.instrumented('place_unplaced')
+def place_unplaced(strategy=None):
+    """Offer the free capacity of every cluster to unplaced PENDING deployments.
+
+    All cluster capacities and organization shares are read in one query
+    each and shared across the whole pass, highest (aged) priority first and
+    organizations taking turns by dominant share within a priority. Gangs
+    are placed as a whole once none of their members has unmet dependencies.
+    """
+    unplaced = [
+        unit for unit in gangs.bundle(
+            Deployment.objects.filter(
+                Q(unmet_dependencies=0) | Q(group__isnull=False),
+                cluster__isnull=True,
+                status=Deployment.Status.PENDING,
+            )
+        )
+        if not unit.unmet_dependencies
+    ]
+    if not unplaced:
+        return
+    capacities = cluster_capacities()
+    shares = fairshare.Shares.load(d.organization_id for d in unplaced)
+    now = timezone.now()
+    for deployment in fairshare.fair_order(unplaced, shares, lambda d: effective_priority(d, now)):
+        place_deployment(deployment, capacities, strategy, shares)
+
+
+def _fits(free, deployment):
+    return (
+        free[0] >= deployment.required_ram and
+        free[1] >= deployment.required_cpu and
+        free[2] >= deployment.required_gpu
+    )
+
+
+def _take(free, deployment):
+    free[0] -= deployment.required_ram
+    free[1] -= deployment.required_cpu
+    free[2] -= deployment.required_gpu
+
+
+def _shortfall(free, deployment):
+    return (
+        deployment.required_ram - free[0],
+        deployment.required_cpu - free[1],
+        deployment.required_gpu - free[2],
+    )
+
+
+def _give(free, deployment):
+    free[0] += deployment.required_ram
+    free[1] += deployment.required_cpu
+    free[2] += deployment.required_gpu
+
+
+@job('default', timeout=3600)
+@metrics.instrumented('schedule_cluster')
+def schedule_cluster(cluster_id):
+    """Place every parked deployment of a cluster in one in-memory pass.
+
+    The cluster row and its PENDING and RUNNING deployments are loaded up
+    front; deployments with no unmet dependencies are then admitted in
+    aged priority order, organizations taking turns by dominant share within
+    a priority (see ``fairshare.fair_order``), preempting lower-priority
+    RUNNING ones when that makes room and the fair-share rules allow it.
+    Deployments whose organization is at quota wait. Gangs are admitted and
+    preempted as one unit with their combined demand. The outcome is committed
+    as one net adjustment through the cluster and organization ledgers plus
+    conditional status UPDATEs; if another worker got there first the pass is
+    rolled back and woken again rather than over-committing.
+    """
+    cluster = Cluster.objects.get(id=cluster_id)
+    deployments = list(
+        Deployment.objects.filter(
+            cluster_id=cluster_id,
+            status__in=[Deployment.Status.PENDING, Deployment.Status.RUNNING],
+        ).order_by('-priority_rank', 'created_at')
+    )
+    pending = [
+        unit for unit in gangs.bundle(d for d in deployments if d.status == Deployment.Status.PENDING)
+        if not unit.unmet_dependencies
+    ]
+    if not pending:
+        return
+    running = gangs.bundle(d for d in reversed(deployments) if d.status == Deployment.Status.RUNNING)
+
+    capacity = (cluster.total_ram, cluster.total_cpu, cluster.total_gpu)
+    free = [cluster.available_ram, cluster.available_cpu, cluster.available_gpu]
+    shares = fairshare.Shares.load(d.organization_id for d in deployments)
+    now = timezone.now()
+    admitted = []
+    preempted = []
+    for deployment in fairshare.fair_order(pending, shares, lambda d: effective_priority(d, now)):
+        if not shares.within_quota(deployment):
+            continue
+        if not _fits(free, deployment):
+            # ``running`` is ordered lowest priority first, so the scan stops at the
+            # first one of equal or higher priority.
+            victims = select_victims(
+                (
+                    r for r in itertools.takewhile(lambda r: r.priority_rank < deployment.priority_rank, running)
+                    if shares.may_preempt(deployment, r)
+                ),
+                _shortfall(free, deployment),
+                capacity,
+                discount=shares.discount,
+            )
+            if victims is None:
+                continue
+            for victim in victims:
+                running.remove(victim)
+                preempted.append(victim)
+                _give(free, victim)
+                shares.give(victim)
+        _take(free, deployment)
+        shares.take(deployment)
+        admitted.append(deployment)
+
+    if not admitted:
+        return
+
+    preempted, admitted = gangs.members(preempted), gangs.members(admitted)
+    freed = [0, 0, 0]
+    for deployment in preempted:
+        _give(freed, deployment)
+    for deployment in admitted:
+        _take(freed, deployment)
+    with transaction.atomic():
+        committed = (
+            Deployment.objects.filter(
+                id__in=[d.id for d in preempted], status=Deployment.Status.RUNNING,
+            ).update(
+                status=Deployment.Status.PENDING, pending_since=now, attempts=0, updated_at=now,
+            ) == len(preempted) and
+            Deployment.objects.filter(
+                id__in=[d.id for d in admitted], status=Deployment.Status.PENDING,
+            ).update(status=Deployment.Status.RUNNING, updated_at=now) == len(admitted) and
+            Cluster.objects.filter(id=cluster_id).adjust(*[-amount for amount in freed]) == 1 and
+            all(
+                Organization.objects.filter(id=organization_id).adjust(*delta) == 1
+                for organization_id, delta in shares.deltas(admitted, preempted).items()
+            )
+        )
+        if not committed:
+            transaction.set_rollback(True)
+
+    if not committed:
+        wake_cluster(cluster_id)
+        return
+    for deployment in preempted:
+        deployment.status, deployment.pending_since, deployment.attempts = Deployment.Status.PENDING, now, 0
+    for deployment in admitted:
+        deployment.status = Deployment.Status.RUNNING
+    events.deployments_changed(preempted + admitted)
+    if preempted:
+        logger.info(
+            "Cluster %s pass preempted %s", cluster_id, ', '.join(str(deployment.id) for deployment in preempted)
+        )
+    metrics.preempted(preempted)
+    metrics.admitted(admitted)
+    for organization_id in {victim.organization_id for victim in preempted}:
+        quota_freed(organization_id, cluster_id)
+    if scheduler_mode() == POLL_MODE:
+        for victim in gangs.bundle(preempted):
+            dispatch(victim)
+
+
+@job('default', timeout=3600)
+@metrics.instrumented('process_deployment')
+def process_deployment(deployment_id):
+    deployment = Deployment.objects.get(id=deployment_id)
+    if deployment.group_id is not None:
+        # From here on the whole gang is handled as one deployment, even if
+        # the member this attempt was queued for has since been cancelled.
+        deployment = gangs.Gang.load(deployment.group_id)
+        if deployment is None:
+            return
+    elif deployment.status != Deployment.Status.PENDING:
+        return
+    shares = fairshare.Shares.load([deployment.organization_id])
+    if deployment.cluster_id is None:
+        if deployment.unmet_dependencies:
+            requeue(deployment, retry.DEPENDENCIES)
+        elif not shares.within_quota(deployment):
+            requeue(deployment, retry.QUOTA)
+        elif not place_deployment(deployment, shares=shares):
+            requeue(deployment, retry.RESOURCES)
+        return
+    # Served from the capacity cache; the ledger UPDATE in allocate() has
+    # the final say, so a stale snapshot can only cost a retry.
+    cluster = capacity.get(deployment.cluster_id)
+
+    logger.debug(
+        "Processing deployment %s (priority %s) on cluster %s: %s/%s GB RAM allocated",
+        deployment.id, deployment.priority, cluster.id, cluster.allocated_ram, cluster.total_ram,
+    )
+
+    def can_allocate(deployment):
+        return (
+            cluster.available_ram >= deployment.required_ram and
+            cluster.available_cpu >= deployment.required_cpu and
+            cluster.available_gpu >= deployment.required_gpu
+        )
+
+    if deployment.unmet_dependencies:
+        logger.debug("Deployment %s has unmet dependencies, re-queuing", deployment.id)
+        requeue(deployment, retry.DEPENDENCIES)
+        return
+    if not shares.within_quota(deployment):
+        logger.debug("Organization of deployment %s is at quota, re-queuing", deployment.id)
+        requeue(deployment, retry.QUOTA)
+        return
+    if not can_allocate(deployment) and deployment.priority_rank == min(PRIORITY_ORDER.values()):
+        # Nothing ranks below this deployment, so there is nothing to preempt.
+        logger.debug("Insufficient resources for deployment %s, re-queuing", deployment.id)
+        requeue(deployment, retry.RESOURCES)
+        return
+
+    with transaction.atomic():
+        if can_allocate(deployment) and deployment.allocate():
+            metrics.admitted(gangs.members([deployment]))
+            return
+
+        preemptable = gangs.bundle(find_preemptable_deployments(deployment.cluster_id, deployment.priority))
+        shares.include(victim.organization_id for victim in preemptable)
+
+        free = [cluster.available_ram, cluster.available_cpu, cluster.available_gpu]
+        victims = select_victims(
+            (victim for victim in preemptable if shares.may_preempt(deployment, victim)),
+            _shortfall(free, deployment),
+            (cluster.total_ram, cluster.total_cpu, cluster.total_gpu),
+            discount=shares.discount,
+        )
+
+        if victims is not None:
+            for victim in victims:
+                victim.release_resources()
+
+            if deployment.allocate():
+                preempted = gangs.members(victims)
+                logger.info(
+                    "Deployment %s preempted %s", deployment.id, ', '.join(str(victim.id) for victim in preempted)
+                )
+                metrics.preempted(preempted)
+                metrics.admitted(gangs.members([deployment]))
+                if scheduler_mode() == POLL_MODE:
+                    for victim in victims:
+                        dispatch(victim)
+                return
+            transaction.set_rollback(True)
+
+    logger.debug("Insufficient resources for deployment %s, re-queuing", deployment.id)
+    requeue(deployment, retry.RESOURCES)
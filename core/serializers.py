@@ -1,7 +1,14 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User, Group
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 from .models import Organization, Cluster, Deployment, Role
+from .authentication import add_role_claims, check_not_revoked
+from .roles import request_roles
+from . import fairshare
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -42,6 +49,23 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def get_token(cls, user):
         token = super().get_token(user)
         token['username'] = user.username
+        return add_role_claims(token, user)
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    def validate(self, attrs):
+        check_not_revoked(self.token_class(attrs['refresh']))
+        return super().validate(attrs)
+
+class LogoutSerializer(serializers.Serializer):
+    refresh = serializers.CharField(write_only=True)
+
+    def validate_refresh(self, value):
+        try:
+            token = RefreshToken(value)
+        except TokenError as e:
+            raise serializers.ValidationError(str(e))
+        if token.get(api_settings.USER_ID_CLAIM) != self.context['request'].user.pk:
+            raise serializers.ValidationError("Token belongs to another user.")
         return token
 
 class OrganizationSerializer(serializers.ModelSerializer):
@@ -50,7 +74,26 @@ class OrganizationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Organization
-        fields = ('id', 'name', 'invite_code', 'created_by', 'created_at')
+        fields = (
+            'id', 'name', 'invite_code', 'created_by', 'created_at',
+            'quota_ram', 'quota_cpu', 'quota_gpu', 'weight',
+        )
+        read_only_fields = ('quota_ram', 'quota_cpu', 'quota_gpu', 'weight')
+
+class OrganizationQuotaSerializer(serializers.ModelSerializer):
+    share = serializers.SerializerMethodField(help_text="Current dominant resource share divided by weight")
+
+    class Meta:
+        model = Organization
+        fields = (
+            'id', 'name',
+            'quota_ram', 'quota_cpu', 'quota_gpu', 'weight',
+            'allocated_ram', 'allocated_cpu', 'allocated_gpu', 'share',
+        )
+        read_only_fields = ('name', 'allocated_ram', 'allocated_cpu', 'allocated_gpu')
+
+    def get_share(self, organization):
+        return fairshare.Shares.of([organization]).share(organization.id)
 
 class JoinOrganizationSerializer(serializers.Serializer):
     invite_code = serializers.CharField()
@@ -84,21 +127,100 @@ class ClusterSerializer(serializers.ModelSerializer):
 class DeploymentSerializer(serializers.ModelSerializer):
     status = serializers.CharField(read_only=True)
     created_by = serializers.StringRelatedField(read_only=True)
-    cluster = serializers.PrimaryKeyRelatedField(queryset=Cluster.objects.all())
+    group = serializers.PrimaryKeyRelatedField(read_only=True)
+    cluster = serializers.PrimaryKeyRelatedField(
+        queryset=Cluster.objects.all(),
+        required=False,
+        allow_null=True
+    )
     dependencies = serializers.PrimaryKeyRelatedField(
         queryset=Deployment.objects.all(),
         many=True,
         required=False
     )
+    organization = serializers.PrimaryKeyRelatedField(
+        queryset=Organization.objects.all(),
+        required=False,
+        allow_null=True
+    )
     class Meta:
         model = Deployment
         fields = [
             'id', 'docker_image_path', 'status', 'priority',
             'required_ram', 'required_cpu', 'required_gpu',
-            'cluster', 'created_by', 'created_at', 'updated_at', 'dependencies'
+            'cluster', 'organization', 'group', 'created_by', 'created_at', 'updated_at', 'dependencies'
         ]
 
+    def validate_organization(self, organization):
+        """Only members of an organization (and admins) can charge deployments to it.
+
+        A batch passes the ids of the organizations the user belongs to as
+        ``context['member_organizations']`` instead of one lookup per row.
+        """
+        request = self.context.get('request')
+        if organization is None or request is None:
+            return organization
+        roles = request_roles(request)
+        if roles.in_group('Admin') or roles.role_in(organization.id) is not None:
+            return organization
+        members = self.context.get('member_organizations')
+        if members is None:
+            member = Organization.objects.filter(pk=organization.pk).for_member(request.user).exists()
+        else:
+            member = organization.pk in members
+        if not member:
+            raise serializers.ValidationError("You are not a member of this organization.")
+        return organization
+
     def validate(self, data):
         if data['required_ram'] <= 0 or data['required_cpu'] <= 0 or data['required_gpu'] < 0:
             raise serializers.ValidationError("Resource values must be positive")
-        return data
\ No newline at end of file
+        return data
+
+
+class BulkRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field resolved against objects loaded up front.
+
+    The view loads every referenced object of the batch in one query and
+    passes them as ``context['bulk_related'][model]``, so validating a batch
+    does not cost one lookup per row.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        related = self.context['bulk_related'][self.get_queryset().model].get(pk)
+        if related is None:
+            self.fail('does_not_exist', pk_value=data)
+        return related
+
+
+class BulkDeploymentSerializer(DeploymentSerializer):
+    cluster = BulkRelatedField(
+        queryset=Cluster.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    dependencies = BulkRelatedField(
+        queryset=Deployment.objects.all(),
+        many=True,
+        required=False
+    )
+    organization = BulkRelatedField(
+        queryset=Organization.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    depends_on = serializers.ListField(
+        child=serializers.IntegerField(min_value=0),
+        required=False,
+        write_only=True,
+        help_text="Positions of earlier deployments in the same batch that this one depends on"
+    )
+
+    class Meta(DeploymentSerializer.Meta):
+        fields = DeploymentSerializer.Meta.fields + ['depends_on']
@@ -0,0 +1,124 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.contrib.auth.models import Group, User
+from django.dispatch import receiver
+
+from .models import Cluster, Deployment, Role
+from . import capacity, dependencies, events, fairshare, profiling, roles, scheduler
+
+
+@receiver(post_save, sender=Deployment)
+def deployment_saved(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    previous_status = loaded.get('status')
+    if previous_status == Deployment.Status.RUNNING and instance.status != Deployment.Status.RUNNING:
+        scheduler.capacity_freed(instance.cluster_id)
+    if instance.status == Deployment.Status.COMPLETED and previous_status != Deployment.Status.COMPLETED:
+        if not created:
+            scheduler.wake_deployments(dependencies.complete(instance))
+    elif previous_status == Deployment.Status.COMPLETED:
+        dependencies.reopen(instance)
+    if previous_status is not None and previous_status != instance.status:
+        events.deployments_changed([instance])
+    instance._loaded_values = {**loaded, 'status': instance.status}
+
+
+@receiver(pre_delete, sender=Deployment)
+def deployment_deleted(sender, instance, **kwargs):
+    if instance.status != Deployment.Status.COMPLETED:
+        # The edges go with the deployment, so its dependents may be ready now.
+        scheduler.wake_deployments(dependencies.complete(instance))
+
+
+@receiver(m2m_changed, sender=Deployment.dependencies.through)
+def dependencies_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        dependent_ids, dependency_ids = pk_set, {instance.pk}
+    else:
+        dependent_ids, dependency_ids = {instance.pk}, pk_set
+
+    if action == 'post_add':
+        dependencies.add_edges([(a, b) for a in dependent_ids for b in dependency_ids])
+    elif action == 'pre_remove':
+        instance._removed_edges = dependencies.existing_edges(dependent_ids, dependency_ids)
+    elif action == 'pre_clear':
+        instance._removed_edges = (
+            dependencies.existing_edges(dependency_ids=[instance.pk]) if reverse
+            else dependencies.existing_edges(dependent_ids=[instance.pk])
+        )
+    elif action in ('post_remove', 'post_clear'):
+        dependencies.remove_edges(instance._removed_edges)
+        del instance._removed_edges
+
+
+@receiver(post_save, sender=Cluster)
+def cluster_saved(sender, instance, created, **kwargs):
+    capacity.write_through(Cluster.objects.filter(pk=instance.pk))
+    fairshare.invalidate_totals()
+    if created:
+        # New capacity: unplaced deployments may fit now.
+        scheduler.wake_placement()
+
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None:
+        return
+    if (instance.total_ram > loaded.get('total_ram', instance.total_ram) or
+            instance.total_cpu > loaded.get('total_cpu', instance.total_cpu) or
+            instance.total_gpu > loaded.get('total_gpu', instance.total_gpu)):
+        scheduler.capacity_freed(instance.id)
+    instance._loaded_values = {
+        **loaded,
+        'total_ram': instance.total_ram,
+        'total_cpu': instance.total_cpu,
+        'total_gpu': instance.total_gpu,
+    }
+
+
+@receiver(post_delete, sender=Cluster)
+def cluster_deleted(sender, instance, **kwargs):
+    capacity.invalidate([instance.pk])
+    fairshare.invalidate_totals()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        roles.invalidate([instance.pk])
+    elif pk_set is not None:
+        roles.invalidate(pk_set)
+    else:
+        roles.invalidate_all()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        return
+    # Any change other than the login timestamp (password, active flag, ...)
+    # outdates issued tokens.
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        roles.invalidate([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    roles.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def role_changed(sender, instance, **kwargs):
+    roles.invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    roles.invalidate_all()
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    profiling.install(connection)
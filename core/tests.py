@@ -1,11 +1,92 @@
+import asyncio
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+
 from django.core.exceptions import ValidationError
-from django.urls import reverse
-from django_rq import get_worker
-from rest_framework.test import APITestCase
+from django.core.management import call_command
+from django.core.cache import cache
+from django.urls import resolve, reverse
+from django.db import connection, transaction
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from unittest import mock
+from django.utils import timezone
+from django_rq import get_worker, get_queue
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework import test
+from rest_framework.serializers import ListSerializer
+from rest_framework.test import APIRequestFactory
 from django.contrib.auth.models import User
 from django.contrib.auth.models import Group
-from .models import Organization, OrganizationMember, Cluster, Deployment
-from .views import process_deployment
+from .models import Organization, OrganizationMember, Cluster, Deployment, DeploymentGroup, Role
+from .permissions import IsAdmin, IsAdminOrReadOnly, IsDeveloper
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import StatelessRoleAuthentication
+from .scheduler import (
+    process_deployment, requeue, schedule_cluster, place_unplaced, effective_priority, dispatch,
+    find_preemptable_deployments, submit_many,
+)
+from .workers import WeightedPriorityWorker
+from .retry import RetryPolicy, schedule_retry
+from .preemption import select_victims
+from .placement import choose_cluster
+from .benchmark import Workload, in_memory_queues, run_benchmark
+from .budgets import BUDGETS, SKIPPED, regressions, run_budgets
+from .export import export_records, ndjson
+from .trace import TraceError, TraceLoader
+from .lifecycle import TransitionError, finish
+from . import capacity, dependencies, events, gangs, metrics, preemption, profiling, roles
+from . import urls as core_urls
+
+
+class CacheResetMixin:
+    """Start every test class and test from an empty cache.
+
+    Capacity snapshots and resolved roles are cached by id, and ids are
+    reused across test databases (and between tests on SQLite).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cache.clear()
+        super().setUpClass()
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+
+class APITestCase(CacheResetMixin, test.APITestCase):
+    pass
+
+
+class APITransactionTestCase(CacheResetMixin, test.APITransactionTestCase):
+    pass
+
+
+class DeploymentFactoryMixin:
+    """``create_deployment`` for test cases that set up ``self.cluster`` and ``self.user``."""
+    deployment_defaults = {'required_ram': 16, 'required_cpu': 4, 'required_gpu': 1}
+
+    def create_deployment(self, **kwargs):
+        return Deployment.objects.create(**{
+            'docker_image_path': "https://localhost/image", 'cluster': self.cluster, 'created_by': self.user,
+            **self.deployment_defaults, **kwargs
+        })
+
+
+def empty_queue(name='default'):
+    """The emptied queue ``name``, minus any stale placement wake left behind by an earlier test."""
+    queue = get_queue(name)
+    queue.empty()
+    queue.connection.delete(queue.job_class.key_for('place-unplaced'))
+    return queue
 
 
 class AuthTests(APITestCase):
@@ -106,7 +187,7 @@ class ClusterTests(APITestCase):
         url = reverse('cluster-list-create')
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_cluster_detail(self):
         cluster = Cluster.objects.create(
@@ -158,6 +239,83 @@ class DeploymentTests(APITestCase):
         self.assertEqual(Deployment.objects.first().status, 'PENDING')
 
 
+class DeploymentListingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.user.groups.add(Group.objects.get_or_create(name='Developer')[0])
+        self.client.force_authenticate(user=self.user)
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+        self.deployments = [
+            Deployment.objects.create(
+                docker_image_path="https://localhost/image",
+                required_ram=1,
+                required_cpu=1,
+                required_gpu=0,
+                priority=priority,
+                status=status,
+                cluster=cluster,
+                created_by=self.user
+            )
+            for priority, status, cluster in [
+                ('HIGH', 'PENDING', self.cluster),
+                ('LOW', 'RUNNING', self.cluster),
+                ('LOW', 'PENDING', None),
+                ('MEDIUM', 'COMPLETED', self.cluster),
+                ('HIGH', 'PENDING', None),
+            ]
+        ]
+
+    def ids(self, response):
+        return [row['id'] for row in response.data['results']]
+
+    def test_cursor_pages_newest_first(self):
+        url = reverse('deployment-list-create')
+        seen = []
+        response = self.client.get(url, {'page_size': 2})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += self.ids(response)
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(seen, sorted((d.id for d in self.deployments), reverse=True))
+
+    def test_filters(self):
+        url = reverse('deployment-list-create')
+        d = self.deployments
+
+        self.assertEqual(self.ids(self.client.get(url, {'status': 'pending'})), [d[4].id, d[2].id, d[0].id])
+        self.assertEqual(self.ids(self.client.get(url, {'priority': 'HIGH,MEDIUM'})), [d[4].id, d[3].id, d[0].id])
+        self.assertEqual(self.ids(self.client.get(url, {'cluster': 'none', 'priority': 'LOW'})), [d[2].id])
+        self.assertEqual(
+            self.ids(self.client.get(url, {'cluster': self.cluster.id, 'status': 'PENDING,RUNNING'})),
+            [d[1].id, d[0].id]
+        )
+
+    def test_invalid_filter_is_rejected(self):
+        url = reverse('deployment-list-create')
+        self.assertEqual(self.client.get(url, {'status': 'SLEEPING'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cluster': 'abc'}).status_code, 400)
+
+    def test_page_query_count_is_constant(self):
+        url = reverse('deployment-list-create')
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url, {'page_size': 2})
+        for _ in range(20):
+            Deployment.objects.create(
+                docker_image_path="https://localhost/image",
+                required_ram=1, required_cpu=1, required_gpu=0,
+                cluster=self.cluster, created_by=self.user
+            )
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(url, {'page_size': 20})
+
+        self.assertEqual(len(small), len(large))
+
 
 class SchedulingTests(APITestCase):
     def setUp(self):
@@ -376,4 +534,1964 @@ class DeploymentDependencyTests(APITestCase):
         get_worker().work(burst=True)
 
         child.refresh_from_db()
-        self.assertEqual(child.status, Deployment.Status.PENDING)
\ No newline at end of file
+        self.assertEqual(child.status, Deployment.Status.PENDING)
+
+
+@override_settings(SCHEDULER_MODE='event')
+class EventSchedulingTests(DeploymentFactoryMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster",
+            total_ram=64,
+            total_cpu=16,
+            total_gpu=4,
+            created_by=self.user
+        )
+        self.queue = empty_queue()
+
+    def test_new_cluster_wakes_placement(self):
+        self.create_deployment(cluster=None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Cluster.objects.create(name="New", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user)
+
+        self.assertEqual(self.queue.job_ids, ['place-unplaced'])
+
+    def test_blocked_deployment_is_parked(self):
+        deployment = self.create_deployment(required_ram=128)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_deployment(deployment.id)
+
+        deployment.refresh_from_db()
+        self.assertEqual(deployment.status, Deployment.Status.PENDING)
+        self.assertEqual(self.queue.count, 0)
+
+    def test_completed_dependency_wakes_cluster(self):
+        dependency = self.create_deployment()
+        dependent = self.create_deployment()
+        dependent.dependencies.add(dependency)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dependency.status = Deployment.Status.COMPLETED
+            dependency.save()
+
+        self.assertEqual(self.queue.job_ids, [f'schedule-cluster-{self.cluster.id}'])
+
+    def test_wakes_wait_for_commit(self):
+        deployment = self.create_deployment(status=Deployment.Status.RUNNING)
+        Cluster.objects.filter(id=self.cluster.id).update(allocated_ram=16, allocated_cpu=4, allocated_gpu=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Deployment.objects.get(id=deployment.id).release_resources()
+                self.assertEqual(self.queue.job_ids, [])
+            self.assertEqual(self.queue.job_ids, [])
+
+        self.assertEqual(self.queue.job_ids, [f'schedule-cluster-{self.cluster.id}', 'place-unplaced'])
+
+    def test_rolled_back_delete_wakes_nothing(self):
+        dependency = self.create_deployment()
+        self.create_deployment().dependencies.add(dependency)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                dependency.delete()
+                transaction.set_rollback(True)
+
+        self.assertEqual(self.queue.job_ids, [])
+
+    def test_deleted_dependency_wakes_cluster(self):
+        dependency = self.create_deployment()
+        dependent = self.create_deployment()
+        dependent.dependencies.add(dependency)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dependency.delete()
+
+        dependent.refresh_from_db()
+        self.assertEqual(dependent.unmet_dependencies, 0)
+        self.assertEqual(self.queue.job_ids, [f'schedule-cluster-{self.cluster.id}'])
+
+    def test_released_resources_wake_cluster_once(self):
+        first = self.create_deployment(status=Deployment.Status.RUNNING)
+        second = self.create_deployment(status=Deployment.Status.RUNNING)
+        self.cluster.allocated_ram = 32
+        self.cluster.allocated_cpu = 8
+        self.cluster.allocated_gpu = 2
+        self.cluster.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Deployment.objects.get(id=first.id).release_resources()
+        with self.captureOnCommitCallbacks(execute=True):
+            Deployment.objects.get(id=second.id).release_resources()
+
+        self.assertEqual(self.queue.job_ids, [f'schedule-cluster-{self.cluster.id}', 'place-unplaced'])
+
+    def test_schedule_cluster_runs_parked_deployments(self):
+        low = self.create_deployment(priority="LOW", required_ram=48)
+        high = self.create_deployment(priority="HIGH", required_ram=48)
+
+        schedule_cluster(self.cluster.id)
+
+        low.refresh_from_db()
+        high.refresh_from_db()
+        self.assertEqual(high.status, Deployment.Status.RUNNING)
+        self.assertEqual(low.status, Deployment.Status.PENDING)
+
+    def test_schedule_cluster_skips_blocked_and_preempts(self):
+        dependency = self.create_deployment(required_ram=1, required_cpu=1, required_gpu=0)
+        blocked = self.create_deployment(priority="HIGH")
+        blocked.dependencies.add(dependency)
+        low = self.create_deployment(priority="LOW", required_ram=48, status=Deployment.Status.RUNNING)
+        self.cluster.allocated_ram = 48
+        self.cluster.allocated_cpu = 4
+        self.cluster.allocated_gpu = 1
+        self.cluster.save()
+        high = self.create_deployment(priority="HIGH", required_ram=32)
+
+        schedule_cluster(self.cluster.id)
+
+        for deployment in (dependency, blocked, low, high):
+            deployment.refresh_from_db()
+        self.cluster.refresh_from_db()
+        self.assertEqual(blocked.status, Deployment.Status.PENDING)
+        self.assertEqual(low.status, Deployment.Status.PENDING)
+        self.assertEqual(high.status, Deployment.Status.RUNNING)
+        self.assertEqual(dependency.status, Deployment.Status.RUNNING)
+        self.assertEqual(self.cluster.allocated_ram, 33)
+        self.assertEqual(self.cluster.allocated_cpu, 5)
+        self.assertEqual(self.cluster.allocated_gpu, 1)
+
+    def test_schedule_cluster_query_count_is_independent_of_batch_size(self):
+        def run_pass(count):
+            Deployment.objects.all().delete()
+            Cluster.objects.filter(id=self.cluster.id).update(allocated_ram=0, allocated_cpu=0, allocated_gpu=0)
+            for _ in range(count):
+                self.create_deployment(required_ram=1, required_cpu=1, required_gpu=0)
+            with CaptureQueriesContext(connection) as queries:
+                schedule_cluster(self.cluster.id)
+            self.assertEqual(Deployment.objects.filter(status=Deployment.Status.RUNNING).count(), count)
+            return len(queries)
+
+        self.assertEqual(run_pass(2), run_pass(12))
+
+
+class ResourceLedgerTests(DeploymentFactoryMixin, APITestCase):
+    deployment_defaults = {'required_ram': 32, 'required_cpu': 8, 'required_gpu': 2}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="admin", password="admin123")
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster",
+            total_ram=64,
+            total_cpu=16,
+            total_gpu=4,
+            created_by=self.user
+        )
+
+    def test_allocate_refuses_over_commit(self):
+        first = self.create_deployment()
+        second = self.create_deployment()
+        third = self.create_deployment()
+
+        self.assertTrue(first.allocate())
+        self.assertTrue(second.allocate())
+        self.assertFalse(third.allocate())
+
+        third.refresh_from_db()
+        self.cluster.refresh_from_db()
+        self.assertEqual(third.status, Deployment.Status.PENDING)
+        self.assertEqual(self.cluster.allocated_ram, 64)
+        self.assertEqual(self.cluster.allocated_gpu, 4)
+
+    def test_allocate_is_claimed_once(self):
+        deployment = self.create_deployment()
+        stale_copy = Deployment.objects.get(id=deployment.id)
+
+        self.assertTrue(deployment.allocate())
+        self.assertFalse(stale_copy.allocate())
+
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.allocated_ram, 32)
+
+    def test_release_is_applied_once(self):
+        deployment = self.create_deployment()
+        deployment.allocate()
+        stale_copy = Deployment.objects.get(id=deployment.id)
+
+        self.assertTrue(deployment.release_resources())
+        self.assertFalse(stale_copy.release_resources())
+
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.allocated_ram, 0)
+        self.assertEqual(self.cluster.allocated_cpu, 0)
+
+    def test_ledger_never_goes_negative(self):
+        updated = Cluster.objects.filter(id=self.cluster.id).release(1, 1, 1)
+
+        self.assertEqual(updated, 0)
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.allocated_ram, 0)
+
+
+class VictimSelectionTests(SimpleTestCase):
+    capacity = (64, 16, 4)
+
+    def running(self, ram, cpu=1, gpu=0, priority="LOW", hours=1):
+        return SimpleNamespace(
+            required_ram=ram,
+            required_cpu=cpu,
+            required_gpu=gpu,
+            priority=priority,
+            updated_at=timezone.now() - timedelta(hours=hours),
+        )
+
+    def test_single_fitting_victim_beats_several_small_ones(self):
+        small = [self.running(8), self.running(8)]
+        exact = self.running(16)
+
+        victims = select_victims(small + [exact], (16, 1, 0), self.capacity)
+
+        self.assertEqual(victims, [exact])
+
+    def test_lower_priority_is_preferred(self):
+        medium = self.running(16, priority="MEDIUM")
+        low = self.running(16, priority="LOW")
+
+        self.assertEqual(select_victims([medium, low], (16, 1, 0), self.capacity), [low])
+
+    def test_covers_every_resource(self):
+        ram_heavy = self.running(32, cpu=1, gpu=0)
+        gpu_heavy = self.running(4, cpu=1, gpu=2)
+
+        victims = select_victims([ram_heavy, gpu_heavy], (20, 1, 1), self.capacity)
+
+        self.assertCountEqual(victims, [ram_heavy, gpu_heavy])
+
+    def test_returns_none_when_shortfall_cannot_be_covered(self):
+        self.assertIsNone(select_victims([self.running(8)], (16, 1, 0), self.capacity))
+
+    def test_large_candidate_set(self):
+        candidates = [self.running(1 + i % 7, cpu=1 + i % 3, gpu=i % 2, hours=i % 5) for i in range(5000)]
+
+        victims = select_victims(candidates, (40, 12, 3), (10000, 4000, 2500))
+
+        self.assertGreaterEqual(sum(v.required_ram for v in victims), 40)
+        self.assertGreaterEqual(sum(v.required_cpu for v in victims), 12)
+        self.assertGreaterEqual(sum(v.required_gpu for v in victims), 3)
+
+    def test_candidate_scan_is_bounded(self):
+        candidates = [self.running(1 + i % 7, cpu=1 + i % 3, gpu=i % 2, hours=i % 5) for i in range(5000)]
+
+        with mock.patch('core.preemption.victim_cost', wraps=preemption.victim_cost) as cost:
+            victims = select_victims(iter(candidates), (40, 12, 3), (10000, 4000, 2500))
+
+        self.assertLessEqual(cost.call_count, preemption.CANDIDATE_LIMIT)
+        self.assertGreaterEqual(sum(v.required_ram for v in victims), 40)
+
+    def test_scan_continues_past_the_limit_until_covered(self):
+        small = [self.running(1) for _ in range(preemption.CANDIDATE_LIMIT)]
+        large = self.running(400)
+
+        victims = select_victims(small + [large], (300, 1, 0), (1000, 1000, 1000))
+
+        self.assertIn(large, victims)
+
+
+class PreemptionTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="admin", password="admin123")
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster",
+            total_ram=64,
+            total_cpu=16,
+            total_gpu=4,
+            allocated_ram=64,
+            allocated_cpu=12,
+            allocated_gpu=0,
+            created_by=self.user
+        )
+
+    def test_only_the_needed_victim_is_preempted(self):
+        running = [
+            Deployment.objects.create(
+                docker_image_path="https://localhost/low",
+                required_ram=ram,
+                required_cpu=4,
+                required_gpu=0,
+                priority="LOW",
+                cluster=self.cluster,
+                created_by=self.user,
+                status=Deployment.Status.RUNNING
+            )
+            for ram in (32, 16, 16)
+        ]
+        high = Deployment.objects.create(
+            docker_image_path="https://localhost/high",
+            required_ram=16,
+            required_cpu=4,
+            required_gpu=0,
+            priority="HIGH",
+            cluster=self.cluster,
+            created_by=self.user
+        )
+
+        process_deployment(high.id)
+
+        high.refresh_from_db()
+        self.cluster.refresh_from_db()
+        statuses = sorted(Deployment.objects.get(id=d.id).status for d in running)
+        self.assertEqual(high.status, Deployment.Status.RUNNING)
+        self.assertEqual(statuses, ['PENDING', 'RUNNING', 'RUNNING'])
+        self.assertEqual(Deployment.objects.get(id=running[0].id).status, Deployment.Status.RUNNING)
+        self.assertEqual(self.cluster.allocated_ram, 64)
+
+    @override_settings(SCHEDULER_MODE='poll')
+    def test_victims_are_dispatched_after_the_preemption_commits(self):
+        victim = Deployment.objects.create(
+            docker_image_path="https://localhost/low",
+            required_ram=32, required_cpu=4, required_gpu=0, priority="LOW",
+            cluster=self.cluster, created_by=self.user, status=Deployment.Status.RUNNING
+        )
+        high = Deployment.objects.create(
+            docker_image_path="https://localhost/high",
+            required_ram=16, required_cpu=4, required_gpu=0, priority="HIGH",
+            cluster=self.cluster, created_by=self.user
+        )
+        queue = empty_queue('low')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_deployment(high.id)
+            self.assertEqual(queue.count, 0)
+
+        self.assertEqual(Deployment.objects.get(id=victim.id).status, Deployment.Status.PENDING)
+        self.assertEqual([job.args for job in queue.jobs], [(victim.id,)])
+
+    def test_priority_rank_follows_priority(self):
+        deployment = Deployment.objects.create(
+            docker_image_path="https://localhost/image",
+            required_ram=1,
+            required_cpu=1,
+            required_gpu=0,
+            priority="LOW",
+            cluster=self.cluster,
+            created_by=self.user
+        )
+        self.assertEqual(deployment.priority_rank, 1)
+
+        deployment.priority = "HIGH"
+        deployment.save(update_fields=['priority'])
+
+        deployment.refresh_from_db()
+        self.assertEqual(deployment.priority_rank, 3)
+
+    def test_preemptable_deployments_are_filtered_on_stored_rank(self):
+        for priority in ("MEDIUM", "LOW", "HIGH", "LOW"):
+            Deployment.objects.create(
+                docker_image_path="https://localhost/image",
+                required_ram=1,
+                required_cpu=1,
+                required_gpu=0,
+                priority=priority,
+                cluster=self.cluster,
+                created_by=self.user,
+                status=Deployment.Status.RUNNING
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            preemptable = list(find_preemptable_deployments(self.cluster, "HIGH"))
+
+        self.assertEqual([d.priority for d in preemptable], ["LOW", "LOW", "MEDIUM"])
+        self.assertNotIn('CASE', queries[0]['sql'])
+
+
+class DependencyIndexTests(DeploymentFactoryMixin, APITestCase):
+    deployment_defaults = {'required_ram': 1, 'required_cpu': 1, 'required_gpu': 0}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster",
+            total_ram=64,
+            total_cpu=16,
+            total_gpu=4,
+            created_by=self.user
+        )
+
+    def unmet(self, deployment):
+        return Deployment.objects.values_list('unmet_dependencies', flat=True).get(id=deployment.id)
+
+    def test_counts_follow_edge_changes(self):
+        first = self.create_deployment()
+        second = self.create_deployment()
+        done = self.create_deployment(status=Deployment.Status.COMPLETED)
+        child = self.create_deployment()
+
+        child.dependencies.add(first, second, done)
+        self.assertEqual(self.unmet(child), 2)
+
+        child.dependencies.remove(first, done)
+        self.assertEqual(self.unmet(child), 1)
+
+        second.dependent_deployments.clear()
+        self.assertEqual(self.unmet(child), 0)
+
+    def test_completion_moves_dependents_to_ready_set(self):
+        parent = self.create_deployment()
+        other_parent = self.create_deployment()
+        child = self.create_deployment()
+        child.dependencies.add(parent, other_parent)
+
+        parent.status = Deployment.Status.COMPLETED
+        parent.save()
+        self.assertFalse(dependencies.ready().filter(id=child.id).exists())
+
+        other_parent.status = Deployment.Status.COMPLETED
+        other_parent.save()
+        self.assertTrue(dependencies.ready().filter(id=child.id).exists())
+
+    def test_deleting_an_unfinished_dependency_unblocks_dependents(self):
+        parent = self.create_deployment()
+        child = self.create_deployment()
+        child.dependencies.add(parent)
+
+        parent.delete()
+
+        self.assertEqual(self.unmet(child), 0)
+
+    def test_scheduling_does_not_query_dependencies(self):
+        parent = self.create_deployment(status=Deployment.Status.COMPLETED)
+        child = self.create_deployment()
+        child.dependencies.add(parent)
+
+        with CaptureQueriesContext(connection) as queries:
+            process_deployment(child.id)
+
+        child.refresh_from_db()
+        self.assertEqual(child.status, Deployment.Status.RUNNING)
+        self.assertFalse(any('core_deployment_dependencies' in q['sql'] for q in queries.captured_queries))
+
+    def test_recount_rebuilds_counters(self):
+        parent = self.create_deployment()
+        child = self.create_deployment()
+        child.dependencies.add(parent)
+        Deployment.objects.update(unmet_dependencies=0)
+
+        dependencies.recount()
+
+        self.assertEqual(self.unmet(child), 1)
+        self.assertEqual(self.unmet(parent), 0)
+
+
+class PlacementStrategyTests(SimpleTestCase):
+    capacities = [
+        (1, [8, 4, 0], (64, 16, 0)),
+        (2, [48, 12, 0], (64, 16, 0)),
+        (3, [16, 4, 2], (64, 16, 8)),
+    ]
+
+    def test_best_fit_picks_tightest_cluster(self):
+        self.assertEqual(choose_cluster((8, 2, 0), self.capacities, 'best_fit')[0], 1)
+
+    def test_worst_fit_picks_emptiest_cluster(self):
+        self.assertEqual(choose_cluster((8, 2, 0), self.capacities, 'worst_fit')[0], 2)
+
+    def test_gpu_affinity_keeps_cpu_work_off_gpu_clusters(self):
+        self.assertEqual(choose_cluster((16, 4, 0), self.capacities, 'gpu_affinity')[0], 2)
+        self.assertEqual(choose_cluster((8, 2, 1), self.capacities, 'gpu_affinity')[0], 3)
+
+    def test_drf_picks_lowest_dominant_share(self):
+        self.assertEqual(choose_cluster((8, 2, 0), self.capacities, 'drf')[0], 2)
+
+    def test_nothing_fits(self):
+        self.assertIsNone(choose_cluster((128, 1, 0), self.capacities, 'best_fit'))
+
+
+@override_settings(SCHEDULER_PLACEMENT_STRATEGY='best_fit')
+class PlacementTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.user.groups.add(Group.objects.get(name='Developer'))
+        self.small = Cluster.objects.create(
+            name="Small", total_ram=16, total_cpu=4, total_gpu=0, created_by=self.user
+        )
+        self.large = Cluster.objects.create(
+            name="Large", total_ram=128, total_cpu=32, total_gpu=8, created_by=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_unplaced_deployment_is_placed_by_scheduler(self):
+        url = reverse('deployment-list-create')
+        data = {
+            "docker_image_path": "https://0.0.0.0/ml-model:v1",
+            "required_ram": 8,
+            "required_cpu": 2,
+            "required_gpu": 0,
+        }
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.data['cluster'])
+
+        place_unplaced()
+
+        deployment = Deployment.objects.get(id=response.data['id'])
+        self.small.refresh_from_db()
+        self.assertEqual(deployment.cluster_id, self.small.id)
+        self.assertEqual(deployment.status, Deployment.Status.RUNNING)
+        self.assertEqual(self.small.allocated_ram, 8)
+
+    def test_deployment_that_fits_nowhere_stays_unplaced(self):
+        deployment = Deployment.objects.create(
+            docker_image_path="https://localhost/huge",
+            required_ram=256,
+            required_cpu=2,
+            required_gpu=0,
+            created_by=self.user
+        )
+
+        process_deployment(deployment.id)
+
+        deployment.refresh_from_db()
+        self.assertIsNone(deployment.cluster_id)
+        self.assertEqual(deployment.status, Deployment.Status.PENDING)
+
+
+@override_settings(SCHEDULER_MODE='poll', SCHEDULER_AGING_INTERVAL=300)
+class PriorityQueueTests(DeploymentFactoryMixin, APITestCase):
+    deployment_defaults = {'required_ram': 128, 'required_cpu': 1, 'required_gpu': 0}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster",
+            total_ram=64,
+            total_cpu=16,
+            total_gpu=4,
+            created_by=self.user
+        )
+        for name in ('high', 'medium', 'low'):
+            get_queue(name).empty()
+
+    def test_dispatch_routes_by_priority(self):
+        high = self.create_deployment(priority="HIGH")
+        low = self.create_deployment(priority="LOW")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch(high)
+            dispatch(low)
+
+        self.assertEqual(get_queue('high').count, 1)
+        self.assertEqual(get_queue('medium').count, 0)
+        self.assertEqual(get_queue('low').count, 1)
+
+    def test_waiting_deployments_are_promoted(self):
+        low = self.create_deployment(priority="LOW", pending_since=timezone.now() - timedelta(minutes=6))
+        oldest = self.create_deployment(priority="LOW", pending_since=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(effective_priority(low), 2)
+        self.assertEqual(effective_priority(oldest), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch(low)
+        self.assertEqual(get_queue('medium').count, 1)
+
+    def test_blocked_deployment_is_retried_later_on_its_priority_queue(self):
+        high = self.create_deployment(priority="HIGH")
+        get_queue('high').scheduled_job_registry.remove_jobs()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_deployment(high.id)
+
+        high.refresh_from_db()
+        self.assertEqual(high.attempts, 1)
+        self.assertEqual(get_queue('high').count, 0)
+        self.assertEqual(
+            get_queue('high').scheduled_job_registry.get_job_ids(),
+            [f'retry-deployment-{high.id}-0']
+        )
+
+
+class WeightedPriorityWorkerTests(SimpleTestCase):
+    @override_settings(RQ_QUEUE_WEIGHTS={'high': 8, 'low': 1})
+    def test_queues_are_ordered_by_weight(self):
+        worker = WeightedPriorityWorker([get_queue('low'), get_queue('high')])
+        first = {'high': 0, 'low': 0}
+        for _ in range(900):
+            worker.reorder_queues(reference_queue=worker.queues[0])
+            first[worker._ordered_queues[0].name] += 1
+
+        self.assertGreater(first['high'], 700)
+        self.assertGreater(first['low'], 30)
+
+
+class RetryPolicyTests(APITestCase):
+    def test_delay_grows_and_is_capped(self):
+        policy = RetryPolicy(base=5, factor=2, cap=60, jitter=0.5)
+
+        for attempt, ceiling in ((0, 5), (1, 10), (3, 40), (10, 60), (1000, 60)):
+            delay = policy.delay(attempt)
+            self.assertGreaterEqual(delay, ceiling / 2)
+            self.assertLessEqual(delay, ceiling)
+
+    def test_retry_is_scheduled_once_per_attempt(self):
+        user = User.objects.create_user(username="dev", password="dev123")
+        cluster = Cluster.objects.create(name="Test Cluster", total_ram=1, total_cpu=1, total_gpu=0, created_by=user)
+        deployment = Deployment.objects.create(
+            docker_image_path="https://localhost/image",
+            required_ram=8,
+            required_cpu=1,
+            required_gpu=0,
+            cluster=cluster,
+            created_by=user
+        )
+        queue = get_queue('default')
+        queue.scheduled_job_registry.remove_jobs()
+
+        self.assertIsNotNone(schedule_retry(process_deployment, deployment, 'resources'))
+        self.assertIsNone(schedule_retry(process_deployment, deployment, 'resources'))
+        self.assertEqual(len(queue.scheduled_job_registry), 1)
+
+
+class BenchmarkTests(APITestCase):
+    def test_benchmark_schedules_every_deployment_and_rolls_back(self):
+        workload = dict(clusters=4, deployments=40, dependency_rate=0.5, unplaced_rate=0.25, seed=1)
+
+        for mode in ('event', 'poll'):
+            report = run_benchmark(Workload(**workload), mode=mode)
+
+            self.assertEqual(report['decisions'], 40)
+            self.assertEqual(report['left_pending'], 0)
+            self.assertGreater(report['queries_per_decision'], 0)
+            self.assertIsNotNone(report['admission_latency_p99_ms'])
+        self.assertFalse(Deployment.objects.exists())
+        self.assertFalse(Cluster.objects.exists())
+
+
+class CapacityCacheTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="viewer", password="view123")
+        self.user.groups.add(Group.objects.get_or_create(name='Viewer')[0])
+        self.client.force_authenticate(user=self.user)
+        self.redis = capacity._client()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cluster = Cluster.objects.create(
+                name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+            )
+
+    def cached(self):
+        return self.redis.hgetall(capacity.cache_key(self.cluster.id))
+
+    def test_ledger_updates_write_through_with_a_new_version(self):
+        self.assertEqual(self.cached()[b'allocated_ram'], b'0')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Cluster.objects.filter(pk=self.cluster.pk).allocate(16, 4, 1)
+
+        self.assertEqual(self.cached()[b'allocated_ram'], b'16')
+        self.assertEqual(self.cached()[b'version'], b'1')
+
+    def test_rolled_back_updates_do_not_reach_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Cluster.objects.filter(pk=self.cluster.pk).allocate(16, 4, 1)
+                transaction.set_rollback(True)
+
+        self.assertEqual(self.cached()[b'allocated_ram'], b'0')
+
+    def test_older_snapshots_never_replace_newer_ones(self):
+        stale = capacity._load(Cluster.objects.filter(pk=self.cluster.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            Cluster.objects.filter(pk=self.cluster.pk).allocate(16, 4, 1)
+
+        capacity._store(self.redis, stale)
+
+        self.assertEqual(self.cached()[b'allocated_ram'], b'16')
+
+    def test_detail_is_served_from_the_cache(self):
+        url = reverse('cluster-detail', args=[self.cluster.id])
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['available_gpu'], 4)
+        self.assertEqual(response.data['created_by'], 'viewer')
+
+    def test_list_reads_only_ids_from_the_database(self):
+        response = self.client.get(reverse('cluster-list-create'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['name'], "Test Cluster")
+        self.assertEqual(response.data['results'][0]['available_ram'], 64)
+
+    def test_redis_errors_fall_back_to_the_database(self):
+        Cluster.objects.filter(pk=self.cluster.pk).allocate(16, 4, 1)
+        broken = mock.Mock()
+        broken.pipeline.return_value.execute.side_effect = RedisError("down")
+
+        with mock.patch.object(capacity, '_client', return_value=broken), \
+                self.assertLogs('core.capacity', 'WARNING'):
+            snapshot = capacity.get(self.cluster.id)
+
+        self.assertEqual(snapshot.allocated_ram, 16)
+
+    def test_low_priority_rejection_does_not_read_the_cluster(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Cluster.objects.filter(pk=self.cluster.pk).allocate(60, 4, 0)
+        deployment = Deployment.objects.create(
+            docker_image_path="https://localhost/image",
+            required_ram=8,
+            required_cpu=1,
+            required_gpu=0,
+            priority="LOW",
+            cluster=self.cluster,
+            created_by=self.user
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            process_deployment(deployment.id)
+
+        self.assertFalse([q for q in queries if 'core_cluster' in q['sql']])
+        deployment.refresh_from_db()
+        self.assertEqual(deployment.status, Deployment.Status.PENDING)
+        self.assertEqual(deployment.attempts, 1)
+
+
+class RoleResolutionTests(APITransactionTestCase):
+    def setUp(self):
+        self.admin_group = Group.objects.get_or_create(name='Admin')[0]
+        self.developer_group = Group.objects.get_or_create(name='Developer')[0]
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.user.groups.add(self.developer_group)
+        self.factory = APIRequestFactory()
+
+    def request(self, method='get'):
+        request = getattr(self.factory, method)('/api/clusters/')
+        request.user = self.user
+        return request
+
+    def test_permission_checks_are_free_once_cached(self):
+        self.assertTrue(IsDeveloper().has_permission(self.request(), None))
+
+        with self.assertNumQueries(0):
+            request = self.request('post')
+            self.assertTrue(IsDeveloper().has_permission(request, None))
+            self.assertFalse(IsAdminOrReadOnly().has_permission(request, None))
+
+    def test_membership_changes_invalidate_the_cache(self):
+        self.assertFalse(IsAdmin().has_permission(self.request(), None))
+
+        self.user.groups.add(self.admin_group)
+        self.assertTrue(IsAdmin().has_permission(self.request(), None))
+
+        self.admin_group.user_set.remove(self.user)
+        self.assertFalse(IsAdmin().has_permission(self.request(), None))
+
+    def test_organization_roles_are_resolved_and_invalidated(self):
+        organization = Organization.objects.create(name="Org", created_by=self.user)
+        self.assertIsNone(roles.resolve(self.user).role_in(organization.id))
+
+        Role.objects.create(user=self.user, organization=organization, role=Role.RoleType.ADMIN)
+
+        self.assertEqual(roles.resolve(self.user).role_in(organization.id), Role.RoleType.ADMIN)
+
+    def test_group_changes_invalidate_every_user(self):
+        self.assertTrue(IsDeveloper().has_permission(self.request(), None))
+
+        self.developer_group.name = 'Contractor'
+        self.developer_group.save()
+
+        self.assertFalse(IsDeveloper().has_permission(self.request(), None))
+
+
+class RequestRoleMemoTests(APITestCase):
+    def test_roles_are_resolved_once_per_request(self):
+        user = User.objects.create_user(username="viewer", password="view123")
+        user.groups.add(Group.objects.get(name='Viewer'))
+        request = APIRequestFactory().post('/api/clusters/')
+        request.user = user
+
+        with self.assertNumQueries(2):
+            self.assertFalse(IsAdminOrReadOnly().has_permission(request, None))
+            self.assertFalse(IsDeveloper().has_permission(request, None))
+            self.assertFalse(IsAdmin().has_permission(request, None))
+
+
+class StatelessAuthTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="viewer", password="view123", email="viewer@localhost")
+        self.user.groups.add(Group.objects.get(name='Viewer'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cluster = Cluster.objects.create(
+                name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+            )
+        patcher = mock.patch.object(APIView, 'authentication_classes', [StatelessRoleAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self):
+        response = self.client.post(reverse('login'), {'username': 'viewer', 'password': 'view123'}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access_token']}")
+        return response.data['refresh_token']
+
+    def test_requests_are_authorized_from_the_token_alone(self):
+        self.login()
+
+        with self.assertNumQueries(0):
+            profile = self.client.get(reverse('profile'))
+            detail = self.client.get(reverse('cluster-detail', args=[self.cluster.id]))
+            denied = self.client.post(reverse('cluster-list-create'), {"name": "Nope"})
+
+        self.assertEqual(profile.status_code, 200)
+        self.assertEqual(profile.data['email'], "viewer@localhost")
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(denied.status_code, 403)
+
+    def test_membership_changes_outdate_issued_tokens(self):
+        self.login()
+        self.user.groups.add(Group.objects.get(name='Admin'))
+
+        response = self.client.get(reverse('profile'))
+
+        self.assertEqual(response.status_code, 401)
+        self.login()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+    def test_logout_revokes_both_tokens(self):
+        refresh = self.login()
+
+        self.assertEqual(self.client.post(reverse('logout'), {'refresh': refresh}).status_code, 204)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+        self.assertEqual(self.client.post(reverse('token_refresh'), {'refresh': refresh}).status_code, 401)
+
+    def test_logout_requires_the_users_own_refresh_token(self):
+        self.login()
+        other = User.objects.create_user(username="other", password="other123")
+
+        response = self.client.post(reverse('logout'), {'refresh': str(RefreshToken.for_user(other))})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+    def test_database_authentication_does_not_read_the_cache(self):
+        self.login()
+
+        with mock.patch.object(APIView, 'authentication_classes', [JWTAuthentication]), \
+                mock.patch('core.authentication.cache.get_many') as get_many:
+            self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+        get_many.assert_not_called()
+
+    def test_tokens_without_role_claims_are_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+
+class BulkDeploymentTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.user.groups.add(Group.objects.get(name='Developer'))
+        self.client.force_authenticate(user=self.user)
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+        self.url = reverse('deployment-bulk-create')
+        for name in ('default', 'high', 'medium', 'low'):
+            get_queue(name).empty()
+
+    def item(self, **fields):
+        return {
+            "docker_image_path": "https://localhost/image",
+            "required_ram": 1,
+            "required_cpu": 1,
+            "required_gpu": 0,
+            "cluster": self.cluster.id,
+            **fields
+        }
+
+    def test_batch_with_dependencies_is_created(self):
+        done = Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=1, required_cpu=1, required_gpu=0,
+            cluster=self.cluster, created_by=self.user, status=Deployment.Status.COMPLETED
+        )
+        running = Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=1, required_cpu=1, required_gpu=0,
+            cluster=self.cluster, created_by=self.user
+        )
+
+        response = self.client.post(self.url, [
+            self.item(priority="HIGH", dependencies=[done.id]),
+            self.item(depends_on=[0], dependencies=[running.id]),
+            self.item(cluster=None, depends_on=[0, 1]),
+        ], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        first, second, third = (Deployment.objects.get(id=row['id']) for row in response.data)
+        self.assertEqual(first.priority_rank, 3)
+        self.assertEqual([d.unmet_dependencies for d in (first, second, third)], [0, 2, 2])
+        self.assertEqual(set(second.dependencies.values_list('id', flat=True)), {first.id, running.id})
+        self.assertEqual(sorted(response.data[2]['dependencies']), [first.id, second.id])
+
+    def test_dependency_completed_after_validation_is_not_counted(self):
+        dependency = Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=1, required_cpu=1, required_gpu=0,
+            cluster=self.cluster, created_by=self.user, status=Deployment.Status.RUNNING
+        )
+        is_valid = ListSerializer.is_valid
+
+        def validate_then_complete(serializer, *args, **kwargs):
+            valid = is_valid(serializer, *args, **kwargs)
+            Deployment.objects.filter(id=dependency.id).update(status=Deployment.Status.COMPLETED)
+            return valid
+
+        with mock.patch.object(ListSerializer, 'is_valid', validate_then_complete):
+            response = self.client.post(self.url, [self.item(dependencies=[dependency.id])], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Deployment.objects.get(id=response.data[0]['id']).unmet_dependencies, 0)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        dependency = Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=1, required_cpu=1, required_gpu=0,
+            cluster=self.cluster, created_by=self.user
+        )
+
+        def submit(size):
+            batch = [self.item(dependencies=[dependency.id])] + [self.item(depends_on=[0]) for _ in range(size - 1)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, batch, format='json')
+            self.assertEqual(response.status_code, 201)
+            return len(queries)
+
+        self.assertEqual(submit(5), submit(50))
+
+    def test_invalid_batches_are_rejected_whole(self):
+        response = self.client.post(self.url, [self.item(), self.item(depends_on=[1])], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('depends_on', response.data[1])
+
+        response = self.client.post(self.url, [self.item(), self.item(cluster=9999)], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cluster', response.data[1])
+        self.assertFalse(Deployment.objects.exists())
+
+    def test_event_mode_wakes_each_cluster_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, [self.item(), self.item(), self.item(cluster=None)], format='json')
+
+        self.assertEqual(get_queue('default').job_ids, [f'schedule-cluster-{self.cluster.id}', 'place-unplaced'])
+
+    @override_settings(SCHEDULER_MODE='poll')
+    def test_poll_mode_queues_one_attempt_per_deployment(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'deployments': [
+                self.item(priority="HIGH"), self.item(priority="LOW"), self.item(priority="LOW"),
+            ]}, format='json')
+
+        self.assertEqual(get_queue('high').count, 1)
+        self.assertEqual(get_queue('low').count, 2)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="admin", password="admin123")
+        self.user.groups.add(Group.objects.get(name='Admin'))
+        self.client.force_authenticate(user=self.user)
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+        self.first = Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=1, required_cpu=1, required_gpu=0,
+            cluster=self.cluster, created_by=self.user, status=Deployment.Status.RUNNING
+        )
+        self.second = Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=2, required_cpu=1, required_gpu=0,
+            cluster=self.cluster, created_by=self.user
+        )
+        self.second.dependencies.add(self.first)
+
+    def records(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        response = await self.async_client.get(
+            reverse('export'), headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        )
+
+        self.assertTrue(response.is_async)
+        lines = [line async for line in response.streaming_content]
+        self.assertEqual(
+            [json.loads(line)['type'] for line in b''.join(lines).decode().splitlines()],
+            ['cluster', 'deployment', 'deployment', 'dependency'],
+        )
+
+    def test_export_streams_typed_records(self):
+        response = self.client.get(reverse('export'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        records = self.records(response)
+        self.assertEqual([r['type'] for r in records], ['cluster', 'deployment', 'deployment', 'dependency'])
+        self.assertEqual(records[2]['required_ram'], 2)
+        self.assertEqual(records[3], {
+            'type': 'dependency', 'deployment_id': self.second.id, 'depends_on_id': self.first.id
+        })
+
+    def test_export_sections_and_filters(self):
+        response = self.client.get(reverse('export'), {'include': 'deployments', 'status': 'RUNNING'})
+
+        self.assertEqual([r['id'] for r in self.records(response)], [self.first.id])
+        self.assertEqual(self.client.get(reverse('export'), {'include': 'users'}).status_code, 400)
+
+    def test_export_requires_admin(self):
+        viewer = User.objects.create_user(username="viewer", password="view123")
+        viewer.groups.add(Group.objects.get(name='Viewer'))
+        self.client.force_authenticate(user=viewer)
+
+        self.assertEqual(self.client.get(reverse('export')).status_code, 403)
+
+    def test_management_command(self):
+        out = StringIO()
+        call_command('export_deployments', include='deployments,dependencies', status='PENDING', stdout=out)
+
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        # The edge to the RUNNING dependency is left out with it.
+        self.assertEqual([(r['type'], r.get('id')) for r in records], [('deployment', self.second.id)])
+
+
+def trace_lines(*records):
+    return [json.dumps(record) + '\n' for record in records]
+
+
+class TraceImportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="admin", password="admin123")
+        self.cluster = {'type': 'cluster', 'id': 7, 'name': 'Traced', 'total_ram': 64, 'total_cpu': 16, 'total_gpu': 4}
+        self.first = {
+            'type': 'deployment', 'id': 1, 'docker_image_path': 'https://localhost/image', 'status': 'RUNNING',
+            'required_ram': 8, 'required_cpu': 2, 'required_gpu': 0, 'cluster_id': 7, 'priority': 'HIGH',
+        }
+        self.second = {**self.first, 'id': 2, 'status': 'PENDING', 'required_ram': 4, 'priority': 'LOW'}
+        self.edge = {'type': 'dependency', 'deployment_id': 2, 'depends_on_id': 1}
+
+    def test_load_keeps_recorded_state_and_reconciles(self):
+        stats = TraceLoader(self.user, chunk_size=2).load(
+            trace_lines(self.cluster, self.first, self.second, self.edge)
+        )
+
+        self.assertEqual((stats['clusters'], stats['deployments'], stats['dependencies'], stats['chunks']), (1, 2, 1, 2))
+        cluster = Cluster.objects.get(name='Traced')
+        self.assertEqual((cluster.allocated_ram, cluster.allocated_cpu), (8, 2))
+        second = Deployment.objects.get(cluster=cluster, required_ram=4)
+        self.assertEqual((second.unmet_dependencies, second.priority_rank), (1, 1))
+        self.assertEqual(list(second.dependencies.values_list('required_ram', flat=True)), [8])
+
+    def test_load_applies_events(self):
+        TraceLoader(self.user).load(trace_lines(
+            self.cluster, self.first, self.second, self.edge,
+            {'type': 'complete', 'deployment_id': 1},
+        ))
+
+        cluster = Cluster.objects.get(name='Traced')
+        self.assertEqual(cluster.allocated_ram, 0)
+        self.assertEqual(
+            sorted(cluster.deployments.values_list('status', 'unmet_dependencies')),
+            [('COMPLETED', 0), ('PENDING', 0)],
+        )
+
+    def test_export_round_trip(self):
+        cluster = Cluster.objects.create(name="Source", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user)
+        Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=1, required_cpu=1, required_gpu=0,
+            cluster=cluster, created_by=self.user
+        )
+        exported = ''.join(ndjson(export_records())).splitlines(keepends=True)
+        importer = User.objects.create_user(username="importer")
+
+        stats = TraceLoader(importer).load(exported)
+
+        self.assertEqual((stats['clusters'], stats['deployments']), (1, 1))
+        self.assertEqual(Deployment.objects.filter(created_by=importer, cluster__name="Source").count(), 1)
+
+    def test_filtered_export_round_trip(self):
+        cluster = Cluster.objects.create(name="Source", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user)
+        values = dict(
+            docker_image_path="https://localhost/image", required_ram=1, required_cpu=1, required_gpu=0,
+            cluster=cluster, created_by=self.user,
+        )
+        running = Deployment.objects.create(**values, status=Deployment.Status.RUNNING)
+        first = Deployment.objects.create(**values)
+        second = Deployment.objects.create(**values)
+        first.dependencies.add(running)
+        second.dependencies.add(running, first)
+        pending = Deployment.objects.filter(status=Deployment.Status.PENDING)
+        exported = ''.join(ndjson(export_records(deployments=pending))).splitlines(keepends=True)
+        importer = User.objects.create_user(username="importer")
+
+        stats = TraceLoader(importer).load(exported)
+
+        self.assertEqual((stats['deployments'], stats['dependencies']), (2, 1))
+        imported = Deployment.objects.filter(created_by=importer).order_by('id')
+        self.assertEqual(list(imported.values_list('unmet_dependencies', flat=True)), [0, 1])
+
+    def test_unknown_reference_is_reported_with_line(self):
+        with self.assertRaisesMessage(TraceError, "line 2: unknown cluster 9"):
+            TraceLoader(self.user).load(trace_lines(self.cluster, {**self.first, 'cluster_id': 9}))
+
+    def test_management_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as trace:
+            trace.writelines(trace_lines(self.cluster, self.first))
+            trace.flush()
+            out = StringIO()
+            call_command('import_trace', trace.name, user='replayer', stdout=out)
+
+        self.assertEqual(json.loads(out.getvalue())['deployments'], 1)
+        self.assertTrue(Deployment.objects.filter(created_by__username='replayer', status='RUNNING').exists())
+
+
+class TraceReplayTests(APITransactionTestCase):
+    def test_replay_submits_in_time_order_through_the_scheduler(self):
+        user = User.objects.create_user(username="admin", password="admin123")
+        base = {
+            'type': 'deployment', 'docker_image_path': 'https://localhost/image',
+            'required_ram': 8, 'required_cpu': 2, 'required_gpu': 0, 'cluster_id': 7,
+        }
+        lines = trace_lines(
+            {'type': 'cluster', 'id': 7, 'name': 'Replayed', 'total_ram': 16, 'total_cpu': 8, 'total_gpu': 0, 'at': 0},
+            {**base, 'id': 1, 'status': 'COMPLETED', 'at': 0},
+            {**base, 'id': 2, 'dependencies': [1], 'at': 5},
+            # Still blocked on its dependency in the replay, so this is skipped.
+            {'type': 'complete', 'deployment_id': 2, 'at': 6},
+            {'type': 'complete', 'deployment_id': 1, 'at': 30},
+        )
+
+        with override_settings(SCHEDULER_MODE='event'), in_memory_queues() as broker:
+            stats = TraceLoader(user, replay=True, speed=0, broker=broker).load(lines)
+
+        first, second = Deployment.objects.filter(created_by=user).order_by('id')
+        self.assertEqual(first.status, Deployment.Status.COMPLETED)
+        self.assertEqual(second.status, Deployment.Status.RUNNING)
+        self.assertEqual((stats['chunks'], stats['events'], stats['skipped_events']), (4, 1, 1))
+        self.assertEqual(Cluster.objects.get(name='Replayed').allocated_ram, 8)
+
+    def test_replayed_export_holds_dependents_back(self):
+        user = User.objects.create_user(username="admin", password="admin123")
+        cluster = Cluster.objects.create(name="Source", total_ram=64, total_cpu=16, total_gpu=4, created_by=user)
+        values = dict(
+            docker_image_path="https://localhost/image", required_ram=8, required_cpu=2, required_gpu=0,
+            cluster=cluster, created_by=user,
+        )
+        dependency = Deployment.objects.create(**values)
+        Deployment.objects.create(**values)
+        dependent = Deployment.objects.create(**values)
+        dependent.dependencies.add(dependency)
+        exported = ''.join(ndjson(export_records())).splitlines(keepends=True)
+        replayer = User.objects.create_user(username="replayer")
+
+        with override_settings(SCHEDULER_MODE='event'), in_memory_queues() as broker:
+            TraceLoader(replayer, chunk_size=1, replay=True, speed=0, broker=broker).load(exported)
+
+        self.assertEqual(
+            list(Deployment.objects.filter(created_by=replayer).order_by('id').values_list('status', 'unmet_dependencies')),
+            [('RUNNING', 0), ('RUNNING', 0), ('PENDING', 1)],
+        )
+
+    @override_settings(SCHEDULER_MODE='event')
+    def test_replayed_events_wake_the_scheduler_after_their_chunk_commits(self):
+        user = User.objects.create_user(username="admin", password="admin123")
+        queue = empty_queue()
+        loader = TraceLoader(user, replay=True, speed=0)
+        loader.load(trace_lines(
+            {'type': 'cluster', 'id': 7, 'name': 'Replayed', 'total_ram': 16, 'total_cpu': 8, 'total_gpu': 0, 'at': 0},
+            {'type': 'deployment', 'id': 1, 'docker_image_path': 'https://localhost/image',
+             'required_ram': 8, 'required_cpu': 2, 'required_gpu': 0, 'cluster_id': 7, 'at': 0},
+        ))
+        Deployment.objects.filter(created_by=user).update(status=Deployment.Status.RUNNING)
+        Cluster.objects.filter(name='Replayed').update(allocated_ram=8, allocated_cpu=2)
+        queue.empty()
+        during = []
+
+        def finish_and_look(deployment, status):
+            finish(deployment, status)
+            during.append(list(queue.job_ids))
+
+        with mock.patch('core.trace.lifecycle.finish', side_effect=finish_and_look):
+            stats = loader.load(trace_lines({'type': 'complete', 'deployment_id': 1, 'at': 1}))
+
+        cluster = Cluster.objects.get(name='Replayed')
+        self.assertEqual(stats['events'], 1)
+        self.assertEqual(during, [[]])
+        self.assertEqual(queue.job_ids, [f'schedule-cluster-{cluster.id}', 'place-unplaced'])
+
+
+@override_settings(SCHEDULER_MODE='event')
+class LifecycleTests(DeploymentFactoryMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.user.groups.add(Group.objects.get(name='Developer'))
+        self.client.force_authenticate(user=self.user)
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+        self.running = self.create_deployment(status=Deployment.Status.RUNNING)
+        Cluster.objects.filter(id=self.cluster.id).update(allocated_ram=16, allocated_cpu=4, allocated_gpu=1)
+        self.queue = empty_queue()
+
+    def test_complete_releases_resources_and_wakes_dependents(self):
+        dependent = self.create_deployment()
+        dependent.dependencies.add(self.running)
+        self.queue.empty()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('deployment-complete', args=[self.running.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'COMPLETED')
+        self.cluster.refresh_from_db()
+        dependent.refresh_from_db()
+        self.assertEqual((self.cluster.allocated_ram, self.cluster.allocated_cpu, self.cluster.allocated_gpu), (0, 0, 0))
+        self.assertEqual(dependent.unmet_dependencies, 0)
+        self.assertEqual(self.queue.job_ids, [f'schedule-cluster-{self.cluster.id}', 'place-unplaced'])
+
+    def test_passes_are_queued_after_the_transition_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            finish(self.running, Deployment.Status.COMPLETED)
+            self.assertEqual(self.queue.job_ids, [])
+
+        self.assertEqual(self.queue.job_ids, [f'schedule-cluster-{self.cluster.id}', 'place-unplaced'])
+
+    def test_fail_does_not_satisfy_dependents(self):
+        dependent = self.create_deployment()
+        dependent.dependencies.add(self.running)
+
+        response = self.client.post(reverse('deployment-fail', args=[self.running.id]))
+
+        self.assertEqual(response.data['status'], 'FAILED')
+        dependent.refresh_from_db()
+        self.assertEqual(dependent.unmet_dependencies, 1)
+        self.assertEqual(Cluster.objects.get(id=self.cluster.id).allocated_ram, 0)
+
+    def test_cancel_pending_leaves_ledger_alone(self):
+        pending = self.create_deployment()
+
+        response = self.client.post(reverse('deployment-cancel', args=[pending.id]))
+
+        self.assertEqual(response.data['status'], 'CANCELLED')
+        self.assertEqual(Cluster.objects.get(id=self.cluster.id).allocated_ram, 16)
+
+    def test_invalid_transition_conflicts(self):
+        pending = self.create_deployment()
+
+        response = self.client.post(reverse('deployment-complete', args=[pending.id]))
+
+        self.assertEqual(response.status_code, 409)
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, Deployment.Status.PENDING)
+
+    def test_transition_applies_once(self):
+        finish(self.running, Deployment.Status.COMPLETED)
+
+        with self.assertRaises(TransitionError):
+            finish(Deployment.objects.get(id=self.running.id), Deployment.Status.CANCELLED)
+        self.running.save()
+
+        self.assertEqual(Cluster.objects.get(id=self.cluster.id).allocated_ram, 0)
+        self.assertEqual(Deployment.objects.get(id=self.running.id).status, Deployment.Status.COMPLETED)
+
+    def test_requires_developer(self):
+        viewer = User.objects.create_user(username="viewer", password="view123")
+        viewer.groups.add(Group.objects.get(name='Viewer'))
+        self.client.force_authenticate(user=viewer)
+
+        response = self.client.post(reverse('deployment-cancel', args=[self.running.id]))
+
+        self.assertEqual(response.status_code, 403)
+
+
+class StatusEventTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+        self.deployment = Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=16, required_cpu=4, required_gpu=1,
+            cluster=self.cluster, created_by=self.user
+        )
+
+    def published(self, publish):
+        return [event for call in publish.call_args_list for event in call.args[0]]
+
+    def test_transitions_are_published_after_commit(self):
+        with mock.patch.object(events, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.deployment.allocate()
+                self.assertFalse(publish.called)
+            with self.captureOnCommitCallbacks(execute=True):
+                finish(self.deployment, Deployment.Status.COMPLETED)
+
+        deployment_events = [e for e in self.published(publish) if e['type'] == 'deployment']
+        cluster_events = [e for e in self.published(publish) if e['type'] == 'cluster']
+        self.assertEqual([e['status'] for e in deployment_events], ['RUNNING', 'COMPLETED'])
+        self.assertEqual(deployment_events[0], {
+            'type': 'deployment', 'id': self.deployment.id, 'status': 'RUNNING',
+            'priority': 'MEDIUM', 'cluster_id': self.cluster.id,
+        })
+        self.assertEqual([e['allocated_ram'] for e in cluster_events], [16, 0])
+
+    def test_schedule_cluster_publishes_admissions_together(self):
+        second = Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=16, required_cpu=4, required_gpu=1,
+            cluster=self.cluster, created_by=self.user
+        )
+
+        with mock.patch.object(events, 'publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            schedule_cluster(self.cluster.id)
+
+        batches = [[e['id'] for e in call.args[0] if e['type'] == 'deployment'] for call in publish.call_args_list]
+        self.assertIn(sorted([self.deployment.id, second.id]), [sorted(batch) for batch in batches])
+
+    def test_rolled_back_changes_are_not_published(self):
+        with mock.patch.object(events, 'publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.deployment.allocate()
+                transaction.set_rollback(True)
+
+        self.assertFalse(publish.called)
+
+
+class EventHubTests(SimpleTestCase):
+    async def test_dispatch_fans_out_by_key(self):
+        hub = events.Hub(queue_size=2)
+        with mock.patch.object(events.Hub, '_listen', new=mock.AsyncMock()):
+            watched = hub.watch([('deployment', 1)])
+            everything = hub.watch([None])
+            for status in ('PENDING', 'RUNNING', 'COMPLETED'):
+                hub.dispatch({'type': 'deployment', 'id': 1, 'status': status})
+            hub.dispatch({'type': 'deployment', 'id': 2, 'status': 'RUNNING'})
+
+            self.assertEqual([watched.get_nowait()['status'] for _ in range(watched.qsize())], ['RUNNING', 'COMPLETED'])
+            self.assertEqual(everything.qsize(), 2)
+
+            hub.unwatch(watched, [('deployment', 1)])
+            hub.unwatch(everything, [None])
+        self.assertEqual(dict(hub.watchers), {})
+        self.assertIsNone(hub._task)
+
+
+class EventStreamTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+        self.deployment = Deployment.objects.create(
+            docker_image_path="https://localhost/image", required_ram=16, required_cpu=4, required_gpu=1,
+            cluster=self.cluster, created_by=self.user
+        )
+        self.auth = {'headers': {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}}
+
+    def test_stream_is_refused_under_wsgi(self):
+        response = self.client.get(reverse('events'), {'deployments': str(self.deployment.id)}, **self.auth)
+        self.assertEqual(response.status_code, 501)
+
+    async def test_stream_sends_snapshot_then_changes(self):
+        response = await self.async_client.get(
+            reverse('events'), {'deployments': str(self.deployment.id), 'clusters': str(self.cluster.id)}, **self.auth
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+            snapshot = [await anext(chunks), await anext(chunks)]
+            self.assertTrue(snapshot[0].startswith(b'event: deployment\ndata: {"type":"deployment"'))
+            self.assertIn(b'"status":"PENDING"', snapshot[0])
+            self.assertIn(b'"allocated_ram":0', snapshot[1])
+
+            events.publish([
+                {'type': 'deployment', 'id': self.deployment.id + 1, 'status': 'RUNNING'},
+                {'type': 'deployment', 'id': self.deployment.id, 'status': 'RUNNING'},
+            ])
+            change = await asyncio.wait_for(anext(chunks), 5)
+            self.assertEqual(json.loads(change.decode().split('data: ')[1])['id'], self.deployment.id)
+        finally:
+            await chunks.aclose()
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get(reverse('events'), {'deployments': str(self.deployment.id)})
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_firehose_requires_admin(self):
+        response = await self.async_client.get(reverse('events'), **self.auth)
+
+        self.assertEqual(response.status_code, 403)
+
+
+class AsyncReadViewTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.user.groups.add(Group.objects.get(name='Developer'))
+        self.client.force_authenticate(user=self.user)
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+        self.deployments = [
+            Deployment.objects.create(
+                docker_image_path="https://localhost/image", required_ram=1, required_cpu=1, required_gpu=0,
+                cluster=self.cluster, created_by=self.user
+            )
+            for _ in range(5)
+        ]
+        self.deployments[1].dependencies.add(self.deployments[0])
+        self.auth = {'headers': {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}}
+
+    def test_reads_are_served_by_async_views(self):
+        for url in (
+            reverse('cluster-list-create'), reverse('cluster-detail', args=[self.cluster.id]),
+            reverse('deployment-list-create'), reverse('deployment-detail', args=[self.deployments[0].id]),
+        ):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func), url)
+
+    def test_previous_cursor_returns_the_first_page(self):
+        url = reverse('deployment-list-create')
+        first = self.client.get(url, {'page_size': 2})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+
+        self.assertEqual([r['id'] for r in back.data['results']], [r['id'] for r in first.data['results']])
+        self.assertIsNone(back.data['previous'])
+
+    async def test_detail_reads_with_the_async_orm(self):
+        dependent = self.deployments[1]
+        response = await self.async_client.get(reverse('deployment-detail', args=[dependent.id]), **self.auth)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['dependencies'], [self.deployments[0].id])
+        self.assertEqual(response.data['created_by'], 'dev')
+
+        response = await self.async_client.get(reverse('deployment-detail', args=[0]), **self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_unauthenticated_reads_are_rejected(self):
+        response = await self.async_client.get(reverse('cluster-detail', args=[self.cluster.id]))
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_wsgi_requests_close_their_redis_client(self):
+        with mock.patch.object(capacity.aioredis.Redis, 'aclose', autospec=True) as aclose:
+            for _ in range(5):
+                response = self.client.get(reverse('cluster-detail', args=[self.cluster.id]), **self.auth)
+                self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(aclose.call_count, 5)
+
+    async def test_cluster_list_through_async_client(self):
+        response = await self.async_client.get(reverse('cluster-list-create'), **self.auth)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['available_ram'], 64)
+
+
+class MetricsTests(DeploymentFactoryMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+        metrics._pending().clear()
+        get_redis_connection('default').delete(*(metric.key for metric in metrics.REGISTRY.values()))
+
+    def test_observations_are_buffered_until_flushed(self):
+        metrics.requeues.inc(reason='resources')
+        metrics.scheduler_job_seconds.observe(0.03, job='test')
+        self.assertEqual(metrics.stored()['hypervisor_scheduler_requeues_total'], {})
+
+        metrics.flush()
+        metrics.scheduler_job_seconds.observe(20, job='test')
+        metrics.flush()
+
+        self.assertEqual(metrics.stored()['hypervisor_scheduler_requeues_total'], {'reason="resources"': 1})
+        text = metrics.render()
+        self.assertIn('hypervisor_scheduler_job_seconds_bucket{job="test",le="0.025"} 0', text)
+        self.assertIn('hypervisor_scheduler_job_seconds_bucket{job="test",le="0.05"} 1', text)
+        self.assertIn('hypervisor_scheduler_job_seconds_bucket{job="test",le="+Inf"} 2', text)
+        self.assertIn('hypervisor_scheduler_job_seconds_count{job="test"} 2', text)
+        self.assertIn('# TYPE hypervisor_scheduler_requeues_total counter', text)
+
+    def test_labels_must_match(self):
+        with self.assertRaises(ValueError):
+            metrics.requeues.inc(cluster=1)
+
+    def test_scheduler_jobs_record_latency_queries_and_admissions(self):
+        deployment = self.create_deployment(priority='HIGH')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_deployment(deployment.id)
+
+        stored = metrics.stored()
+        self.assertEqual(stored['hypervisor_scheduler_admissions_total'], {'priority="HIGH"': 1})
+        self.assertEqual(stored['hypervisor_scheduler_job_seconds']['job="process_deployment"|count'], 1)
+        self.assertGreater(stored['hypervisor_scheduler_job_queries']['job="process_deployment"|sum'], 0)
+        self.assertEqual(stored['hypervisor_deployment_attempts_before_running']['|0'], 1)
+
+    def test_requeues_and_preemptions_are_counted(self):
+        self.create_deployment(priority='LOW', status=Deployment.Status.RUNNING)
+        Cluster.objects.filter(pk=self.cluster.pk).update(allocated_ram=16, allocated_cpu=4, allocated_gpu=1)
+        capacity.invalidate([self.cluster.id])
+        blocked = self.create_deployment(required_ram=64, required_cpu=16, required_gpu=4, priority='MEDIUM')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            requeue(blocked, 'resources')
+            process_deployment(self.create_deployment(required_ram=64, required_cpu=16, required_gpu=4, priority='HIGH').id)
+
+        stored = metrics.stored()
+        self.assertEqual(stored['hypervisor_scheduler_requeues_total'], {'reason="resources"': 1})
+        self.assertEqual(stored['hypervisor_scheduler_preemptions_total'], {'priority="LOW"': 1})
+
+    def test_disabled_metrics_record_nothing(self):
+        with override_settings(METRICS_ENABLED=False):
+            metrics.requeues.inc(reason='resources')
+            metrics.flush()
+        self.assertEqual(metrics.stored()['hypervisor_scheduler_requeues_total'], {})
+
+    @override_settings(METRICS_TOKEN='scrape')
+    def test_metrics_endpoint(self):
+        self.create_deployment(status=Deployment.Status.RUNNING)
+        Cluster.objects.filter(pk=self.cluster.pk).update(allocated_ram=16, allocated_cpu=4, allocated_gpu=1)
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn(f'hypervisor_cluster_utilization{{cluster="{self.cluster.id}",resource="ram"}} 0.25', text)
+        self.assertIn('hypervisor_deployments{status="RUNNING"} 1', text)
+        self.assertIn('hypervisor_queue_length{queue="high"} 0', text)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_endpoint_is_closed_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code, 404)
+
+    def test_requests_are_timed(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.get(reverse('cluster-list-create'))
+        metrics.flush()
+
+        fields = metrics.stored()['hypervisor_http_request_seconds']
+        self.assertEqual(fields['view="cluster-list-create",method="GET",status="403"|count'], 1)
+
+
+@override_settings(QUERY_PROFILING=True, QUERY_PROFILING_REPEAT_THRESHOLD=3)
+class QueryProfilingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.user.groups.add(Group.objects.get(name='Developer'))
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+        self.deployments = [
+            Deployment.objects.create(
+                docker_image_path="https://localhost/image", required_ram=1, required_cpu=1, required_gpu=0,
+                cluster=self.cluster, created_by=self.user
+            )
+            for _ in range(4)
+        ]
+        self.token = AccessToken.for_user(self.user)
+        self.trace = tempfile.NamedTemporaryFile(suffix='.jsonl')
+        self.addCleanup(self.trace.close)
+
+    def test_fingerprints_ignore_literals_and_in_list_length(self):
+        self.assertEqual(
+            profiling.fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = \'x\' LIMIT 21'),
+            profiling.fingerprint('SELECT  * FROM t WHERE id IN (%s, %s) AND name = \'y\'\nLIMIT 1'),
+        )
+
+    def test_queries_in_a_loop_are_flagged(self):
+        with self.assertLogs('core.profiling', 'WARNING') as logs, profiling.profile('loop') as profile:
+            for deployment in Deployment.objects.filter(id__in=[d.id for d in self.deployments]):
+                deployment.cluster.name
+            Cluster.objects.count()
+
+        self.assertEqual(profile.count, 6)
+        [(sql, count, _)] = profile.repeated()
+        self.assertEqual(count, 4)
+        self.assertIn('"core_cluster"', sql)
+        self.assertIn('Possible N+1 in loop: 4 queries', logs.output[0])
+
+    def test_disabled_profiling_records_nothing(self):
+        with override_settings(QUERY_PROFILING=False), profiling.profile('off') as profile:
+            Cluster.objects.count()
+        self.assertIsNone(profile)
+
+    def test_requests_get_query_headers_and_sampled_traces(self):
+        self.client.force_authenticate(user=self.user)
+        with override_settings(QUERY_PROFILING_TRACE_FILE=self.trace.name, QUERY_PROFILING_SAMPLE_RATE=1):
+            response = self.client.post(reverse('deployment-fail', args=[self.deployments[0].id]))
+
+        self.assertEqual(response.status_code, 409)
+        self.assertGreater(int(response['X-Query-Count']), 0)
+        self.assertTrue(response['Server-Timing'].startswith('db;dur='))
+        [trace] = [json.loads(line) for line in open(self.trace.name)]
+        self.assertEqual(trace['label'], 'POST deployment-fail')
+        self.assertEqual(trace['queries'], int(response['X-Query-Count']))
+        self.assertEqual(trace['n_plus_one'], [])
+
+    def test_unsampled_requests_write_no_trace(self):
+        self.client.force_authenticate(user=self.user)
+        with override_settings(QUERY_PROFILING_TRACE_FILE=self.trace.name, QUERY_PROFILING_SAMPLE_RATE=0):
+            self.client.get(reverse('cluster-list-create'))
+        self.assertEqual(open(self.trace.name).read(), '')
+
+    async def test_async_view_queries_are_counted(self):
+        response = await self.async_client.get(
+            reverse('deployment-detail', args=[self.deployments[0].id]),
+            headers={'Authorization': f'Bearer {self.token}'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response['X-Query-Count']), 1)
+
+    def test_worker_jobs_are_profiled(self):
+        get_queue('default').empty()
+        with override_settings(QUERY_PROFILING_TRACE_FILE=self.trace.name, QUERY_PROFILING_SAMPLE_RATE=1):
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_cluster.delay(self.cluster.id)
+            get_worker('default').work(burst=True)
+
+        [trace] = [json.loads(line) for line in open(self.trace.name)]
+        self.assertEqual(trace['label'], 'job core.scheduler.schedule_cluster')
+        self.assertGreater(trace['queries'], 0)
+
+
+class QueryBudgetTests(APITestCase):
+    def test_every_case_is_within_budget_and_independent_of_fixture_size(self):
+        small = run_budgets(clusters=4, deployments=100)
+        large = run_budgets(clusters=8, deployments=400)
+
+        self.assertEqual(small['failures'], [])
+        self.assertEqual(large['failures'], [])
+        self.assertEqual(set(small['cases']), set(BUDGETS))
+        self.assertEqual(json.loads(json.dumps(small)), small)
+        measured = {case['url'] for case in small['cases'].values()}
+        self.assertEqual({pattern.name for pattern in core_urls.urlpatterns} - measured, set(SKIPPED))
+        self.assertEqual(
+            {name: case['queries'] for name, case in small['cases'].items()},
+            {name: case['queries'] for name, case in large['cases'].items()},
+        )
+
+    def test_regressions_against_a_baseline(self):
+        report = {'cases': {'login': {'queries': 4}, 'profile': {'queries': 1}, 'new-case': {'queries': 9}}}
+        baseline = {'cases': {'login': {'queries': 3}, 'profile': {'queries': 2}}}
+        self.assertEqual(regressions(report, baseline), ["login: 4 queries, was 3"])
+
+    def test_budget_overruns_are_reported(self):
+        with mock.patch.dict(BUDGETS, {'profile': {'queries': 0, 'kib': 256}}):
+            report = run_budgets(clusters=2, deployments=10, cases=['profile'])
+        self.assertEqual(report['failures'], ["profile: 1 queries > budget 0"])
+
+
+
+class FairShareTests(DeploymentFactoryMixin, APITestCase):
+    deployment_defaults = {'required_ram': 16, 'required_cpu': 1, 'required_gpu': 0}
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username="admin", password="admin123")
+        self.admin.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.user = self.developer = User.objects.create_user(username="dev", password="dev123")
+        self.developer.groups.add(Group.objects.get_or_create(name='Developer')[0])
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.admin
+        )
+        self.team_a = Organization.objects.create(name="Team A", created_by=self.admin)
+        self.team_b = Organization.objects.create(name="Team B", created_by=self.admin)
+
+    def create_deployment(self, organization, **kwargs):
+        return super().create_deployment(organization=organization, **kwargs)
+
+    def test_quota_limits_allocation_until_released(self):
+        self.team_a.quota_ram = 16
+        self.team_a.save()
+        first, second = self.create_deployment(self.team_a), self.create_deployment(self.team_a)
+
+        self.assertTrue(first.allocate())
+        self.assertFalse(second.allocate())
+        second.refresh_from_db()
+        self.cluster.refresh_from_db()
+        self.assertEqual(second.status, Deployment.Status.PENDING)
+        self.assertEqual(self.cluster.allocated_ram, 16)
+
+        first.release_resources()
+        self.assertTrue(second.allocate())
+        self.team_a.refresh_from_db()
+        self.assertEqual(self.team_a.allocated_ram, 16)
+
+    def test_deployment_at_quota_is_requeued_for_quota(self):
+        self.team_a.quota_gpu = 1
+        self.team_a.save()
+        deployment = self.create_deployment(self.team_a, required_gpu=2)
+
+        with mock.patch('core.scheduler.requeue') as requeue_mock:
+            process_deployment(deployment.id)
+
+        requeue_mock.assert_called_once_with(mock.ANY, 'quota')
+
+    def test_cluster_pass_alternates_organizations_by_share(self):
+        hungry = [self.create_deployment(self.team_a) for _ in range(4)]
+        modest = [self.create_deployment(self.team_b) for _ in range(2)]
+
+        schedule_cluster(self.cluster.id)
+
+        running = set(Deployment.objects.filter(status=Deployment.Status.RUNNING).values_list('id', flat=True))
+        self.assertEqual(running, {hungry[0].id, hungry[1].id, modest[0].id, modest[1].id})
+        self.team_a.refresh_from_db()
+        self.team_b.refresh_from_db()
+        self.assertEqual((self.team_a.allocated_ram, self.team_b.allocated_ram), (32, 32))
+
+    def test_without_fair_share_admission_is_first_come(self):
+        hungry = [self.create_deployment(self.team_a) for _ in range(4)]
+        self.create_deployment(self.team_b)
+
+        with override_settings(FAIR_SHARE=False):
+            schedule_cluster(self.cluster.id)
+
+        running = set(Deployment.objects.filter(status=Deployment.Status.RUNNING).values_list('id', flat=True))
+        self.assertEqual(running, {deployment.id for deployment in hungry})
+
+    def test_organization_cannot_preempt_a_smaller_one(self):
+        small = self.create_deployment(self.team_a, priority='LOW')
+        large = [self.create_deployment(self.team_b, priority='LOW') for _ in range(3)]
+        for deployment in [small, *large]:
+            deployment.allocate()
+
+        urgent = self.create_deployment(self.team_b, priority='HIGH')
+        process_deployment(urgent.id)
+
+        small.refresh_from_db()
+        urgent.refresh_from_db()
+        self.assertEqual(small.status, Deployment.Status.RUNNING)
+        self.assertEqual(urgent.status, Deployment.Status.RUNNING)
+        self.assertEqual(
+            Deployment.objects.filter(id__in=[d.id for d in large], status=Deployment.Status.PENDING).count(), 1
+        )
+
+        catching_up = self.create_deployment(self.team_a, priority='HIGH')
+        process_deployment(catching_up.id)
+
+        catching_up.refresh_from_db()
+        self.assertEqual(catching_up.status, Deployment.Status.RUNNING)
+        self.team_a.refresh_from_db()
+        self.team_b.refresh_from_db()
+        self.assertEqual((self.team_a.allocated_ram, self.team_b.allocated_ram), (32, 32))
+
+    def test_finishing_releases_the_organization(self):
+        deployment = self.create_deployment(self.team_a)
+        deployment.allocate()
+
+        finish(deployment, Deployment.Status.COMPLETED)
+
+        self.team_a.refresh_from_db()
+        self.assertEqual(self.team_a.allocated_ram, 0)
+
+    def test_only_members_charge_an_organization(self):
+        self.client.force_authenticate(user=self.developer)
+        data = {
+            "docker_image_path": "https://localhost/image", "required_ram": 1, "required_cpu": 1,
+            "required_gpu": 0, "cluster": self.cluster.id, "organization": self.team_a.id,
+        }
+
+        response = self.client.post(reverse('deployment-list-create'), data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('organization', response.data)
+
+        OrganizationMember.objects.create(user=self.developer, organization=self.team_a)
+        response = self.client.post(reverse('deployment-list-create'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['organization'], self.team_a.id)
+
+        response = self.client.post(reverse('deployment-bulk-create'), [
+            data, {**data, "organization": self.team_b.id},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('organization', response.data[1])
+
+    def test_admins_set_quotas(self):
+        url = reverse('organization-quota', args=[self.team_a.id])
+        self.client.force_authenticate(user=self.developer)
+        self.assertEqual(self.client.patch(url, {"quota_ram": 32}, format='json').status_code, 403)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.patch(url, {"quota_ram": 32, "weight": 2}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['quota_ram'], response.data['weight']), (32, 2))
+
+        self.create_deployment(self.team_a).allocate()
+        response = self.client.get(url)
+        self.assertEqual(response.data['allocated_ram'], 16)
+        self.assertEqual(response.data['share'], 16 / 64 / 2)
+
+
+class GangSchedulingTests(DeploymentFactoryMixin, APITestCase):
+    deployment_defaults = {'required_ram': 16, 'required_cpu': 1, 'required_gpu': 0}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="dev", password="dev123")
+        self.user.groups.add(Group.objects.get_or_create(name='Developer')[0])
+        self.cluster = Cluster.objects.create(
+            name="Test Cluster", total_ram=64, total_cpu=16, total_gpu=4, created_by=self.user
+        )
+
+    def create_gang(self, size, **kwargs):
+        group = DeploymentGroup.objects.create(name="gang", created_by=self.user)
+        return [self.create_deployment(group=group, **kwargs) for _ in range(size)]
+
+    def statuses(self, deployments):
+        return [Deployment.objects.get(pk=deployment.pk).status for deployment in deployments]
+
+    def test_gang_only_starts_when_every_member_fits(self):
+        blocker = self.create_deployment(required_ram=32)
+        blocker.allocate()
+        gang = self.create_gang(3)
+
+        process_deployment(gang[0].id)
+
+        self.assertEqual(self.statuses(gang), [Deployment.Status.PENDING] * 3)
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.allocated_ram, 32)
+
+        finish(blocker, Deployment.Status.COMPLETED)
+        process_deployment(gang[2].id)
+
+        self.assertEqual(self.statuses(gang), [Deployment.Status.RUNNING] * 3)
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.allocated_ram, 48)
+
+    def test_cluster_pass_skips_a_gang_that_does_not_fit(self):
+        gang = self.create_gang(2, required_ram=32)
+        single = self.create_deployment(required_ram=8)
+        self.create_deployment(required_ram=32).allocate()
+
+        schedule_cluster(self.cluster.id)
+
+        self.assertEqual(self.statuses(gang), [Deployment.Status.PENDING] * 2)
+        self.assertEqual(self.statuses([single]), [Deployment.Status.RUNNING])
+
+    def test_gang_waits_for_the_dependencies_of_every_member(self):
+        dependency = self.create_deployment()
+        gang = self.create_gang(2)
+        gang[1].dependencies.add(dependency)
+
+        schedule_cluster(self.cluster.id)
+
+        self.assertEqual(self.statuses(gang), [Deployment.Status.PENDING] * 2)
+
+    def test_gang_is_preempted_as_a_whole(self):
+        gang = self.create_gang(2, priority='LOW')
+        medium = self.create_deployment(required_ram=32, priority='MEDIUM')
+        for deployment in [*gang, medium]:
+            deployment.allocate()
+
+        urgent = self.create_deployment(required_ram=16, priority='HIGH')
+        process_deployment(urgent.id)
+
+        self.assertEqual(self.statuses(gang), [Deployment.Status.PENDING] * 2)
+        self.assertEqual(self.statuses([medium, urgent]), [Deployment.Status.RUNNING] * 2)
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.allocated_ram, 48)
+
+    def test_gang_preempts_for_its_combined_demand(self):
+        low = [self.create_deployment(priority='LOW') for _ in range(4)]
+        for deployment in low:
+            deployment.allocate()
+        gang = self.create_gang(2, priority='HIGH')
+
+        schedule_cluster(self.cluster.id)
+
+        self.assertEqual(self.statuses(gang), [Deployment.Status.RUNNING] * 2)
+        self.assertEqual(sorted(self.statuses(low)).count(Deployment.Status.PENDING), 2)
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.allocated_ram, 64)
+
+    def test_unplaced_gang_lands_on_one_cluster(self):
+        self.cluster.delete()
+        clusters = [
+            Cluster.objects.create(name=f"c{i}", total_ram=32, total_cpu=8, total_gpu=0, created_by=self.user)
+            for i in range(2)
+        ]
+        too_big = self.create_gang(2, cluster=None, required_ram=24)
+        fits = self.create_gang(2, cluster=None)
+
+        place_unplaced()
+
+        self.assertEqual(self.statuses(too_big), [Deployment.Status.PENDING] * 2)
+        self.assertEqual(self.statuses(fits), [Deployment.Status.RUNNING] * 2)
+        placed = {Deployment.objects.get(pk=deployment.pk).cluster_id for deployment in fits}
+        self.assertEqual(len(placed), 1)
+        self.assertIn(placed.pop(), {cluster.id for cluster in clusters})
+
+    def test_failing_a_member_sends_the_gang_back(self):
+        gang = self.create_gang(3)
+        process_deployment(gang[0].id)
+
+        finish(gang[1], Deployment.Status.FAILED)
+
+        self.assertEqual(
+            self.statuses(gang), [Deployment.Status.PENDING, Deployment.Status.FAILED, Deployment.Status.PENDING]
+        )
+        self.cluster.refresh_from_db()
+        self.assertEqual(self.cluster.allocated_ram, 0)
+
+    def test_completing_a_member_leaves_the_gang_running(self):
+        gang = self.create_gang(2)
+        process_deployment(gang[0].id)
+
+        finish(gang[0], Deployment.Status.COMPLETED)
+
+        self.assertEqual(self.statuses(gang), [Deployment.Status.COMPLETED, Deployment.Status.RUNNING])
+
+    @override_settings(SCHEDULER_MODE='poll')
+    def test_blocked_gang_is_retried_as_one_unit(self):
+        queue = get_queue('medium')
+        queue.empty()
+        queue.scheduled_job_registry.remove_jobs()
+        gang = self.create_gang(4, required_ram=32)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            submit_many(gang)
+            dispatch(gangs.Gang(gang))
+        self.assertEqual(queue.count, 1)
+
+        process_deployment(gang[2].id)
+        process_deployment(gang[0].id)
+
+        self.assertEqual(
+            sorted(queue.scheduled_job_registry.get_job_ids()),
+            [f'retry-group-{gang[0].group_id}-0', f'retry-group-{gang[0].group_id}-1'],
+        )
+        self.assertEqual({deployment.attempts for deployment in Deployment.objects.filter(group=gang[0].group)}, {2})
+
+    def test_bulk_submission_creates_a_gang(self):
+        self.client.force_authenticate(user=self.user)
+        item = {
+            "docker_image_path": "https://localhost/image", "required_ram": 8, "required_cpu": 1,
+            "required_gpu": 0, "cluster": self.cluster.id,
+        }
+        url = reverse('deployment-bulk-create')
+
+        response = self.client.post(url, {"group": "trainer", "deployments": [item, item]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        [group] = DeploymentGroup.objects.all()
+        self.assertEqual([row['group'] for row in response.data], [group.id, group.id])
+
+        response = self.client.post(url, {"group": "mixed", "deployments": [item, {**item, "priority": "HIGH"}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {"group": "chained", "deployments": [item, {**item, "depends_on": [0]}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(DeploymentGroup.objects.count(), 1)
@@ -0,0 +1,265 @@
+import json
+import time
+
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+
+from .models import Cluster, Deployment
+from . import capacity, dependencies, lifecycle, scheduler
+
+CHUNK_SIZE = 5000
+
+CLUSTER_FIELDS = ('name', 'total_ram', 'total_cpu', 'total_gpu')
+DEPLOYMENT_FIELDS = ('docker_image_path', 'priority', 'required_ram', 'required_cpu', 'required_gpu')
+# Event type -> status it leaves the deployment in.
+EVENTS = {
+    'complete': Deployment.Status.COMPLETED,
+    'fail': Deployment.Status.FAILED,
+    'cancel': Deployment.Status.CANCELLED,
+    'release': Deployment.Status.PENDING,
+}
+
+Edge = Deployment.dependencies.through
+
+
+class TraceError(Exception):
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+
+
+def _timestamp(value):
+    """Seconds for an ISO datetime or a plain number; None if absent."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"invalid timestamp {value!r}")
+    return parsed.timestamp()
+
+
+class TraceLoader:
+    """Load a JSONL workload trace into the database, optionally replaying it.
+
+    A trace is a chronological stream of records with a ``type``:
+    ``cluster``, ``deployment`` (a submission; may list earlier
+    ``dependencies`` by trace id), ``dependency`` (``deployment_id`` depends on
+    ``depends_on_id``; must follow both deployments), and the events
+    ``complete``, ``fail``, ``cancel`` and ``release`` for a
+    ``deployment_id``. Exports from ``core.export`` are valid traces. Ids in
+    the trace are mapped to the rows created for them.
+
+    Records are written in bulk, one transaction per chunk. In load mode the
+    recorded statuses are kept and unmet dependency counts and cluster
+    allocations are recomputed in two statements at the end. In replay mode
+    deployments are submitted as PENDING at their recorded time (``at`` or
+    ``created_at``), scaled down by ``speed``, and handed to the scheduler;
+    events go through ``core.lifecycle`` and are skipped when the deployment
+    is not in a status they apply to in the replay; the scheduling passes they
+    request are enqueued when their chunk commits. With ``broker`` (see
+    ``core.benchmark.in_memory_queues``) scheduler jobs run in-process between
+    chunks instead of on workers.
+    """
+
+    def __init__(self, user, chunk_size=CHUNK_SIZE, replay=False, speed=60.0, broker=None):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.replay = replay
+        self.speed = speed
+        self.broker = broker
+        self.clusters = {}
+        self.deployments = {}
+        self.stats = {
+            'clusters': 0, 'deployments': 0, 'dependencies': 0,
+            'events': 0, 'skipped_events': 0, 'chunks': 0, 'jobs': 0,
+        }
+        self._buffer = []
+        self._started = None
+        self._first_at = None
+        self._last_at = None
+
+    def load(self, lines):
+        started = time.perf_counter()
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                at = _timestamp(record.get('at', record.get('created_at')))
+            except ValueError as exc:
+                raise TraceError(number, exc)
+            if self.replay and at is not None:
+                if self._last_at is None:
+                    self._first_at, self._started = at, time.monotonic()
+                elif at > self._last_at:
+                    self._flush()
+                    self._wait(at)
+            if at is not None:
+                self._last_at = at if self._last_at is None else max(self._last_at, at)
+            # A chunk never ends between a deployment and the dependency records
+            # that follow it, so its edges exist before it is submitted.
+            if len(self._buffer) >= self.chunk_size and record.get('type') != 'dependency':
+                self._flush()
+            self._buffer.append((number, record))
+        self._flush()
+        if not self.replay:
+            self._reconcile()
+        self.stats['seconds'] = round(time.perf_counter() - started, 3)
+        return self.stats
+
+    def _wait(self, at):
+        if self.broker is not None:
+            self.broker.advance(at - self._last_at)
+        if self.speed:
+            delay = self._started + (at - self._first_at) / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, []
+        submitted = []
+        with transaction.atomic():
+            clusters = [(n, r) for n, r in buffer if r.get('type') == 'cluster']
+            if clusters:
+                self._create_clusters(clusters)
+            deployments = [(n, r) for n, r in buffer if r.get('type') == 'deployment']
+            if deployments:
+                submitted = self._create_deployments(deployments)
+            edges = [
+                (deployment.id, self._deployment_id(number, dependency_id))
+                for (number, record), deployment in zip(deployments, submitted)
+                for dependency_id in record.get('dependencies') or []
+            ] + [
+                (self._deployment_id(number, record.get('deployment_id')),
+                 self._deployment_id(number, record.get('depends_on_id')))
+                for number, record in buffer if record.get('type') == 'dependency'
+            ]
+            if edges:
+                self._create_edges(edges)
+            events = []
+            for number, record in buffer:
+                if record.get('type') in EVENTS:
+                    events.append((number, record))
+                elif record.get('type') not in ('cluster', 'deployment', 'dependency'):
+                    raise TraceError(number, f"unknown record type {record.get('type')!r}")
+            if events:
+                self._apply_events(events)
+            if self.replay and submitted:
+                transaction.on_commit(lambda: scheduler.submit_many(submitted))
+        self.stats['chunks'] += 1
+        self._drain()
+
+    def _drain(self):
+        if self.broker is None:
+            return
+        while self.broker.run_next() is not None:
+            self.stats['jobs'] += 1
+
+    def _create_clusters(self, records):
+        rows = [
+            Cluster(created_by=self.user, **{field: record[field] for field in CLUSTER_FIELDS if field in record})
+            for _, record in records
+        ]
+        created = Cluster.objects.bulk_create(rows)
+        capacity.invalidate([cluster.id for cluster in created])
+        for (_, record), cluster in zip(records, created):
+            if 'id' in record:
+                self.clusters[record['id']] = cluster.id
+        self.stats['clusters'] += len(created)
+
+    def _cluster_id(self, number, record):
+        trace_id = record.get('cluster_id', record.get('cluster'))
+        if trace_id is None:
+            return None
+        if trace_id not in self.clusters:
+            raise TraceError(number, f"unknown cluster {trace_id!r}")
+        return self.clusters[trace_id]
+
+    def _create_deployments(self, records):
+        rows = []
+        for number, record in records:
+            deployment = Deployment(
+                created_by=self.user,
+                cluster_id=self._cluster_id(number, record),
+                **{field: record[field] for field in DEPLOYMENT_FIELDS if field in record}
+            )
+            if not self.replay:
+                deployment.status = record.get('status', Deployment.Status.PENDING)
+            deployment.priority_rank = Deployment.PRIORITY_RANKS[deployment.priority]
+            rows.append(deployment)
+        created = Deployment.objects.bulk_create(rows)
+        for (_, record), deployment in zip(records, created):
+            if 'id' in record:
+                self.deployments[record['id']] = deployment.id
+        self.stats['deployments'] += len(created)
+        return created
+
+    def _deployment_id(self, number, trace_id):
+        if trace_id not in self.deployments:
+            raise TraceError(number, f"unknown deployment {trace_id!r}")
+        return self.deployments[trace_id]
+
+    def _create_edges(self, edges):
+        pairs = list(dict.fromkeys(edges))
+        Edge.objects.bulk_create(
+            [Edge(from_deployment_id=a, to_deployment_id=b) for a, b in pairs],
+            batch_size=self.chunk_size,
+            ignore_conflicts=True,
+        )
+        if self.replay:
+            dependencies.add_edges(pairs)
+        self.stats['dependencies'] += len(pairs)
+
+    def _apply_events(self, events):
+        if not self.replay:
+            # Only the final status matters; counts and ledgers are reconciled at the end.
+            final = {
+                self._deployment_id(number, record.get('deployment_id')): record['type']
+                for number, record in events
+            }
+            for status in set(EVENTS.values()):
+                ids = [deployment_id for deployment_id, event in final.items() if EVENTS[event] == status]
+                if ids:
+                    Deployment.objects.filter(id__in=ids).update(status=status)
+            self.stats['events'] += len(events)
+            return
+        for number, record in events:
+            deployment = Deployment.objects.get(id=self._deployment_id(number, record.get('deployment_id')))
+            if record['type'] == 'release':
+                applied = deployment.release_resources()
+            else:
+                try:
+                    lifecycle.finish(deployment, EVENTS[record['type']])
+                    applied = True
+                except lifecycle.TransitionError:
+                    applied = False
+            self.stats['events' if applied else 'skipped_events'] += 1
+
+    def _reconcile(self):
+        """Recompute unmet dependency counts and cluster allocations from the loaded rows."""
+        imported = Deployment.objects.filter(created_by=self.user)
+        unmet = Edge.objects.filter(
+            from_deployment=OuterRef('pk')
+        ).exclude(
+            to_deployment__status=Deployment.Status.COMPLETED
+        ).values('from_deployment').annotate(count=Count('pk')).values('count')
+        with transaction.atomic():
+            imported.update(unmet_dependencies=Coalesce(Subquery(unmet, output_field=IntegerField()), Value(0)))
+            running = Deployment.objects.filter(
+                cluster=OuterRef('pk'), status=Deployment.Status.RUNNING
+            ).values('cluster')
+            Cluster.objects.filter(created_by=self.user).update(**{
+                f'allocated_{resource}': Coalesce(
+                    Subquery(running.annotate(total=Sum(f'required_{resource}')).values('total'),
+                             output_field=IntegerField()),
+                    Value(0),
+                )
+                for resource in ('ram', 'cpu', 'gpu')
+            })
+        capacity.invalidate(self.clusters.values())
@@ -1,26 +1,41 @@
 from django.urls import path
-from .views import RegisterView, LoginView, ProfileView, ClusterListCreateView, ClusterDetailView, \
-    DeploymentListCreateView, DeploymentDetailView
+from .models import Deployment
+from .views import RegisterView, LoginView, LogoutView, ProfileView, ClusterListCreateView, ClusterDetailView, \
+    DeploymentListCreateView, DeploymentDetailView, BulkDeploymentCreateView, DeploymentTransitionView, ExportView, \
+    EventStreamView
 from django.urls import path
 from .views import (
     CreateOrganizationView,
     GenerateInviteCodeView,
-    JoinOrganizationView
+    JoinOrganizationView,
+    OrganizationQuotaView
 )
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
+    path('logout/', LogoutView.as_view(), name='logout'),
     path('profile/', ProfileView.as_view(), name='profile'),
 
     path('organizations/', CreateOrganizationView.as_view(), name='create-organization'),
     path('organizations/<int:pk>/invite-code/', GenerateInviteCodeView.as_view(), name='get-invite-code'),
     path('organizations/join/', JoinOrganizationView.as_view(), name='join-organization'),
+    path('organizations/<int:pk>/quota/', OrganizationQuotaView.as_view(), name='organization-quota'),
 
     path('clusters/', ClusterListCreateView.as_view(), name='cluster-list-create'),
     path('clusters/<int:pk>/', ClusterDetailView.as_view(), name='cluster-detail'),
 
     path('deployments/', DeploymentListCreateView.as_view(), name='deployment-list-create'),
+    path('deployments/bulk/', BulkDeploymentCreateView.as_view(), name='deployment-bulk-create'),
     path('deployments/<int:pk>/', DeploymentDetailView.as_view(), name='deployment-detail'),
+    path('deployments/<int:pk>/complete/',
+         DeploymentTransitionView.as_view(target_status=Deployment.Status.COMPLETED), name='deployment-complete'),
+    path('deployments/<int:pk>/fail/',
+         DeploymentTransitionView.as_view(target_status=Deployment.Status.FAILED), name='deployment-fail'),
+    path('deployments/<int:pk>/cancel/',
+         DeploymentTransitionView.as_view(target_status=Deployment.Status.CANCELLED), name='deployment-cancel'),
+
+    path('export/', ExportView.as_view(), name='export'),
+    path('events/', EventStreamView.as_view(), name='events'),
 
 ]
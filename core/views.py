@@ -1,16 +1,29 @@
 from rest_framework_simplejwt.views import TokenObtainPairView
+from django.conf import settings
 from django.contrib.auth.models import User
-from .serializers import UserSerializer, RegisterSerializer, CustomTokenObtainPairSerializer
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from asgiref.sync import sync_to_async
+from .serializers import UserSerializer, RegisterSerializer, CustomTokenObtainPairSerializer, LogoutSerializer
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import APIException, NotAuthenticated, PermissionDenied, ValidationError
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
 from .models import Organization, OrganizationMember, Cluster
-from .serializers import OrganizationSerializer, JoinOrganizationSerializer, ClusterSerializer
+from .serializers import OrganizationSerializer, OrganizationQuotaSerializer, JoinOrganizationSerializer, \
+    ClusterSerializer
 from .swagger import JWTSwaggerAutoSchema
-from django_rq import job, get_queue
-from .models import Deployment
-from .serializers import DeploymentSerializer
-from django.db import models
-from django.db import transaction
+from .models import Deployment, DeploymentGroup
+from .serializers import DeploymentSerializer, BulkDeploymentSerializer
+from . import capacity, events, lifecycle, metrics
+from .export import SECTIONS, aiterate, export_records, ndjson
+from .authentication import revoke
+from .pagination import IdCursorPagination
+from .scheduler import quota_freed, submit, submit_many
 from .permissions import IsAdmin, IsDeveloper, IsViewer, IsAdminOrReadOnly
 
 
@@ -33,6 +46,19 @@ class LoginView(TokenObtainPairView):
             })
         return response
 
+class LogoutView(generics.GenericAPIView):
+    """Revoke the given refresh token and the access token the request was made with."""
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = LogoutSerializer
+    schema_class = JWTSwaggerAutoSchema
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        revoke(serializer.validated_data['refresh'])
+        revoke(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 class ProfileView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = UserSerializer
@@ -60,6 +86,21 @@ class GenerateInviteCodeView(generics.RetrieveAPIView):
             self.permission_denied(self.request, "You are not the creator of this organization.")
         return organization
 
+class OrganizationQuotaView(generics.RetrieveUpdateAPIView):
+    """Read or set an organization's quotas and fair-share weight.
+
+    Raising a quota or weight takes effect at the next scheduling decision;
+    the organization's parked deployments are woken right away.
+    """
+    permission_classes = [IsAdminOrReadOnly]
+    serializer_class = OrganizationQuotaSerializer
+    schema_class = JWTSwaggerAutoSchema
+    queryset = Organization.objects.all()
+
+    def perform_update(self, serializer):
+        organization = serializer.save()
+        quota_freed(organization.id)
+
 class JoinOrganizationView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = JoinOrganizationSerializer
@@ -82,140 +123,389 @@ class JoinOrganizationView(generics.CreateAPIView):
             status=status.HTTP_201_CREATED
         )
 
-class ClusterListCreateView(generics.ListCreateAPIView):
+class AsyncReadMixin:
+    """Serve GET and HEAD with ``aget`` on the event loop; other methods keep DRF's sync path.
+
+    Authentication and permission checks run in a worker thread since they
+    may hit the database or cache, but the read itself uses the async ORM,
+    so under ASGI a slow client does not hold a thread while it waits. The
+    view class stays a regular DRF view for routing and the schema.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        sync_view = super().as_view(**initkwargs)
+
+        async def view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            try:
+                return await self.async_dispatch(request, *args, **kwargs)
+            finally:
+                if not isinstance(request, ASGIRequest):
+                    # Under WSGI every request runs on an event loop of its own.
+                    await capacity.aclose()
+
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.csrf_exempt = True
+        return view
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await self.aget(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            obj = await queryset.aget(pk=self.kwargs['pk'])
+        except queryset.model.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class ClusterListCreateView(AsyncReadMixin, generics.ListCreateAPIView):
     permission_classes = [IsAdminOrReadOnly]
     serializer_class = ClusterSerializer
     schema_class = JWTSwaggerAutoSchema
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
-        return Cluster.objects.select_related('created_by').prefetch_related('deployments')
+        return Cluster.objects.select_related('created_by')
+
+    async def aget(self, request, *args, **kwargs):
+        # Only the page of ids comes from the database; the rows themselves
+        # are served from the capacity cache.
+        page = await self.paginator.apaginate_queryset(Cluster.objects.only('id'), request, view=self)
+        snapshots = await capacity.aget_many(cluster.id for cluster in page)
+        serializer = self.get_serializer(
+            [snapshots[cluster.id] for cluster in page if cluster.id in snapshots], many=True
+        )
+        return self.get_paginated_response(serializer.data)
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
-class ClusterDetailView(generics.RetrieveAPIView):
+class ClusterDetailView(AsyncReadMixin, generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ClusterSerializer
     schema_class = JWTSwaggerAutoSchema
     queryset = Cluster.objects.all()
 
-@job('default', timeout=3600)
-def process_deployment(deployment_id):
-    deployment = Deployment.objects.get(id=deployment_id)
-
-    cluster = deployment.cluster
-    if (cluster.available_ram >= deployment.required_ram and
-            cluster.available_cpu >= deployment.required_cpu and
-            cluster.available_gpu >= deployment.required_gpu):
-
-        cluster.allocated_ram += deployment.required_ram
-        cluster.allocated_cpu += deployment.required_cpu
-        cluster.allocated_gpu += deployment.required_gpu
-        cluster.save()
-
-        deployment.status = Deployment.Status.RUNNING
-        deployment.save()
-    else:
-        deployment.status = Deployment.Status.PENDING
-        deployment.save()
-        get_queue('default').enqueue(process_deployment, deployment.id)
-
-
-class DeploymentListCreateView(generics.ListCreateAPIView):
+    async def aget(self, request, *args, **kwargs):
+        snapshot = (await capacity.aget_many([self.kwargs['pk']])).get(self.kwargs['pk'])
+        if snapshot is None:
+            raise Http404
+        self.check_object_permissions(request, snapshot)
+        return Response(self.get_serializer(snapshot).data)
+
+def choice_filter(params, name, choices):
+    value = params.get(name)
+    if value is None:
+        return None
+    values = [v.strip().upper() for v in value.split(',') if v.strip()]
+    invalid = [v for v in values if v not in choices]
+    if invalid:
+        raise ValidationError({name: f"Invalid value(s): {', '.join(invalid)}"})
+    return values
+
+def filter_deployments(queryset, params):
+    statuses = choice_filter(params, 'status', Deployment.Status.values)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    priorities = choice_filter(params, 'priority', Deployment.Priority.values)
+    if priorities:
+        queryset = queryset.filter(priority__in=priorities)
+    cluster = params.get('cluster')
+    if cluster is not None:
+        if cluster.lower() == 'none':
+            queryset = queryset.filter(cluster__isnull=True)
+        elif cluster.isdigit():
+            queryset = queryset.filter(cluster_id=int(cluster))
+        else:
+            raise ValidationError({'cluster': "Expected a cluster id or 'none'."})
+    return queryset
+
+class DeploymentListCreateView(AsyncReadMixin, generics.ListCreateAPIView):
+    """List deployments newest first, optionally filtered.
+
+    ``?status=`` and ``?priority=`` take one or more comma-separated values;
+    ``?cluster=`` takes a cluster id, or ``none`` for unplaced deployments.
+    """
     permission_classes = [IsDeveloper]
     serializer_class = DeploymentSerializer
     schema_class = JWTSwaggerAutoSchema
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
-        return Deployment.objects.select_related('cluster', 'created_by')\
-                   .prefetch_related('dependencies')
+        queryset = Deployment.objects.select_related('created_by').prefetch_related('dependencies')
+        if self.request.method != 'GET':
+            return queryset
+        return filter_deployments(queryset, self.request.query_params)
+
+    async def aget(self, request, *args, **kwargs):
+        page = await self.paginator.apaginate_queryset(self.get_queryset(), request, view=self)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
     def perform_create(self, serializer):
         deployment = serializer.save(created_by=self.request.user)
-        process_deployment.delay(deployment.id)
+        submit(deployment)
+
+
+def pk_set(values):
+    """The values that look like primary keys; the serializer reports the rest."""
+    pks = set()
+    for value in values if isinstance(values, list) else [values]:
+        try:
+            pks.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return pks
+
+def validate_gang(items):
+    """Members of a gang are admitted as one unit, so they must be schedulable as one."""
+    shared = {
+        (data.get('cluster'), data.get('organization'), data.get('priority', Deployment.Priority.MEDIUM))
+        for data in items
+    }
+    if len(shared) > 1:
+        raise ValidationError({'group': "Deployments in a group must share cluster, organization and priority."})
+    if any(data.get('depends_on') for data in items):
+        raise ValidationError({'group': "Deployments in a group cannot depend on each other."})
+
+class BulkDeploymentCreateView(generics.GenericAPIView):
+    """Submit a batch of deployments in one request.
+
+    The body is a list of deployments, or ``{"deployments": [...]}``. Besides
+    ``dependencies`` on existing deployments, each one may list
+    ``depends_on``: positions of earlier deployments in the same batch.
+    With ``{"deployments": [...], "group": "<name>"}`` the batch becomes a
+    gang that is only ever started and preempted as a whole (see
+    core.gangs). Validation, the inserts and the hand-off to the scheduler
+    take the same number of queries and Redis round trips whatever the batch
+    size.
+    """
+    permission_classes = [IsDeveloper]
+    serializer_class = BulkDeploymentSerializer
+    schema_class = JWTSwaggerAutoSchema
+
+    def post(self, request, *args, **kwargs):
+        items = request.data.get('deployments') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({'deployments': "Expected a non-empty list of deployments."})
+        group_name = request.data.get('group') if isinstance(request.data, dict) else None
+        if group_name is not None and (not isinstance(group_name, str) or not group_name.strip()):
+            raise ValidationError({'group': "Expected a group name."})
+        limit = getattr(settings, 'DEPLOYMENT_BULK_LIMIT', 1000)
+        if len(items) > limit:
+            raise ValidationError({'deployments': f"At most {limit} deployments can be submitted at once."})
+
+        cluster_ids, dependency_ids, organization_ids = set(), set(), set()
+        for item in items:
+            if isinstance(item, dict):
+                cluster_ids |= pk_set(item.get('cluster'))
+                dependency_ids |= pk_set(item.get('dependencies'))
+                organization_ids |= pk_set(item.get('organization'))
+        context = self.get_serializer_context()
+        context['bulk_related'] = {
+            Cluster: Cluster.objects.only('id').in_bulk(cluster_ids),
+            Deployment: Deployment.objects.only('id', 'status').in_bulk(dependency_ids),
+            Organization: Organization.objects.only('id').in_bulk(organization_ids) if organization_ids else {},
+        }
+        if organization_ids:
+            context['member_organizations'] = set(
+                Organization.objects.filter(id__in=organization_ids).for_member(request.user)
+                .values_list('id', flat=True)
+            )
+        serializer = BulkDeploymentSerializer(data=items, many=True, context=context)
+        serializer.is_valid(raise_exception=True)
+
+        errors = [
+            {'depends_on': ["Can only depend on earlier deployments in the batch."]}
+            if any(position >= index for position in data.get('depends_on', [])) else {}
+            for index, data in enumerate(serializer.validated_data)
+        ]
+        if any(errors):
+            raise ValidationError(errors)
+        if group_name is not None:
+            validate_gang(serializer.validated_data)
+
+        with transaction.atomic():
+            # Re-read the dependencies under a row lock: one completing between
+            # validation and commit would not see the new edges and would leave
+            # its dependents' counts stuck.
+            referenced = {
+                dependency.id for data in serializer.validated_data for dependency in data.get('dependencies', [])
+            }
+            statuses = dict(
+                Deployment.objects.select_for_update().filter(id__in=referenced).order_by('id')
+                .values_list('id', 'status')
+            ) if referenced else {}
+            group = DeploymentGroup.objects.create(name=group_name, created_by=request.user) if group_name else None
+            rows = []
+            for data in serializer.validated_data:
+                fields = {k: v for k, v in data.items() if k not in ('dependencies', 'depends_on')}
+                deployment = Deployment(created_by=request.user, group=group, **fields)
+                deployment.priority_rank = Deployment.PRIORITY_RANKS[deployment.priority]
+                deployment.unmet_dependencies = len(set(data.get('depends_on', []))) + sum(
+                    statuses[dependency.id] != Deployment.Status.COMPLETED
+                    for dependency in set(data.get('dependencies', []))
+                )
+                rows.append(deployment)
+            created = Deployment.objects.bulk_create(rows)
+
+            Edge = Deployment.dependencies.through
+            edges = []
+            for deployment, data in zip(created, serializer.validated_data):
+                edges += [Edge(from_deployment_id=deployment.id, to_deployment_id=dependency.id)
+                          for dependency in set(data.get('dependencies', []))]
+                edges += [Edge(from_deployment_id=deployment.id, to_deployment_id=created[position].id)
+                          for position in set(data.get('depends_on', []))]
+            Edge.objects.bulk_create(edges, batch_size=5000)
+            transaction.on_commit(lambda: submit_many(created))
+
+        prefetch_related_objects(created, 'dependencies')
+        return Response(
+            BulkDeploymentSerializer(created, many=True, context=context).data,
+            status=status.HTTP_201_CREATED
+        )
 
 
-class DeploymentDetailView(generics.RetrieveAPIView):
+class DeploymentDetailView(AsyncReadMixin, generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = DeploymentSerializer
     schema_class = JWTSwaggerAutoSchema
+    queryset = Deployment.objects.select_related('created_by').prefetch_related('dependencies')
+
+    async def aget(self, request, *args, **kwargs):
+        return Response(self.get_serializer(await self.aget_object()).data)
+
+
+class DeploymentTransitionView(generics.GenericAPIView):
+    """Move a deployment to ``target_status`` (COMPLETED, FAILED or CANCELLED).
+
+    Frees the deployment's resources and schedules waiting work; responds
+    409 if the deployment is not in a status the transition starts from.
+    """
+    permission_classes = [IsDeveloper]
+    serializer_class = DeploymentSerializer
+    schema_class = JWTSwaggerAutoSchema
     queryset = Deployment.objects.all()
+    target_status = None
 
+    def post(self, request, *args, **kwargs):
+        deployment = self.get_object()
+        try:
+            lifecycle.finish(deployment, self.target_status)
+        except lifecycle.TransitionError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(deployment).data)
+
+
+class ExportView(generics.GenericAPIView):
+    """Stream clusters, deployments and dependency edges as NDJSON.
+
+    ``?include=`` picks sections (default: all of clusters, deployments,
+    dependencies); deployments take the same filters as the deployment list.
+    Under ASGI the rows are handed over as an async iterator, which Django
+    streams instead of buffering.
+    """
+    permission_classes = [IsAdmin]
+    schema_class = JWTSwaggerAutoSchema
 
-def find_preemptable_deployments(cluster, current_priority):
-    PRIORITY_ORDER = {'HIGH': 3, 'MEDIUM': 2, 'LOW': 1}
-    return Deployment.objects.filter(
-        cluster=cluster,
-        status=Deployment.Status.RUNNING,
-    ).annotate(
-        priority_order=models.Case(
-            *[models.When(priority=p, then=v) for p, v in PRIORITY_ORDER.items()],
-            output_field=models.IntegerField()
-        )
-    ).filter(priority_order__lt=PRIORITY_ORDER[current_priority]).order_by('priority_order')
+    def get(self, request, *args, **kwargs):
+        sections = request.query_params.get('include')
+        sections = [s.strip() for s in sections.split(',')] if sections else list(SECTIONS)
+        invalid = [s for s in sections if s not in SECTIONS]
+        if invalid:
+            raise ValidationError({'include': f"Invalid value(s): {', '.join(invalid)}"})
+        deployments = filter_deployments(Deployment.objects.all(), request.query_params)
+        lines = ndjson(export_records(sections, deployments))
+        if isinstance(request._request, ASGIRequest):
+            lines = aiterate(lines)
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="hypervisor-export.ndjson"'
+        return response
 
 
-@job('default', timeout=3600)
-def process_deployment(deployment_id):
-    deployment = Deployment.objects.get(id=deployment_id)
-    cluster = deployment.cluster
+class EventStreamView(View):
+    """Server-sent events for deployment and cluster status changes.
+
+    ``?deployments=`` and ``?clusters=`` take comma-separated ids; the stream
+    starts with their current state and then follows every change. Without
+    either, admins get every event. Needs an ASGI server: each watcher holds
+    one open connection and shares its process's Redis subscription. Under
+    WSGI Django would buffer the endless stream, so the request is refused.
+    """
+    max_ids = 100
+
+    def ids(self, name):
+        value = self.request.GET.get(name)
+        ids = pk_set(value.split(',')) if value else set()
+        if value and not ids:
+            raise ValidationError({name: "Expected comma-separated ids."})
+        return ids
+
+    def check(self, request):
+        request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        deployment_ids, cluster_ids = self.ids('deployments'), self.ids('clusters')
+        if len(deployment_ids) + len(cluster_ids) > self.max_ids:
+            raise ValidationError({'detail': f"At most {self.max_ids} ids per stream."})
+        if not (deployment_ids or cluster_ids) and not IsAdmin().has_permission(request, self):
+            raise PermissionDenied("Only admins can watch every event; pass deployments or clusters.")
+        return deployment_ids, cluster_ids
+
+    async def get(self, request, *args, **kwargs):
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({'detail': "Status events need an ASGI server."}, status=501)
+        try:
+            deployment_ids, cluster_ids = await sync_to_async(self.check)(request)
+        except APIException as exc:
+            return JsonResponse(
+                exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}, status=exc.status_code
+            )
 
-    print(f"Processing deployment {deployment.id} (priority: {deployment.priority})")
-    print(f"Cluster resources - Total: {cluster.total_ram}GB, Allocated: {cluster.allocated_ram}GB, Available: {cluster.available_ram}GB")
+        async def snapshot():
+            current = [
+                events.deployment_event(deployment)
+                async for deployment in Deployment.objects.filter(id__in=deployment_ids).only(*events.DEPLOYMENT_FIELDS)
+            ]
+            clusters = await sync_to_async(capacity.get_many)(cluster_ids)
+            return current + [events.cluster_event(vars(cluster)) for cluster in clusters.values()]
+
+        keys = [('deployment', pk) for pk in deployment_ids] + [('cluster', pk) for pk in cluster_ids] or [None]
+        response = StreamingHttpResponse(events.stream(keys, snapshot), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
-    def can_allocate(deployment):
-        return (
-            cluster.available_ram >= deployment.required_ram and
-            cluster.available_cpu >= deployment.required_cpu and
-            cluster.available_gpu >= deployment.required_gpu
-        )
 
-    def dependencies_completed(deployment):
-        return all(dep.status == Deployment.Status.COMPLETED for dep in deployment.dependencies.all())
-
-    with transaction.atomic():
-        if not dependencies_completed(deployment):
-            print("Dependencies not completed, re-queuing deployment")
-            deployment.status = Deployment.Status.PENDING
-            deployment.save()
-            get_queue('default').enqueue(process_deployment, deployment.id)
-            return
-        if can_allocate(deployment):
-            print("Direct allocation possible")
-            cluster.allocated_ram += deployment.required_ram
-            cluster.allocated_cpu += deployment.required_cpu
-            cluster.allocated_gpu += deployment.required_gpu
-            cluster.save()
-            deployment.status = Deployment.Status.RUNNING
-            deployment.save()
-            return
-
-        preemptable = find_preemptable_deployments(cluster, deployment.priority)
-        print(f"Found {preemptable.count()} preemptable deployments")
-
-        preempted_deployments = []
-
-        for victim in preemptable:
-            print(f"Preempting deployment {victim.id} (priority: {victim.priority})")
-            victim.release_resources()
-            preempted_deployments.append(victim)
-            print('Cluster after victim release ', cluster)
-
-            if can_allocate(deployment):
-                print("Allocation possible after preemption")
-                cluster.allocated_ram += deployment.required_ram
-                cluster.allocated_cpu += deployment.required_cpu
-                cluster.allocated_gpu += deployment.required_gpu
-                cluster.save()
-                deployment.status = Deployment.Status.RUNNING
-                deployment.save()
-
-                for preempted in preempted_deployments:
-                    get_queue('default').enqueue(process_deployment, preempted.id)
-                return
-
-        print("Insufficient resources, re-queuing deployment")
-        deployment.status = Deployment.Status.PENDING
-        deployment.save()
-        get_queue('default').enqueue(process_deployment, deployment.id)
+class MetricsView(View):
+    """Prometheus scrape endpoint; needs ``Authorization: Bearer <METRICS_TOKEN>``.
 
+    Without a configured token the endpoint does not exist (404) rather than
+    being open.
+    """
 
+    def get(self, request):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if not token:
+            raise Http404
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse(status=401)
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,31 @@
+import random
+
+from django.conf import settings
+from rq import Worker
+
+from . import profiling
+
+
+class WeightedPriorityWorker(Worker):
+    """Worker that drains its queues in weighted random order.
+
+    After every job the queues are reshuffled so that each queue comes first
+    with a probability proportional to its weight in ``RQ_QUEUE_WEIGHTS``.
+    High-priority queues are served almost every time, while low-priority
+    queues still get a share and cannot starve.
+
+    With ``QUERY_PROFILING`` on, the queries of every job are profiled like
+    those of a request (see core.profiling).
+    """
+
+    def reorder_queues(self, reference_queue):
+        weights = getattr(settings, 'RQ_QUEUE_WEIGHTS', {})
+        self._ordered_queues = sorted(
+            self.queues,
+            key=lambda queue: random.random() ** (1 / weights.get(queue.name, 1)),
+            reverse=True,
+        )
+
+    def perform_job(self, job, queue):
+        with profiling.profile(f'job {job.func_name}'):
+            return super().perform_job(job, queue)
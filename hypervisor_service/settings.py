@@ -49,17 +49,85 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.RequestMetricsMiddleware',
+    'core.middleware.QueryProfilingMiddleware',
 ]
 
-RQ_QUEUES = {
-    'default': {
-        'HOST': env('REDIS_HOST', default='localhost'),
-        'PORT': env.int('REDIS_PORT', default=6379),
-        'DB': 0,
-        'DEFAULT_TIMEOUT': 360,
-    }
+RQ_CONNECTION = {
+    'HOST': env('REDIS_HOST', default='localhost'),
+    'PORT': env.int('REDIS_PORT', default=6379),
+    'DB': 0,
+    'DEFAULT_TIMEOUT': 360,
+}
+
+# 'default' carries the scheduler passes; deployments are dispatched to the
+# queue matching their (aged) priority.
+RQ_QUEUES = {name: RQ_CONNECTION for name in ('high', 'default', 'medium', 'low')}
+
+# Relative share of dequeues each queue gets from core.workers.WeightedPriorityWorker.
+RQ_QUEUE_WEIGHTS = {'high': 8, 'default': 8, 'medium': 3, 'low': 1}
+
+RQ = {
+    'WORKER_CLASS': 'core.workers.WeightedPriorityWorker',
 }
 
+# 'event' parks blocked deployments until capacity or dependencies change,
+# 'poll' re-enqueues them immediately.
+SCHEDULER_MODE = env('SCHEDULER_MODE', default='event')
+# Class the scheduler enqueues its jobs through (see core.queues).
+SCHEDULER_QUEUE_BACKEND = 'core.queues.RQBackend'
+# Strategy used to pick a cluster for deployments submitted without one:
+# best_fit, worst_fit, gpu_affinity or drf.
+SCHEDULER_PLACEMENT_STRATEGY = env('SCHEDULER_PLACEMENT_STRATEGY', default='best_fit')
+# A PENDING deployment is promoted one priority level for every interval
+# (in seconds) it has been waiting. 0 disables aging.
+SCHEDULER_AGING_INTERVAL = env.int('SCHEDULER_AGING_INTERVAL', default=300)
+# Poll-mode backoff per blocking reason, in seconds (see core.retry.RetryPolicy).
+SCHEDULER_RETRY_POLICIES = {
+    'dependencies': {'base': 30, 'cap': 900},
+    'resources': {'base': 5, 'cap': 300},
+    'quota': {'base': 15, 'cap': 600},
+}
+
+# Organization quotas are always enforced; FAIR_SHARE additionally orders
+# admissions by dominant resource share and stops a team from preempting a
+# team that holds less than it does (see core.fairshare).
+FAIR_SHARE = env.bool('FAIR_SHARE', default=True)
+FAIR_SHARE_TOTALS_TTL = env.int('FAIR_SHARE_TOTALS_TTL', default=60)
+
+# Cluster capacity snapshots in Redis (see core.capacity); Postgres stays the
+# source of truth and the TTL bounds staleness if a refresh is ever lost.
+CLUSTER_CAPACITY_CACHE = env.bool('CLUSTER_CAPACITY_CACHE', default=True)
+CLUSTER_CAPACITY_TTL = env.int('CLUSTER_CAPACITY_TTL', default=300)
+
+# Largest batch accepted by POST deployments/bulk/.
+DEPLOYMENT_BULK_LIMIT = env.int('DEPLOYMENT_BULK_LIMIT', default=1000)
+
+# Seconds a user's resolved groups and organization roles are cached (see core.roles).
+ROLE_CACHE_TTL = env.int('ROLE_CACHE_TTL', default=300)
+
+# Deployment and cluster status changes published on a Redis pub/sub channel
+# and streamed to clients by GET events/ (see core.events).
+STATUS_EVENTS = env.bool('STATUS_EVENTS', default=True)
+STATUS_EVENTS_CHANNEL = env('STATUS_EVENTS_CHANNEL', default='hypervisor-events')
+STATUS_EVENTS_KEEPALIVE = env.int('STATUS_EVENTS_KEEPALIVE', default=15)
+
+# Scheduler and request metrics, aggregated in Redis across web and worker
+# processes and served to Prometheus by GET /metrics (see core.metrics).
+# /metrics answers 404 until METRICS_TOKEN is set; scrapers then send it as a
+# bearer token.
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# Opt-in per-request and per-job query profiling (see core.profiling): a
+# fingerprint run QUERY_PROFILING_REPEAT_THRESHOLD times is logged as a likely
+# N+1, and a QUERY_PROFILING_SAMPLE_RATE share of profiles is appended to
+# QUERY_PROFILING_TRACE_FILE as JSON lines.
+QUERY_PROFILING = env.bool('QUERY_PROFILING', default=False)
+QUERY_PROFILING_REPEAT_THRESHOLD = env.int('QUERY_PROFILING_REPEAT_THRESHOLD', default=5)
+QUERY_PROFILING_SAMPLE_RATE = env.float('QUERY_PROFILING_SAMPLE_RATE', default=0.01)
+QUERY_PROFILING_TRACE_FILE = env('QUERY_PROFILING_TRACE_FILE', default='')
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -102,16 +170,22 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT', '5432'),
     }
 }
+# Authenticate API requests from the role claims in the access token alone,
+# without loading the user from the database (see core.authentication).
+JWT_STATELESS_AUTH = env.bool('JWT_STATELESS_AUTH', default=False)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-
+        'core.authentication.StatelessRoleAuthentication' if JWT_STATELESS_AUTH
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
 }
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # Refuses refresh tokens revoked by logout.
+    'TOKEN_REFRESH_SERIALIZER': 'core.serializers.TokenRefreshSerializer',
 }
 
 